@@ -0,0 +1,81 @@
+import json
+import random
+import time
+
+import main
+from main import MarkPriceDecoder, RateBook, SymbolIndex
+
+# Micro-benchmark: Binance `!markPrice@arr` decoding.
+# Compares the original per-frame loop from BinanceWebSocketManager._connect against MarkPriceDecoder.
+# Usage: python bench_markprice_decoder.py [symbols] [frames]
+
+INTERVALS = {}
+
+def make_frames(n_symbols=600, n_frames=200, change_ratio=0.3):
+    """Builds a realistic frame sequence: every symbol in every frame, ~30% of mark prices moving."""
+    state = []
+    for i in range(n_symbols):
+        state.append({
+            "e": "markPriceUpdate", "E": 0, "s": f"SYM{i}USDT",
+            "p": f"{random.uniform(0.01, 50000):.8f}", "P": "0.0", "i": "0.0",
+            "r": f"{random.uniform(-0.001, 0.001):.8f}", "T": 1700000000000
+        })
+    frames = []
+    for f in range(n_frames):
+        for item in state:
+            item["E"] = 1700000000000 + f * 1000
+            if random.random() < change_ratio:
+                item["p"] = f"{float(item['p']) * random.uniform(0.999, 1.001):.8f}"
+        frames.append(json.dumps(state))
+    return frames
+
+def legacy_loop(frames):
+    """The loop as it was in BinanceWebSocketManager._connect: json.loads + a fresh dict per symbol."""
+    data = {}
+    for message in frames:
+        items = json.loads(message)
+        if isinstance(items, list):
+            for item in items:
+                symbol = item.get('s', '').replace('USDT', '')
+                if symbol:
+                    data[symbol] = {
+                        'markPrice': float(item.get('p', 0)),
+                        'fundingRate': float(item.get('r', 0)),
+                        'nextFundingTime': int(item.get('T', 0)),
+                        'fundingIntervalHours': INTERVALS.get(symbol, 8)
+                    }
+    return data
+
+def decoder_loop(frames, use_orjson=True):
+    decoder = MarkPriceDecoder(RateBook(SymbolIndex()))
+    if not use_orjson:
+        decoder.loads = json.loads
+    for message in frames:
+        decoder.decode(message, time.time(), INTERVALS)
+    return decoder
+
+def bench(name, fn, frames, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(frames)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    per_frame_us = best / len(frames) * 1e6
+    print(f"{name:<28} {per_frame_us:10.1f} µs/frame")
+    return per_frame_us
+
+if __name__ == "__main__":
+    import sys
+    n_symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    n_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    frames = make_frames(n_symbols, n_frames)
+
+    print(f"Frames: {n_frames} x {n_symbols} symbols ({len(frames[0]) / 1024:.0f} KB each)")
+    print(f"orjson available: {main.orjson is not None}")
+    base = bench("legacy loop (json)", legacy_loop, frames)
+    fast_json = bench("MarkPriceDecoder (json)", lambda f: decoder_loop(f, use_orjson=False), frames)
+    print(f"  speedup: {base / fast_json:.2f}x")
+    if main.orjson is not None:
+        fast_orjson = bench("MarkPriceDecoder (orjson)", decoder_loop, frames)
+        print(f"  speedup: {base / fast_orjson:.2f}x")
@@ -1,20 +1,21 @@
-from fastapi import FastAPI, HTTPException, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Header, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
-from typing import List
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import time
 import hmac
 import hashlib
 import json
-import requests
+import httpx
+import importlib.util
 import asyncio
 from typing import Dict, Any, Optional
 import os
 from dotenv import load_dotenv
 import datetime
-import functools
 import uuid
+import collections
 
 # Load environment variables from .env file
 try:
@@ -138,21 +139,33 @@ load_dotenv()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
-    asyncio.create_task(update_binance_intervals())
-    asyncio.create_task(update_bybit_intervals())
-    
-    # Start Managers (Both Live and Testnet)
-    binance_live_wm.start(is_live=True)
-    binance_test_wm.start(is_live=False)
-    bybit_ws_manager.start(is_live=True)
+    if LOOP_BLOCK_WARN_MS > 0:
+        loop_watchdog.start()
+    asyncio.create_task(instruments.run())
     
+    # Start Market-Data Streams (Binance Live + Bybit) as tasks on this loop; Binance Testnet starts on demand
+    if market_share:
+        # Multi-worker: only the elected owner connects to the exchanges (and trades); others follow its books
+        market_share.on_owner.append(lambda: asyncio.create_task(auto_trade_service()))
+        asyncio.create_task(market_share.run())
+    else:
+        market_hub.start()
+
     # Start services
     asyncio.create_task(broadcast_rates())
-    asyncio.create_task(auto_trade_service())
-    
+    asyncio.create_task(session_channels.run())
+    manager.start() # Reaps dead /ws/clients connections
+    if not market_share:
+        asyncio.create_task(auto_trade_service())
+
     yield
     # Shutdown logic (optional)
     print("Shutting down...")
+    await market_hub.stop()
+    if market_share:
+        market_share.stop()
+    loop_watchdog.stop()
+    await http_pool.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -181,8 +194,187 @@ from cryptography.hazmat.primitives.asymmetric import ed25519
 from urllib.parse import urlparse, urlencode, unquote_plus
 import urllib
 
+# --- SHARED HTTP TRANSPORT ---
+# Connect / read timeouts (s) for exchange REST calls; a call's own timeout= overrides both
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+# Pooled connections per exchange host, and how long an idle one is kept open
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+# HTTP/2 is only used when the optional h2 package is installed (pip install "httpx[http2]")
+HTTP2 = os.getenv("HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+class HTTPPool:
+    """One keep-alive httpx.AsyncClient per exchange host, so REST calls and order legs reuse warm TCP+TLS connections."""
+
+    def __init__(self):
+        self.clients = {} # origin (scheme://host) -> AsyncClient
+        self.loop = None
+        self.requests = collections.Counter() # origin -> requests sent
+
+    def client(self, url):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # Connections belong to the loop that opened them (tests and scripts run their own loops)
+            self.clients = {}
+            self.loop = loop
+        parts = urlparse(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        client = self.clients.get(origin)
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=HTTP2,
+                follow_redirects=True,
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+                )
+            )
+            self.clients[origin] = client
+        self.requests[origin] += 1
+        return client
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return await self.client(url).request(method, url, **kwargs)
 
-import functools
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        clients, self.clients = self.clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def stats(self):
+        return {"http2": HTTP2, "requests": {origin: self.requests[origin] for origin in self.clients}}
+
+http_pool = HTTPPool()
+
+# Seconds a public exchange response is reused, per endpoint; concurrent identical calls always share one request
+PUBLIC_TTL_SECONDS = {
+    "/fapi/v1/premiumIndex": float(os.getenv("PUBLIC_TTL_PREMIUM_INDEX", "1")),
+    "/v5/market/tickers": float(os.getenv("PUBLIC_TTL_BYBIT_TICKERS", "1")),
+    "/fapi/v1/fundingInfo": float(os.getenv("PUBLIC_TTL_FUNDING_INFO", "60")),
+    "/fapi/v1/exchangeInfo": float(os.getenv("PUBLIC_TTL_EXCHANGE_INFO", "60")),
+    "/v5/market/instruments-info": float(os.getenv("PUBLIC_TTL_INSTRUMENTS", "60"))
+}
+
+class SharedResponse:
+    """Parsed result of one public GET, handed to every caller that asked for it (treat json() as read-only)."""
+
+    def __init__(self, status_code, data=None, text=""):
+        self.status_code = status_code
+        self.data = data
+        self.text = text
+
+    def json(self):
+        return self.data
+
+class SingleFlight:
+    """Coalesces identical public GETs: concurrent callers await one in-flight request, and a successful
+    result is reused for its endpoint's TTL. Keeps dashboard bursts from multiplying exchange weight usage.
+    Calls are identical when url, params and every other request argument (headers, timeout) match."""
+
+    def __init__(self, pool, ttls):
+        self.pool = pool
+        self.ttls = ttls
+        self.inflight = {} # key -> Task
+        self.cache = {} # key -> (expires at, SharedResponse)
+        self.fetches = 0
+        self.coalesced = 0
+        self.hits = 0
+
+    async def get(self, url, params=None, **kwargs):
+        options = {name: sorted(value.items()) if isinstance(value, dict) else value for name, value in kwargs.items()}
+        key = (url, tuple(sorted((params or {}).items())), repr(sorted(options.items())))
+        cached = self.cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1]
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, url, params, kwargs))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: a cancelled caller must not cancel the request the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, url, params, kwargs):
+        self.fetches += 1
+        response = await self.pool.get(url, params=params, **kwargs)
+        if response.status_code != 200:
+            # Callers read the exchange's error body (code / msg) when it is JSON
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            return SharedResponse(response.status_code, data, response.text)
+        result = SharedResponse(200, response.json())
+        ttl = self.ttls.get(urlparse(url).path, 0)
+        if ttl > 0:
+            self.cache[key] = (time.monotonic() + ttl, result)
+        return result
+
+    def stats(self):
+        return {"fetches": self.fetches, "coalesced": self.coalesced, "cache_hits": self.hits}
+
+public_api = SingleFlight(http_pool, PUBLIC_TTL_SECONDS)
+
+# --- EVENT LOOP WATCHDOG ---
+# Warn when the event loop is held longer than this (ms) by one callback; 0 disables. Turns on asyncio
+# debug mode, whose "Executing <Handle ...> took X seconds" warning names the offending callback.
+LOOP_BLOCK_WARN_MS = float(os.getenv("LOOP_BLOCK_WARN_MS", "0"))
+
+class LoopWatchdog:
+    """Ticks a short timer and measures how late it fires: lateness past the threshold means the loop was blocked."""
+
+    def __init__(self, threshold_ms=LOOP_BLOCK_WARN_MS, interval=0.05):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.blocks = 0
+        self.max_lag_ms = 0.0
+        self.task = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.threshold
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - due
+            self.max_lag_ms = max(self.max_lag_ms, lag * 1000)
+            if lag > self.threshold:
+                self.blocks += 1
+                print(f"⚠️ Event loop blocked for {lag * 1000:.0f}ms (warn at {self.threshold * 1000:.0f}ms)")
+
+    def stats(self):
+        return {
+            "enabled": self.task is not None,
+            "warn_ms": self.threshold * 1000,
+            "blocks": self.blocks,
+            "max_lag_ms": round(self.max_lag_ms, 1)
+        }
+
+loop_watchdog = LoopWatchdog()
 
 # Bybit Configuration
 BYBIT_API_URL = "https://api.bybit.com/v5/market/tickers"
@@ -190,6 +382,13 @@ BYBIT_API_TESTNET_URL = "https://api-testnet.bybit.com/v5/market/tickers"
 
 BYBIT_WS_LIVE = "wss://stream.bybit.com/v5/public/linear"
 BYBIT_WS_TESTNET = "wss://stream-testnet.bybit.com/v5/public/linear"
+BYBIT_INSTRUMENTS_URL = "https://api.bybit.com/v5/market/instruments-info"
+
+# Ticker subscriptions per Bybit connection, and topics per subscribe request
+BYBIT_WS_SHARD_SIZE = int(os.getenv("BYBIT_WS_SHARD_SIZE", "200"))
+BYBIT_SUBSCRIBE_BATCH = int(os.getenv("BYBIT_SUBSCRIBE_BATCH", "100"))
+# How often the cached instrument list is re-fetched to pick up new listings
+BYBIT_UNIVERSE_REFRESH_SECONDS = int(os.getenv("BYBIT_UNIVERSE_REFRESH_SECONDS", "300"))
 
 # Default Keys from Env or Hardcoded (Fallback)
 # Default Keys from Env or Hardcoded (Fallback)
@@ -197,123 +396,645 @@ DEFAULT_BYBIT_API_KEY = os.getenv("BYBIT_API_KEY", "GS68TldhIYqdRUOz4V")
 DEFAULT_BYBIT_SECRET = os.getenv("BYBIT_SECRET", "b5suxCOFWQsV2IoGDZ2HnNyhxDvt4NQNAReK")
 BYBIT_DEMO_URL = os.getenv("BYBIT_DEMO_URL", "https://api-testnet.bybit.com")
 
-# Cache for Instrument Info (qtyStep, minOrderQty)
-INSTRUMENT_CACHE = {}
-# Cache for Binance symbol info (precision, stepSize)
-BINANCE_SYMBOL_INFO = {}
-# Cache for Binance Funding Intervals
-BINANCE_INTERVAL_CACHE = {}
-# Cache for Bybit Funding Intervals
-BYBIT_INTERVAL_CACHE = {}
-
-async def update_bybit_intervals():
-    """Fetches funding intervals from Bybit API."""
-    global BYBIT_INTERVAL_CACHE
+# --- INSTRUMENT REGISTRY ---
+# How often both venues' instrument lists are re-fetched (new listings, changed filters, delistings)
+INSTRUMENT_REFRESH_SECONDS = float(os.getenv("INSTRUMENT_REFRESH_SECONDS", "3600"))
+# Wait before retrying a failed load
+INSTRUMENT_RETRY_SECONDS = 60
+# Last loaded registry; read at startup so orders have step sizes before the first fetch completes
+INSTRUMENTS_FILE = os.getenv("INSTRUMENTS_FILE", "backend/data/instruments.json")
+
+async def fetch_bybit_instruments():
+    """Every linear instrument from Bybit (all pages of instruments-info). Returns None on failure."""
+    items = []
+    cursor = ""
     try:
-        url = "https://api.bybit.com/v5/market/tickers?category=linear"
-        print(f"DEBUG: Updating Bybit Funding Intervals from {url}...")
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, requests.get, url)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data['retCode'] == 0:
-                count = 0
-                for item in data['result']['list']:
-                    symbol_raw = item.get('symbol', '')
-                    if symbol_raw.endswith('USDT'):
-                        symbol = symbol_raw.replace('USDT', '')
-                        # Bybit uses 'fundingIntervalHour' (singular, in hours)
-                        fih = item.get('fundingIntervalHour', '8')
-                        try:
-                            interval_hours = int(fih) if int(fih) < 24 else int(fih) // 60
-                            BYBIT_INTERVAL_CACHE[symbol] = interval_hours
-                            count += 1
-                        except:
-                            BYBIT_INTERVAL_CACHE[symbol] = 8
-                print(f"✅ Loaded Bybit Intervals for {count} symbols.")
-            else:
-                print(f"⚠️ Bybit API Error: {data['retMsg']}")
-        else:
-            print(f"⚠️ Failed to fetch Bybit Intervals: {response.status_code}")
+        while True:
+            params = {"category": "linear", "limit": 1000}
+            if cursor:
+                params["cursor"] = cursor
+            resp = await http_pool.get(BYBIT_INSTRUMENTS_URL, params=params, timeout=10)
+            if resp.status_code != 200:
+                print(f"Bybit Instruments HTTP Error: {resp.status_code}")
+                return None
+            data = resp.json()
+            if data.get("retCode") != 0:
+                print(f"Bybit Instruments Error (RetCode {data.get('retCode')}): {data.get('retMsg')}")
+                return None
+            items.extend(data["result"]["list"])
+            cursor = data["result"].get("nextPageCursor")
+            if not cursor:
+                break
     except Exception as e:
-        print(f"❌ Error updating Bybit Intervals: {e}")
+        print(f"Bybit Instruments Fetch Error: {e}")
+        return None
+    return items
 
-async def update_binance_intervals():
-    """Fetches funding intervals from Binance API."""
-    global BINANCE_INTERVAL_CACHE, BINANCE_SYMBOL_INFO
-    try:
-        # 1. Update Intervals
-        itv_url = "https://fapi.binance.com/fapi/v1/fundingInfo"
-        print(f"DEBUG: Updating Binance Funding Intervals...")
-        itv_res = await asyncio.to_thread(requests.get, itv_url, timeout=10)
-        if itv_res.status_code == 200:
-            data = itv_res.json()
-            for item in data:
-                s = item.get('symbol', '').replace('USDT', '')
-                if 'fundingIntervalHours' in item:
-                    BINANCE_INTERVAL_CACHE[s] = int(item['fundingIntervalHours'])
-            print(f"✅ Loaded Binance Intervals for {len(BINANCE_INTERVAL_CACHE)} symbols.")
-
-        # 2. Update Exchange Info (Precision)
-        info_url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
-        print(f"DEBUG: Updating Binance Exchange Info (Precision)...")
-        info_res = await asyncio.to_thread(requests.get, info_url, timeout=10)
-        if info_res.status_code == 200:
-            info_data = info_res.json()
-            for s in info_data.get("symbols", []):
-                sym = s["symbol"].replace("USDT","")
-                BINANCE_SYMBOL_INFO[sym] = {
-                    "quantityPrecision": s.get("quantityPrecision", 2),
-                    "stepSize": 0.001 # Default
-                }
-                for f in s.get("filters", []):
-                    if f["filterType"] == "LOT_SIZE":
-                        BINANCE_SYMBOL_INFO[sym]["stepSize"] = float(f["stepSize"])
-            print(f"✅ Loaded Binance Symbol Info for {len(BINANCE_SYMBOL_INFO)} symbols.")
-    except Exception as e:
-        print(f"❌ Error updating Binance data: {e}")
+def step_decimals(step):
+    """Decimal places of a step/tick size string ("0.010" -> 2)."""
+    return len(step.split(".")[1].rstrip("0")) if "." in step else 0
+
+def bybit_instrument(item):
+    lot = item.get("lotSizeFilter", {})
+    return {
+        "stepSize": float(lot.get("qtyStep", 0.001)),
+        "minQty": float(lot.get("minOrderQty", 0.001)),
+        "maxQty": float(lot.get("maxOrderQty", 0)) or None,
+        "tickSize": float(item.get("priceFilter", {}).get("tickSize", 0)),
+        "maxLeverage": float(item.get("leverageFilter", {}).get("maxLeverage", 0)) or None,
+        "fundingIntervalHours": int(item.get("fundingInterval") or 480) // 60, # minutes
+        "status": item.get("status", "Trading").upper(),
+        "quantityPrecision": step_decimals(lot.get("qtyStep", "0.001"))
+    }
+
+def binance_instrument(item, interval_hours):
+    filters = {f["filterType"]: f for f in item.get("filters", [])}
+    lot = filters.get("LOT_SIZE", {})
+    return {
+        "stepSize": float(lot.get("stepSize", 0.001)),
+        "minQty": float(lot.get("minQty", 0)),
+        "maxQty": float(lot.get("maxQty", 0)) or None,
+        "tickSize": float(filters.get("PRICE_FILTER", {}).get("tickSize", 0)),
+        "maxLeverage": None, # Only the signed /fapi/v1/leverageBracket has it
+        "fundingIntervalHours": interval_hours,
+        "status": item.get("status", "TRADING").upper(),
+        "quantityPrecision": item.get("quantityPrecision", 2)
+    }
+
+class InstrumentRegistry:
+    """
+    Trading rules for every USDT perpetual on both venues, keyed by base symbol (BTCUSDT -> BTC):
+    { stepSize, minQty, maxQty, tickSize, maxLeverage, fundingIntervalHours, status, quantityPrecision }.
+    Bulk-loaded from the public endpoints, refreshed on a schedule and saved to disk for warm restarts.
+    Lookups on the order path are plain dict reads.
+    """
+    VENUES = ("binance", "bybit")
+
+    def __init__(self, path=INSTRUMENTS_FILE):
+        self.path = path
+        self.venues = {venue: {} for venue in self.VENUES}
+        self.intervals = {venue: {} for venue in self.VENUES} # symbol -> funding hours, read by the stream decoders
+        self.loaded_at = {venue: 0.0 for venue in self.VENUES}
+        self.version = 0 # Bumped on every change, so readers of `intervals` can tell when to re-apply them
+
+    def get(self, venue, symbol):
+        return self.venues[venue].get(symbol)
+
+    def replace(self, venue, table, ts=None):
+        """Swaps in a venue's complete instrument list. The dicts are updated in place, so held references stay live."""
+        self.venues[venue].clear()
+        self.venues[venue].update(table)
+        self.intervals[venue].clear()
+        self.intervals[venue].update({symbol: info["fundingIntervalHours"] for symbol, info in table.items()})
+        self.loaded_at[venue] = time.time() if ts is None else ts
+        self.version += 1
+
+    def add(self, venue, symbol, info):
+        """Single-symbol insert for a listing newer than the last bulk load."""
+        self.venues[venue][symbol] = info
+        self.intervals[venue][symbol] = info["fundingIntervalHours"]
+        self.version += 1
+
+    async def load_binance(self):
+        info_res, funding_res = await asyncio.gather(
+            public_api.get("https://fapi.binance.com/fapi/v1/exchangeInfo", timeout=10),
+            public_api.get("https://fapi.binance.com/fapi/v1/fundingInfo", timeout=10)
+        )
+        if info_res.status_code != 200:
+            raise RuntimeError(f"exchangeInfo returned {info_res.status_code}")
+        # fundingInfo only lists symbols whose interval differs from the default 8h
+        hours = {}
+        if funding_res.status_code == 200:
+            hours = {item["symbol"]: int(item["fundingIntervalHours"]) for item in funding_res.json() if "fundingIntervalHours" in item}
+        self.replace("binance", {
+            item["symbol"][:-4]: binance_instrument(item, hours.get(item["symbol"], 8))
+            for item in info_res.json().get("symbols", []) if item["symbol"].endswith("USDT")
+        })
+
+    async def load_bybit(self):
+        items = await fetch_bybit_instruments()
+        if items is None:
+            raise RuntimeError("instruments-info failed")
+        self.replace("bybit", {item["symbol"][:-4]: bybit_instrument(item) for item in items if item["symbol"].endswith("USDT")})
+
+    async def refresh(self):
+        """Reloads both venues; a venue that fails keeps its previous list."""
+        results = await asyncio.gather(self.load_binance(), self.load_bybit(), return_exceptions=True)
+        for venue, result in zip(self.VENUES, results):
+            if isinstance(result, Exception):
+                print(f"❌ Error loading {venue} instruments: {result}")
+            else:
+                print(f"✅ Loaded {len(self.venues[venue])} {venue} instruments.")
+        if not all(isinstance(result, Exception) for result in results):
+            await asyncio.to_thread(self.save)
+
+    def load(self):
+        """Warm start from the last saved registry. Returns False if there is none."""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable {self.path}: {e}")
+            return False
+        for venue in self.VENUES:
+            if data.get(venue):
+                self.replace(venue, data[venue]["instruments"], data[venue]["loaded_at"])
+        print(f"📦 Loaded instruments from {self.path} ({', '.join(f'{v}: {len(self.venues[v])}' for v in self.VENUES)})")
+        return True
+
+    def save(self):
+        data = {venue: {"loaded_at": self.loaded_at[venue], "instruments": self.venues[venue]} for venue in self.VENUES}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path) # Other workers may read it at any time
+
+    async def run(self):
+        self.load()
+        while True:
+            age = time.time() - min(self.loaded_at.values())
+            if age >= INSTRUMENT_REFRESH_SECONDS:
+                await self.refresh()
+                age = time.time() - min(self.loaded_at.values())
+            await asyncio.sleep(max(INSTRUMENT_RETRY_SECONDS, INSTRUMENT_REFRESH_SECONDS - age))
+
+    def stats(self):
+        now = time.time()
+        return {venue: {"symbols": len(self.venues[venue]), "age_seconds": round(now - self.loaded_at[venue])} for venue in self.VENUES}
+
+instruments = InstrumentRegistry()
+
+# --- CLIENT FAN-OUT ---
+# Unsent non-snapshot messages (logs, errors, pongs) a client may have queued before it is evicted
+CLIENT_QUEUE_SIZE = int(os.getenv("CLIENT_QUEUE_SIZE", "64"))
+# A client with data waiting for longer than this is too slow and gets disconnected
+CLIENT_MAX_LAG_SECONDS = float(os.getenv("CLIENT_MAX_LAG_SECONDS", "10"))
+# zlib level for clients that opt into encoding=deflate (frames are compressed once, not per client)
+BROADCAST_DEFLATE_LEVEL = int(os.getenv("BROADCAST_DEFLATE_LEVEL", "6"))
+# Rates are pushed on change: a change waits this long for the rest of its burst before going out...
+BROADCAST_COALESCE_MS = float(os.getenv("BROADCAST_COALESCE_MS", "150"))
+# ...ticks never run more often than this...
+BROADCAST_MAX_HZ = float(os.getenv("BROADCAST_MAX_HZ", "4"))
+# ...and with no change at all the broadcaster still re-checks views (top-N rankings, stale quotes) this often
+BROADCAST_IDLE_SECONDS = float(os.getenv("BROADCAST_IDLE_SECONDS", "5"))
+# A client silent for this long is sent {"op": "ping"}; if it stays silent for as long again it is reaped
+CLIENT_IDLE_TIMEOUT = float(os.getenv("CLIENT_IDLE_TIMEOUT", "45"))
+CLIENT_REAP_INTERVAL = float(os.getenv("CLIENT_REAP_INTERVAL", "10"))
+# Session channels: how often session state is diffed for changes, and how often subscribed positions are fetched
+SESSION_PUSH_SECONDS = float(os.getenv("SESSION_PUSH_SECONDS", "0.5"))
+POSITIONS_POLL_SECONDS = float(os.getenv("POSITIONS_POLL_SECONDS", "5"))
+
+class ClientView:
+    """
+    What a client subscribed to: one environment, a venue set, and optionally a symbol watchlist and/or
+    the top N symbols by cross-venue rate spread. Equal views share one serialized message per tick.
+    """
+    VENUES = ("binance", "bybit")
+
+    def __init__(self, env="live", venues=None, symbols=None, top_n=None):
+        self.env = "testnet" if env == "testnet" else "live"
+        self.venues = tuple(v for v in self.VENUES if not venues or v in venues)
+        self.symbols = frozenset(s.upper().replace("USDT", "") for s in symbols) if symbols else None
+        self.top_n = int(top_n) if top_n else None
+        self.key = (self.env, self.venues, self.symbols, self.top_n)
+
+    @classmethod
+    def from_request(cls, is_live=None, venues=None, symbols=None, top_n=None):
+        """Builds a view from op / query fields (lists or comma-separated strings). None if nothing was given."""
+        if is_live is None and not venues and not symbols and not top_n:
+            return None
+        if isinstance(venues, str):
+            venues = [v.strip().lower() for v in venues.split(",") if v.strip()]
+        if isinstance(symbols, str):
+            symbols = [s.strip() for s in symbols.split(",") if s.strip()]
+        return cls("testnet" if is_live is False else "live", venues, symbols, top_n)
+
+    def __eq__(self, other):
+        return isinstance(other, ClientView) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def streams(self):
+        """{ venue -> hub stream name } for this view's venues."""
+        names = {"binance": "binance_live" if self.env == "live" else "binance_testnet", "bybit": "bybit"}
+        return {venue: names[venue] for venue in self.venues}
+
+    def members(self, rankings):
+        """Symbols in view this tick (None = all). `rankings` maps env -> symbols sorted by spread."""
+        if self.top_n is None:
+            return self.symbols
+        ranked = rankings[self.env]
+        if self.symbols:
+            ranked = [s for s in ranked if s in self.symbols]
+        return set(ranked[:self.top_n])
+
+    def select(self, books, members):
+        """Restricts { stream name -> payload } to this view's streams and symbols."""
+        out = {}
+        for name in self.streams().values():
+            if name in books:
+                book = books[name]
+                out[name] = book if members is None else {s: info for s, info in book.items() if s in members}
+        return out
+
+    def describe(self):
+        return {"env": self.env, "venues": list(self.venues), "symbols": sorted(self.symbols) if self.symbols else None, "top_n": self.top_n}
+
+def dump_bytes(payload):
+    """JSON-encodes straight to UTF-8 bytes (orjson when installed)."""
+    if orjson:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode()
+
+class BroadcastFrame:
+    """
+    One message serialized once and shared by every client that receives it.
+    Holds the UTF-8 JSON bytes; the str, deflated and MessagePack forms are derived lazily, at most once per frame.
+    """
+    __slots__ = ("payload", "data", "_text", "_deflated", "_packed")
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.data = dump_bytes(payload)
+        self._text = None
+        self._deflated = None
+        self._packed = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.data.decode()
+        return self._text
+
+    @property
+    def deflated(self):
+        if self._deflated is None:
+            self._deflated = zlib.compress(self.data, BROADCAST_DEFLATE_LEVEL)
+        return self._deflated
+
+    @property
+    def packed(self):
+        if self._packed is None:
+            self._packed = msgpack.packb(self.payload)
+        return self._packed
+
+    def encode(self, encoding):
+        """
+        (bytes, None) or (None, str) for a client's encoding: "text", "binary" (UTF-8 JSON),
+        "deflate" (zlib) or "msgpack".
+        """
+        if encoding == "binary":
+            return self.data, None
+        if encoding == "deflate":
+            return self.deflated, None
+        if encoding == "msgpack":
+            return self.packed, None
+        return None, self.text
+
+# Optional MessagePack encoding for binary clients
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CLIENT_ENCODINGS = ("text", "binary", "deflate") + (("msgpack",) if msgpack else ())
+# "full" = whole books every tick; "delta" = snapshot once, then changed fields (DeltaEncoder);
+# "compact" = delta with positional rows keyed by symbol id (CompactEncoder); "none" = no rates (channel-only sockets)
+CLIENT_PROTOCOLS = ("full", "delta", "compact", "none")
+
+class ClientConnection:
+    """
+    One browser connection with its own outbound queue and writer task, so a slow client never delays the others.
+    Rate snapshots are coalesced: an unsent snapshot is replaced by the newer one instead of queueing behind it.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.is_live = None # Announced by the client's "init" op
+        self.protocol = "full" # One of CLIENT_PROTOCOLS
+        self.needs_snapshot = True # Client still waiting for a full message (delta: must (re)start from a snapshot)
+        self.view = None # ClientView; None = every environment, venue and symbol
+        self.encoding = "text" # How BroadcastFrames are sent: "text", "binary" or "deflate" (see BroadcastFrame.encode)
+        self.opportunities = None # (top_n, sort) when subscribed to the ranked opportunities channel
+        self.opportunities_pending = False # Subscribed but not sent the current ranking yet
+        self.session_id = None # UserSession.user_id once the client sent {"op": "auth"}
+        self.channels = set() # SessionChannels subscriptions: "session", "scheduler", "positions"
+        self.channels_pending = set() # Channels whose full state has not been sent yet
+        self.positions_symbol = None
+        self.events = collections.deque() # Messages that must all be delivered, in order
+        self.snapshot = None # Latest unsent rates snapshot
+        self.wake = asyncio.Event()
+        self.task = None
+        self.closed = False
+        self.connected_at = time.time()
+        self.last_seen = self.connected_at # Last message received from the client (its pings count)
+        self.probed_at = None # When the reaper sent it a ping that is still unanswered
+        self.pending_since = None # When the oldest unsent message was queued
+        self.sent = 0
+        self.coalesced = 0 # Snapshots replaced before they were sent
+        self.send_latency_ms = 0.0 # Moving average
+        self.max_send_latency_ms = 0.0
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    def send(self, message, coalesce: bool = False):
+        """Queues a message without waiting. Returns False if the client is closed or its queue is full."""
+        if self.closed:
+            return False
+        if coalesce:
+            if self.snapshot is not None:
+                self.coalesced += 1
+            self.snapshot = message
+        else:
+            if len(self.events) >= CLIENT_QUEUE_SIZE:
+                return False
+            self.events.append(message)
+        if self.pending_since is None:
+            self.pending_since = time.time()
+        self.wake.set()
+        return True
+
+    def reset_to(self, message):
+        """Replaces everything still queued with one message (a delta client's resync snapshot)."""
+        self.events.clear()
+        self.snapshot = None
+        self.pending_since = None
+        self.needs_snapshot = False
+        return self.send(message)
+
+    def depth(self):
+        return len(self.events) + (self.snapshot is not None)
+
+    def lag(self, now):
+        return now - self.pending_since if self.pending_since is not None else 0.0
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                await self.wake.wait()
+                self.wake.clear()
+                while self.events or self.snapshot is not None:
+                    if self.events:
+                        message = self.events.popleft()
+                    else:
+                        message, self.snapshot = self.snapshot, None
+                    t0 = time.perf_counter()
+                    if isinstance(message, BroadcastFrame):
+                        data, text = message.encode(self.encoding)
+                        if data is not None:
+                            await self.websocket.send_bytes(data)
+                        else:
+                            await self.websocket.send_text(text)
+                    else:
+                        await self.websocket.send_text(message)
+                    latency = (time.perf_counter() - t0) * 1000
+                    self.send_latency_ms = latency if not self.sent else self.send_latency_ms * 0.9 + latency * 0.1
+                    self.max_send_latency_ms = max(self.max_send_latency_ms, latency)
+                    self.sent += 1
+                    self.pending_since = time.time() if self.depth() else None
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Socket is gone: stop accepting messages; the endpoint / next broadcast removes us
+            self.closed = True
+
+    async def close(self, code=1000):
+        self.closed = True
+        if self.task:
+            self.task.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=5)
+        except Exception:
+            pass
 
-# --- CLIENT WEBSOCKET MANAGER ---
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.connected = 0
+        self.evicted = 0
+        self.disconnected = 0
+        self.reaped = 0
+        self.evictions = collections.Counter() # reason -> count
+        self.pending = asyncio.Event() # A client needs a full message: wakes the RateBroadcaster
+        self.reaper_task = None
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = ClientConnection(websocket)
+        self.clients[websocket] = client
+        client.start()
+        self.connected += 1
+        self.pending.set()
+        return client
+
+    def heard_from(self, client: ClientConnection):
+        """Any message from the client proves the connection is alive."""
+        client.last_seen = time.time()
+        client.probed_at = None
+
+    def request_snapshot(self, client: ClientConnection):
+        client.needs_snapshot = True
+        self.pending.set()
+
+    def set_opportunities(self, client: ClientConnection, top_n, sort=None):
+        """Subscribes a client to the top `top_n` opportunities by `sort` (top_n 0 / None unsubscribes)."""
+        client.opportunities = (int(top_n), sort if sort in OPPORTUNITY_SORTS else "rate_diff") if top_n else None
+        client.opportunities_pending = client.opportunities is not None
+        self.pending.set()
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        client = self.clients.pop(websocket, None)
+        if client:
+            client.closed = True
+            if client.task:
+                client.task.cancel()
+            self.disconnected += 1
+
+    def evict(self, client: ClientConnection, reason: str, detail: str = None):
+        """Drops a client that cannot keep up (or whose socket died) and closes its socket in the background."""
+        if self.clients.pop(client.websocket, None) is None:
+            return
+        self.evicted += 1
+        self.evictions[reason] += 1
+        print(f"WS: Evicting client ({detail or reason}).")
+        asyncio.create_task(client.close(code=1013)) # 1013 = Try Again Later
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
+    def reap(self, now=None):
+        """
+        Heartbeat check: pings clients silent for CLIENT_IDLE_TIMEOUT and drops those that stay silent as long again.
+        Catches half-open connections (sleeping laptops, dropped networks) that never raise in receive_text.
+        """
+        now = time.time() if now is None else now
+        for client in list(self.clients.values()):
+            if client.closed:
+                self.evict(client, "socket closed")
+            elif client.probed_at is not None:
+                if now - client.probed_at > CLIENT_IDLE_TIMEOUT:
+                    if self.clients.pop(client.websocket, None) is not None:
+                        self.reaped += 1
+                        print(f"WS: Reaping client silent for {now - client.last_seen:.0f}s.")
+                        asyncio.create_task(client.close(code=1001)) # 1001 = Going Away
+            elif now - client.last_seen > CLIENT_IDLE_TIMEOUT:
+                client.probed_at = now
+                client.send(json.dumps({"op": "ping"}))
+
+    async def reaper(self):
+        while True:
+            await asyncio.sleep(CLIENT_REAP_INTERVAL)
             try:
-                await connection.send_text(message)
+                self.reap()
             except Exception as e:
-                # Handle disconnection or send error gracefully
-                pass
+                print(f"WS Reaper Error: {e}")
+
+    def start(self):
+        if self.reaper_task is None:
+            self.reaper_task = asyncio.create_task(self.reaper())
+
+    def set_mode(self, websocket: WebSocket, is_live: bool):
+        client = self.clients.get(websocket)
+        if client:
+            client.is_live = is_live
+
+    def set_view(self, websocket: WebSocket, view):
+        client = self.clients.get(websocket)
+        if client and client.view != view:
+            client.view = view
+            self.request_snapshot(client) # Clients restart on the new view's message / stream
+
+    def wants_testnet(self):
+        return any(client.is_live is False for client in self.clients.values())
+
+    def _fan_out(self, message, coalesce: bool, clients=None):
+        now = time.time()
+        for client in list(self.clients.values()) if clients is None else clients:
+            if client.closed:
+                self.evict(client, "socket closed")
+            elif not client.send(message, coalesce):
+                self.evict(client, "queue full")
+            elif client.lag(now) > CLIENT_MAX_LAG_SECONDS:
+                self.evict(client, "lagging", f"{client.lag(now):.0f}s behind")
+
+    async def broadcast(self, message: str):
+        """Queues a message for every client; returns without waiting for any socket."""
+        self._fan_out(message, coalesce=False)
+
+    def send_to(self, message, clients):
+        """Queues a message for some clients, in order with everything else they are sent."""
+        self._fan_out(message, coalesce=False, clients=clients)
+
+    def broadcast_snapshot(self, message, clients=None):
+        """Queues a rates snapshot; a client still sending the previous one only gets the latest."""
+        self._fan_out(message, coalesce=True, clients=clients)
+
+    def broadcast_delta(self, message, clients):
+        """Queues a delta for delta clients. A client whose queue overflows is resynced from a snapshot instead."""
+        now = time.time()
+        for client in clients:
+            if client.closed:
+                self.evict(client, "socket closed")
+            elif client.lag(now) > CLIENT_MAX_LAG_SECONDS:
+                self.evict(client, "lagging", f"{client.lag(now):.0f}s behind")
+            elif not client.send(message):
+                self.request_snapshot(client)
+
+    def stats(self):
+        now = time.time()
+        clients = list(self.clients.values())
+        return {
+            "connected": len(clients),
+            "queue_depth_total": sum(c.depth() for c in clients),
+            "queue_depth_max": max((c.depth() for c in clients), default=0),
+            "max_lag_seconds": round(max((c.lag(now) for c in clients), default=0.0), 3),
+            "send_latency_ms_avg": round(sum(c.send_latency_ms for c in clients) / len(clients), 3) if clients else 0.0,
+            "send_latency_ms_max": round(max((c.max_send_latency_ms for c in clients), default=0.0), 3),
+            "snapshots_coalesced": sum(c.coalesced for c in clients),
+            "views": len({(c.protocol, c.view) for c in clients}),
+            "protocols": dict(collections.Counter(c.protocol for c in clients)),
+            "opportunity_subscribers": sum(1 for c in clients if c.opportunities),
+            "session_channels": dict(collections.Counter(ch for c in clients for ch in c.channels)),
+            "encodings": dict(collections.Counter(c.encoding for c in clients)),
+            "oldest_silence_seconds": round(max((now - c.last_seen for c in clients), default=0.0), 3),
+            "probed": sum(1 for c in clients if c.probed_at is not None),
+            # Churn since startup
+            "connected_total": self.connected,
+            "evicted": self.evicted,
+            "evictions": dict(self.evictions),
+            "reaped": self.reaped,
+            "disconnected": self.disconnected
+        }
 
 manager = ConnectionManager()
 
 @app.websocket("/ws/clients")
-async def websocket_endpoint(websocket: WebSocket, is_live: bool = False):
-    print(f"WS: Connection attempt received. is_live={is_live}")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    is_live: Optional[bool] = None,
+    protocol: Optional[str] = None,
+    venues: Optional[str] = None, # e.g. "binance,bybit"
+    symbols: Optional[str] = None, # e.g. "BTC,ETH"
+    top_n: Optional[int] = None,
+    encoding: Optional[str] = None, # "text" (default), "binary" or "deflate"
+    opportunities: Optional[int] = None # Top N of the ranked opportunities channel
+):
+    print(f"WS: Connection attempt received. is_live={is_live} protocol={protocol}")
     try:
-        await manager.connect(websocket)
+        client = await manager.connect(websocket)
         print("WS: Connection accepted and added to manager.")
+        if protocol in CLIENT_PROTOCOLS and protocol != "full":
+            client.protocol = protocol
+            manager.request_snapshot(client)
+        manager.set_view(websocket, ClientView.from_request(is_live, venues, symbols, top_n))
+        if encoding in CLIENT_ENCODINGS:
+            client.encoding = encoding
+        if opportunities:
+            manager.set_opportunities(client, opportunities)
+        if is_live is not None:
+            manager.set_mode(websocket, is_live)
+            if not is_live: market_hub.touch("binance_testnet")
         while True:
             # Keep connection alive, listen for ping/commands
             data = await websocket.receive_text()
+            manager.heard_from(client)
             try:
                 # Parse message
                 msg = json.loads(data)
-                if msg.get("op") == "ping":
-                    # Respond with pong
-                    await websocket.send_text(json.dumps({"op": "pong"}))
-                elif msg.get("op") == "init":
-                     # Client just informing of its local mode, no server toggle needed.
-                     pass
+                if msg.get("op") == "pong":
+                    pass # Answer to a reaper ping; heard_from() already recorded it
+                elif msg.get("op") == "ping":
+                    # Respond with pong (through the client's queue, never racing its writer)
+                    client.send(json.dumps({"op": "pong"}))
+                elif msg.get("op") in ("init", "subscribe"):
+                     # Client announcing its mode / view: it only receives that environment (and venues / symbols)
+                     is_live = bool(msg.get("is_live", msg.get("env", "live") != "testnet"))
+                     manager.set_mode(websocket, is_live)
+                     if not is_live: market_hub.touch("binance_testnet")
+                     if msg.get("protocol") in CLIENT_PROTOCOLS and msg["protocol"] != client.protocol:
+                         client.protocol = msg["protocol"]
+                         manager.request_snapshot(client)
+                     manager.set_view(websocket, ClientView.from_request(is_live, msg.get("venues"), msg.get("symbols"), msg.get("top_n")))
+                     if msg.get("encoding") in CLIENT_ENCODINGS:
+                         client.encoding = msg["encoding"]
+                elif msg.get("op") == "opportunities":
+                    # Ranked opportunities channel: {"op": "opportunities", "top_n": 20, "sort": "annualized_yield"}
+                    manager.set_opportunities(client, msg.get("top_n"), msg.get("sort"))
+                elif msg.get("op") == "auth":
+                    # Same keys as the X-User-* headers of the REST API; binds this socket to their session
+                    session = get_current_session(msg.get("bybit_key"), msg.get("bybit_secret"), msg.get("binance_key"), msg.get("binance_secret"))
+                    client.session_id = session.user_id if session else None
+                    client.send(json.dumps({"op": "auth", "status": "ok" if session else "error"}))
+                elif msg.get("op") == "channel":
+                    # {"op": "channel", "channel": "session" | "scheduler" | "positions", "symbol": "BTC", "on": true}
+                    error = session_channels.subscribe(client, msg.get("channel"), msg.get("symbol"), msg.get("on", True))
+                    if error:
+                        client.send(json.dumps({"op": "channel", "channel": msg.get("channel"), "status": "error", "message": error}))
+                elif msg.get("op") == "resync":
+                    # Delta client saw a seq gap: send it a full snapshot on the next tick
+                    manager.request_snapshot(client)
             except json.JSONDecodeError:
                 pass # Ignore non-JSON (if any)
             except Exception as e:
@@ -326,49 +1047,320 @@ async def websocket_endpoint(websocket: WebSocket, is_live: bool = False):
         print(f"WS: Error in endpoint: {e}")
         manager.disconnect(websocket)
 
+# Per-symbol fields in rate payloads, in RateBook column order
+RATE_FIELDS = ("rate", "markPrice", "nextFundingTime", "fundingIntervalHours")
+
+class DeltaEncoder:
+    """
+    Builds the protocol=delta stream: {"op": "snapshot"} with every active book keyed once by stream name,
+    then {"op": "delta"} messages with only the symbols and fields that changed. Each carries a seq number;
+    a delta is seq + 1 of the message before it, so clients can detect gaps and send {"op": "resync"}.
+    With a ClientView, only the view's streams and symbols are sent; symbols leaving a top-N / watchlist
+    view are listed under "removed".
+    """
+
+    def __init__(self, hub, view=None):
+        self.hub = hub
+        self.view = view
+        self.seq = 0
+        self.cursors = {} # hub.changed_since cursors as of the last message
+        self.sent = {} # name -> { symbol -> [rate, markPrice, nextFundingTime, fundingIntervalHours] } as clients know it
+        self.cached = None # (seq, snapshot message) for clients joining between deltas
+
+    def snapshot(self, members=None):
+        """Full snapshot message for the current seq (built at most once per seq)."""
+        if self.cached and self.cached[0] == self.seq:
+            return self.cached[1]
+        books = self.hub.snapshot()
+        if self.view is not None:
+            books = self.view.select(books, members)
+        self.sent = {name: {sym: [info[f] for f in RATE_FIELDS] for sym, info in book.items()} for name, book in books.items()}
+        self.cursors = self.hub.versions()
+        message = BroadcastFrame(self.shape({"op": "snapshot", "seq": self.seq, "books": books, "timestamp": time.time() * 1000}))
+        self.cached = (self.seq, message)
+        return message
+
+    def step(self, members=None):
+        """
+        Advances one tick. Returns ("delta", message), ("snapshot", message) when every client must restart
+        (a book was cleared or a stream started/stopped), or (None, None) if nothing changed.
+        `members` is the view's symbol set for this tick (None = all).
+        """
+        changes, cursors = self.hub.changed_since(self.cursors)
+        names = set(changes) if self.view is None else {n for n in self.view.streams().values() if n in changes}
+        if set(self.sent) != names or any(changes[name] is None for name in names):
+            self.seq += 1
+            self.cached = None
+            return "snapshot", self.snapshot(members)
+
+        books, removed = {}, {}
+        for name in names:
+            book = self.hub.get(name).book
+            sent = self.sent[name]
+            symbols = changes[name]
+            if members is not None:
+                symbols = [sym for sym in symbols if sym in members]
+                # Newly in view: send the full record even though it did not change
+                fresh = set(symbols)
+                symbols += [sym for sym in members if sym not in sent and sym not in fresh and sym in book]
+                gone = [sym for sym in sent if sym not in members]
+                for sym in gone:
+                    del sent[sym]
+                if gone:
+                    removed[name] = gone
+            if not symbols:
+                continue
+            rows = [book.index.ids[sym] for sym in symbols]
+            columns = (book.funding_rate[rows].tolist(), book.mark_price[rows].tolist(),
+                       book.next_funding_time[rows].tolist(), book.interval_hours[rows].tolist())
+            out = {}
+            for sym, values in zip(symbols, zip(*columns)):
+                prev = sent.get(sym)
+                if prev is None:
+                    out[sym] = dict(zip(RATE_FIELDS, values))
+                    sent[sym] = list(values)
+                    continue
+                diff = {}
+                for i, value in enumerate(values):
+                    if prev[i] != value:
+                        diff[RATE_FIELDS[i]] = value
+                        prev[i] = value
+                if diff:
+                    out[sym] = diff
+            if out:
+                books[name] = out
+        self.cursors = cursors
+        if not books and not removed:
+            return None, None
+        self.seq += 1
+        message = {"op": "delta", "seq": self.seq, "books": books, "timestamp": time.time() * 1000}
+        if removed:
+            message["removed"] = removed
+        return "delta", BroadcastFrame(self.shape(message))
+
+    def shape(self, message):
+        """Final wire form of a snapshot / delta message (subclasses change the book encoding)."""
+        return message
+
+class CompactEncoder(DeltaEncoder):
+    """
+    protocol=compact: the delta stream with positional rows instead of repeated key names.
+    Symbols are sent as ids into a symbol table that the snapshot carries in full ("symbols") and deltas extend:
+    a delta's "symbols" are the table entries starting at index "symbols_from". A row is
+    [id, rate, markPrice, nextFundingTime, fundingIntervalHours]; in deltas an unchanged field is null.
+    "removed" lists ids.
+    """
+
+    def __init__(self, hub, view=None, index=None):
+        super().__init__(hub, view)
+        self.index = index or SYMBOLS
+        self.known = 0 # Table length every client on the delta chain has
+        self.snapshot_known = 0 # Table length in the last snapshot built
+
+    def step(self, members=None):
+        kind, message = super().step(members)
+        if kind == "snapshot":
+            self.known = self.snapshot_known # Every client restarts from this snapshot's table
+        return kind, message
+
+    def shape(self, message):
+        ids = self.index.ids
+        symbols = self.index.symbols
+        if message["op"] == "snapshot":
+            # A late joiner's snapshot must not move the delta chain's cursor: clients already connected
+            # still need the entries interned since their last delta
+            message["fields"] = RATE_FIELDS
+            message["symbols"] = symbols[:]
+            self.snapshot_known = len(message["symbols"])
+        else:
+            # The table only grows, so everything interned since the last delta is the extension. A client that
+            # joined on a later snapshot already has some of it; entries never change, so it just rewrites them.
+            message["symbols_from"] = self.known
+            message["symbols"] = symbols[self.known:]
+            self.known = len(symbols)
+        message["books"] = {
+            name: [[ids[sym]] + [info.get(f) for f in RATE_FIELDS] for sym, info in book.items()]
+            for name, book in message["books"].items()
+        }
+        if "removed" in message:
+            message["removed"] = {name: [ids[sym] for sym in syms] for name, syms in message["removed"].items()}
+        return message
+
+def view_message(view, books, members):
+    """protocol=full message for a ClientView: the legacy payload shape, with only the subscribed environment."""
+    selected = view.select(books, members)
+    return BroadcastFrame({
+        view.env: {venue: selected.get(name, {}) for venue, name in view.streams().items()},
+        "view": view.describe(),
+        "source": "websocket_dual_stream",
+        "timestamp": time.time() * 1000
+    })
+
+class RateBroadcaster:
+    """
+    Pushes rates to /ws/clients when market data changes rather than on a fixed timer.
+    A change opens a BROADCAST_COALESCE_MS window so a burst of frames goes out as one message, and
+    ticks are spaced at least 1 / BROADCAST_MAX_HZ apart. With nothing changing, nothing is sent.
+    """
+
+    def __init__(self, hub, connections, opportunities=None):
+        self.hub = hub
+        self.connections = connections
+        self.opportunities = opportunities or {} # env -> OpportunityTable
+        self.rankings = {} # (env, top_n, sort) -> (rows, BroadcastFrame) last sent on the opportunities channel
+        self.encoders = {} # (protocol, ClientView or None) -> DeltaEncoder / CompactEncoder
+        self.frames = {} # ClientView (or None) -> (versions, members, BroadcastFrame) for protocol=full
+        self.last_tick = 0.0
+        self.ticks = 0
+
+    def tick(self):
+        """Sends every client what changed since the last tick (and a full message to those that need one)."""
+        hub = self.hub
+        # Clients grouped by (protocol, view): each distinct view is serialized once per tick
+        groups = {}
+        for client in list(self.connections.clients.values()):
+            groups.setdefault((client.protocol, client.view), []).append(client)
+
+        rankings = {}
+        if any(view is not None and view.top_n for _, view in groups):
+            books = hub.books()
+            for env, bn_name in (("live", "binance_live"), ("testnet", "binance_testnet")):
+                rankings[env] = rank_by_spread(books[bn_name], books["bybit"]) if hub.is_active(bn_name) else []
+
+        versions = hub.versions()
+        for (protocol, view), clients in groups.items():
+            if protocol == "none":
+                continue
+            members = view.members(rankings) if view is not None else None
+
+            if protocol != "full":
+                # Delta protocols: changed fields only; joining / lagging clients get a full snapshot
+                encoder = self.encoders.get((protocol, view))
+                if encoder is None:
+                    encoder_cls = CompactEncoder if protocol == "compact" else DeltaEncoder
+                    encoder = self.encoders[(protocol, view)] = encoder_cls(hub, view)
+                kind, delta = encoder.step(members)
+                if kind == "snapshot":
+                    for client in clients:
+                        client.reset_to(delta)
+                elif kind == "delta":
+                    self.connections.broadcast_delta(delta, [c for c in clients if not c.needs_snapshot])
+                for client in clients:
+                    if client.needs_snapshot:
+                        client.reset_to(encoder.snapshot(members))
+                continue
+
+            cached = self.frames.get(view)
+            if cached is not None and cached[0] == versions and cached[1] == members:
+                # Unchanged since the last message: only clients that have not had it yet
+                waiting = [c for c in clients if c.needs_snapshot]
+                for client in waiting:
+                    client.needs_snapshot = False
+                if waiting:
+                    self.connections.broadcast_snapshot(cached[2], waiting)
+                continue
+
+            frame = view_message(view, hub.snapshot(), members) if view is not None else self.full_message()
+            self.frames[view] = (versions, members, frame)
+            for client in clients:
+                client.needs_snapshot = False
+            self.connections.broadcast_snapshot(frame, clients)
+
+        # Views nobody watches anymore
+        for key in [k for k in self.encoders if k not in groups]:
+            del self.encoders[key]
+        for view in [v for v in self.frames if ("full", v) not in groups]:
+            del self.frames[view]
+        self.send_opportunities()
+        self.ticks += 1
+
+    def send_opportunities(self):
+        """Opportunities channel: one ranking per (env, top_n, sort), sent when it changed."""
+        subscribers = {}
+        for client in list(self.connections.clients.values()):
+            if client.opportunities:
+                env = "testnet" if client.is_live is False else "live"
+                subscribers.setdefault((env,) + client.opportunities, []).append(client)
+
+        now_ms = time.time() * 1000
+        for key, clients in subscribers.items():
+            env, top_n, sort = key
+            table = self.opportunities.get(env)
+            if table is None or not table.is_active():
+                continue
+            # Clock fields are left to the client (it has next_funding_time), so idle rankings stay identical
+            rows = table.top(top_n, sort, now_ms, clock_fields=False)
+            last = self.rankings.get(key)
+            if last is None or last[0] != rows:
+                frame = BroadcastFrame({"op": "opportunities", "env": env, "sort": sort, "rows": rows, "timestamp": now_ms})
+                self.rankings[key] = (rows, frame)
+                targets = clients
+            else:
+                frame = last[1]
+                targets = [c for c in clients if c.opportunities_pending]
+            for client in targets:
+                client.opportunities_pending = False
+            if targets:
+                self.connections.send_to(frame, targets)
+
+        for key in [k for k in self.rankings if k not in subscribers]:
+            del self.rankings[key]
+
+    def full_message(self):
+        """The legacy payload: every environment, venue and symbol."""
+        # 1. Gather one consistent snapshot of every active stream from the hub (already in client shape)
+        books = self.hub.snapshot()
+        bn_live_out = books["binance_live"]
+        bybit_out = books["bybit"] # Shared Source
+        
+        payload = {
+            "live": {
+                "binance": bn_live_out,
+                "bybit": bybit_out
+            },
+            "source": "websocket_dual_stream",
+            "timestamp": time.time() * 1000
+        }
+        # Testnet stream only runs while a testnet client is connected
+        if "binance_testnet" in books:
+            payload["testnet"] = {
+                "binance": books["binance_testnet"],
+                "bybit": bybit_out
+            }
+        return BroadcastFrame(payload)
+
+    async def wait(self):
+        """Sleeps until market data changes or a client needs a message, then through the coalescing window."""
+        events = (self.hub.changed, self.connections.pending)
+        if not any(e.is_set() for e in events):
+            waiters = [asyncio.ensure_future(e.wait()) for e in events]
+            try:
+                await asyncio.wait(waiters, timeout=BROADCAST_IDLE_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+        # Let the burst finish, and never tick faster than BROADCAST_MAX_HZ
+        delay = max(BROADCAST_COALESCE_MS / 1000, self.last_tick + 1 / BROADCAST_MAX_HZ - time.monotonic())
+        await asyncio.sleep(delay)
+        for event in events:
+            event.clear()
+        self.last_tick = time.monotonic()
+
+    async def run(self):
+        print("🚀 Rate Broadcaster Started")
+        while True:
+            try:
+                await self.wait()
+                self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Broadcaster Error: {e}")
+                await asyncio.sleep(1)
+
 async def broadcast_rates():
-    """Background task to push rates to connected clients every 1s."""
-    print("🚀 Rate Broadcaster Started")
-    while True:
-        try:
-            if manager.active_connections:
-                # 1. Gather Data from Dual Managers
-                bn_live_data = binance_live_wm.get_rates()
-                bn_test_data = binance_test_wm.get_rates()
-                bb_data = bybit_ws_manager.get_rates()
-                
-                # Transform Binance Live
-                bn_live_out = {sym: {"rate": info['fundingRate'], "markPrice": info['markPrice'], "nextFundingTime": info['nextFundingTime'], "fundingIntervalHours": info.get('fundingIntervalHours', 8)} 
-                                 for sym, info in bn_live_data.items()}
-                
-                # Transform Binance Testnet
-                bn_test_out = {sym: {"rate": info['fundingRate'], "markPrice": info['markPrice'], "nextFundingTime": info['nextFundingTime'], "fundingIntervalHours": info.get('fundingIntervalHours', 8)} 
-                                 for sym, info in bn_test_data.items()}
-                
-                # Transform Bybit (Shared Source)
-                bybit_out = {sym: {"rate": info['fundingRate'], "markPrice": info['markPrice'], "nextFundingTime": info['nextFundingTime'], "fundingIntervalHours": info.get('fundingIntervalHours', 8)} 
-                               for sym, info in bb_data.items()}
-                
-                payload = {
-                    "live": {
-                        "binance": bn_live_out,
-                        "bybit": bybit_out
-                    },
-                    "testnet": {
-                        "binance": bn_test_out,
-                        "bybit": bybit_out
-                    },
-                    "source": "websocket_dual_stream",
-                    "timestamp": time.time() * 1000
-                }
-                
-                await manager.broadcast(json.dumps(payload))
-            
-            # Throttle to 1s
-            await asyncio.sleep(1)
-        except Exception as e:
-            print(f"Broadcaster Error: {e}")
-            await asyncio.sleep(1)
+    """Background task pushing rate changes to connected clients (see RateBroadcaster)."""
+    await RateBroadcaster(market_hub, manager, opportunity_tables).run()
 
 
 
@@ -378,22 +1370,533 @@ async def broadcast_rates():
 BINANCE_WS_LIVE = os.getenv("BINANCE_WS_LIVE", "wss://fstream.binance.com/ws/!markPrice@arr")
 BINANCE_WS_TESTNET = os.getenv("BINANCE_WS_TESTNET", "wss://stream.binancefuture.com/ws/!markPrice@arr")
 
-import websockets
+# --- MARKET DATA FRESHNESS ---
+# A symbol not refreshed for this long is stale: reported in /api/ws/status and never traded on
+MARKET_DATA_STALE_SECONDS = float(os.getenv("MARKET_DATA_STALE_SECONDS", "15"))
+# A connection that delivers nothing for this long is closed by the watchdog, forcing a reconnect + resubscribe
+MARKET_DATA_HEARTBEAT_TIMEOUT = float(os.getenv("MARKET_DATA_HEARTBEAT_TIMEOUT", "20"))
+
+# --- RECONNECT / RESYNC ---
+WS_RECONNECT_BASE_SECONDS = float(os.getenv("WS_RECONNECT_BASE_SECONDS", "0.5"))
+WS_RECONNECT_MAX_SECONDS = float(os.getenv("WS_RECONNECT_MAX_SECONDS", "30"))
+# While a stream is not STREAMING, its book is re-seeded from REST this often
+REST_RESYNC_SECONDS = float(os.getenv("REST_RESYNC_SECONDS", "2"))
+
+# Stream states
+STREAM_CONNECTING = "CONNECTING" # Socket opening / waiting for the first frames
+STREAM_STREAMING = "STREAMING" # Socket has caught up; the book is fed by the stream only
+STREAM_BACKOFF = "BACKOFF" # Socket dropped; waiting before the next attempt
+
+# --- MARKET DATA RECORDER ---
+# Directory for raw frame segments; empty disables recording
+MARKET_DATA_RECORD_DIR = os.getenv("MARKET_DATA_RECORD_DIR", "")
+RECORD_QUEUE_SIZE = int(os.getenv("RECORD_QUEUE_SIZE", "20000"))
+RECORD_SEGMENT_BYTES = int(os.getenv("RECORD_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+RECORD_SEGMENT_SECONDS = int(os.getenv("RECORD_SEGMENT_SECONDS", "3600"))
+# --- ON-DEMAND STREAMS ---
+# A lazy stream keeps running this long after its last reader went away
+STREAM_IDLE_GRACE_SECONDS = float(os.getenv("STREAM_IDLE_GRACE_SECONDS", "120"))
+
+# --- MULTI-WORKER MARKET DATA ---
+# Unix socket one worker publishes its books on; empty = every process runs its own streams (single worker)
+MARKET_DATA_SOCKET = os.getenv("MARKET_DATA_SOCKET", "")
+# flock()ed by the worker that owns the exchange streams
+MARKET_DATA_LOCK_FILE = os.getenv("MARKET_DATA_LOCK_FILE", "/tmp/funding-bot-market-data.lock")
+# Owner -> follower heartbeat, and how often followers retry (and try to take over) when the owner is gone
+MARKET_DATA_SHARE_HEARTBEAT_SECONDS = float(os.getenv("MARKET_DATA_SHARE_HEARTBEAT_SECONDS", "1"))
+# How long a follower waits for the owner to answer a forwarded auto-trade request
+MARKET_DATA_SHARE_CALL_TIMEOUT = float(os.getenv("MARKET_DATA_SHARE_CALL_TIMEOUT", "30"))
+
+# Venue ids stored in each frame header
+RECORD_VENUES = {"binance_live": 1, "binance_testnet": 2, "bybit": 3}
+
+import base64
+import gzip
+import random
+import re
+import shutil
+import struct
 import threading
+import zlib
+import websockets
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # No flock (Windows): MARKET_DATA_SOCKET is unsupported
+import numpy as np
+
+class Backoff:
+    """Jittered exponential reconnect delay ("full jitter"), reset once a connection is healthy again."""
+
+    def __init__(self, base=None, cap=None):
+        self.base = WS_RECONNECT_BASE_SECONDS if base is None else base
+        self.cap = WS_RECONNECT_MAX_SECONDS if cap is None else cap
+        self.attempt = 0
+
+    def next(self):
+        ceiling = min(self.cap, self.base * (2 ** self.attempt))
+        self.attempt += 1
+        return random.uniform(self.base / 2, ceiling)
+
+    def reset(self):
+        self.attempt = 0
+
+# --- COLUMNAR RATE BOOK ---
+class SymbolIndex:
+    """Interns normalized symbols ("BTC") to stable row numbers shared by every venue's RateBook."""
+
+    def __init__(self):
+        self.ids = {} # symbol -> row
+        self.symbols = [] # row -> symbol
+
+    def intern(self, symbol):
+        row = self.ids.get(symbol)
+        if row is None:
+            row = len(self.symbols)
+            self.ids[symbol] = row
+            self.symbols.append(symbol)
+        return row
+
+    def __len__(self):
+        return len(self.symbols)
+
+# One index for all venues, so row N is the same symbol in every book
+SYMBOLS = SymbolIndex()
+
+# Bits of RateBook.fields: a row is only exposed once all three have been received
+FIELD_MARK_PRICE = 1
+FIELD_FUNDING_RATE = 2
+FIELD_NEXT_FUNDING = 4
+FIELD_ALL = FIELD_MARK_PRICE | FIELD_FUNDING_RATE | FIELD_NEXT_FUNDING
+
+class RateBook:
+    """
+    One venue's rates held in contiguous arrays, one row per symbol in SYMBOLS.
+    Lets cross-venue spreads be computed for every symbol in a single vectorized pass.
+    """
+
+    def __init__(self, index=None, capacity=1024):
+        self.index = index if index is not None else SYMBOLS
+        self.mark_price = np.zeros(capacity, dtype=np.float64)
+        self.funding_rate = np.zeros(capacity, dtype=np.float64)
+        self.next_funding_time = np.zeros(capacity, dtype=np.int64) # ms
+        self.interval_hours = np.full(capacity, 8, dtype=np.int32)
+        self.updated_at = np.zeros(capacity, dtype=np.float64) # seconds, 0 = never received
+        self.fields = np.zeros(capacity, dtype=np.uint8)
+        self.version = np.zeros(capacity, dtype=np.int64) # book seq of the row's last value change
+        self.seq = 0 # Monotonic change counter for the whole book
+        self.reset_seq = 0 # seq at the last clear(); older cursors must resync from a full snapshot
+
+    @classmethod
+    def from_rates(cls, rates, index=None):
+        """Builds a book from the { symbol -> { rate, markPrice, nextFundingTime, fundingIntervalHours } } shape used by the REST fetchers."""
+        book = cls(index)
+        book.apply_rates(rates)
+        return book
+
+    def apply_rates(self, rates, ts=None):
+        """Writes a REST snapshot (same shape as from_rates) into the book. Returns True if anything changed."""
+        now = time.time() if ts is None else ts
+        changed = False
+        for symbol, info in rates.items():
+            changed |= self.update(symbol, info.get("markPrice", 0.0), info.get("rate", 0.0), int(info.get("nextFundingTime") or 0), info.get("fundingIntervalHours", 8), now)
+        return changed
+
+    @property
+    def capacity(self):
+        return len(self.mark_price)
+
+    def ensure_capacity(self, rows):
+        if rows <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < rows:
+            capacity *= 2
+        for name in ("mark_price", "funding_rate", "next_funding_time", "interval_hours", "updated_at", "fields", "version"):
+            old = getattr(self, name)
+            new = np.full(capacity, 8 if name == "interval_hours" else 0, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def update(self, symbol, mark_price=None, funding_rate=None, next_funding_time=None, interval_hours=None, ts=None):
+        """
+        Writes the given fields for one symbol. Fields left as None keep their previous value.
+        Returns True if any value changed (the row then gets a new version).
+        """
+        row = self.index.intern(symbol)
+        self.ensure_capacity(row + 1)
+        fields = self.fields[row]
+        changed = False
+        if mark_price is not None:
+            if not fields & FIELD_MARK_PRICE or self.mark_price[row] != mark_price:
+                self.mark_price[row] = mark_price
+                changed = True
+            fields |= FIELD_MARK_PRICE
+        if funding_rate is not None:
+            if not fields & FIELD_FUNDING_RATE or self.funding_rate[row] != funding_rate:
+                self.funding_rate[row] = funding_rate
+                changed = True
+            fields |= FIELD_FUNDING_RATE
+        if next_funding_time is not None:
+            if not fields & FIELD_NEXT_FUNDING or self.next_funding_time[row] != next_funding_time:
+                self.next_funding_time[row] = next_funding_time
+                changed = True
+            fields |= FIELD_NEXT_FUNDING
+        if interval_hours is not None and self.interval_hours[row] != interval_hours:
+            self.interval_hours[row] = interval_hours
+            changed = True
+        self.fields[row] = fields
+        self.updated_at[row] = ts if ts is not None else time.time()
+        if changed:
+            self.mark_changed(row)
+        return changed
+
+    def remove(self, symbols):
+        """Drops the rows of `symbols` (e.g. delisted). Counts as a reset: delta readers resync from a snapshot."""
+        rows = [row for row in (self.index.ids.get(s) for s in symbols) if row is not None and row < self.capacity]
+        if not rows:
+            return False
+        self.fields[rows] = 0
+        self.updated_at[rows] = 0
+        self.seq += 1
+        self.reset_seq = self.seq
+        return True
+
+    def mark_changed(self, rows):
+        """Stamps one row (or an array of rows) with a new book version."""
+        self.seq += 1
+        self.version[rows] = self.seq
+
+    def changed_rows_since(self, version):
+        """Rows with a complete record whose values changed after `version`."""
+        n = min(len(self.index), self.capacity)
+        return np.nonzero((self.version[:n] > version) & (self.fields[:n] == FIELD_ALL))[0]
+
+    def changed_since(self, version):
+        """Symbols changed after `version`, plus the cursor to pass next time."""
+        symbols = self.index.symbols
+        return [symbols[r] for r in self.changed_rows_since(version)], self.seq
+
+    def refresh(self, ts, exclude=()):
+        """Marks every complete row as fresh at `ts`, except the symbols in `exclude`."""
+        mask = self.present(min(len(self.index), self.capacity))
+        for symbol in exclude:
+            row = self.index.ids.get(symbol)
+            if row is not None and row < len(mask):
+                mask[row] = False
+        self.updated_at[:len(mask)][mask] = ts
+
+    def needs_resync(self, version):
+        """True if the book was cleared after `version`, so a delta from it would miss removals."""
+        return version < self.reset_seq
+
+    def present(self, rows=None):
+        """Boolean mask of rows with a complete record, over the first `rows` symbols."""
+        n = len(self.index) if rows is None else rows
+        mask = np.zeros(n, dtype=bool)
+        m = min(n, self.capacity)
+        mask[:m] = self.fields[:m] == FIELD_ALL
+        return mask
+
+    def stale(self, now=None, max_age=None, rows=None):
+        """Boolean mask of complete rows not refreshed within `max_age` seconds."""
+        now = time.time() if now is None else now
+        max_age = MARKET_DATA_STALE_SECONDS if max_age is None else max_age
+        mask = self.present(rows)
+        m = min(len(mask), self.capacity)
+        mask[:m] &= (now - self.updated_at[:m]) > max_age
+        return mask
+
+    def stale_symbols(self, now=None, max_age=None):
+        symbols = self.index.symbols
+        return [symbols[r] for r in np.nonzero(self.stale(now, max_age))[0]]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.fields == FIELD_ALL))
+
+    def __contains__(self, symbol):
+        row = self.index.ids.get(symbol)
+        return row is not None and row < self.capacity and self.fields[row] == FIELD_ALL
+
+    def clear(self):
+        self.fields[:] = 0
+        self.updated_at[:] = 0
+        self.seq += 1
+        self.reset_seq = self.seq
+
+    def _columns(self):
+        rows = np.nonzero(self.present())[0]
+        symbols = self.index.symbols
+        return ([symbols[r] for r in rows], self.funding_rate[rows].tolist(), self.mark_price[rows].tolist(),
+                self.next_funding_time[rows].tolist(), self.interval_hours[rows].tolist())
+
+    def to_dict(self):
+        """Legacy manager shape: { symbol -> { markPrice, fundingRate, nextFundingTime, fundingIntervalHours } }."""
+        return {s: {"markPrice": p, "fundingRate": r, "nextFundingTime": t, "fundingIntervalHours": h}
+                for s, r, p, t, h in zip(*self._columns())}
+
+    def to_payload(self):
+        """Client/API shape: { symbol -> { rate, markPrice, nextFundingTime, fundingIntervalHours } }."""
+        return {s: {"rate": r, "markPrice": p, "nextFundingTime": t, "fundingIntervalHours": h}
+                for s, r, p, t, h in zip(*self._columns())}
+
+def compute_spread_table(binance_book, bybit_book, now_ms=None, max_age=None):
+    """
+    Cross-venue columns for every symbol present in both books, computed in one vectorized pass.
+    Returns a dict of equal-length numpy arrays plus the matching `symbols` list.
+    """
+    if now_ms is None:
+        now_ms = time.time() * 1000
+    if max_age is None:
+        max_age = MARKET_DATA_STALE_SECONDS
+    rows = np.nonzero(binance_book.present() & bybit_book.present())[0]
+
+    bn_rate = binance_book.funding_rate[rows]
+    bb_rate = bybit_book.funding_rate[rows]
+    bn_price = binance_book.mark_price[rows]
+    bb_price = bybit_book.mark_price[rows]
+    bn_nft = binance_book.next_funding_time[rows]
+    bb_nft = bybit_book.next_funding_time[rows]
+
+    safe_price = np.where(bn_price > 0, bn_price, 1.0)
+    price_diff_pct = np.where(bn_price > 0, np.abs(bn_price - bb_price) / safe_price * 100, 0.0)
+    next_funding = np.where(bb_nft > 0, np.minimum(bn_nft, bb_nft), bn_nft)
+    # Age of the older of the two quotes, in seconds
+    data_age = now_ms / 1000 - np.minimum(binance_book.updated_at[rows], bybit_book.updated_at[rows])
+
+    return {
+        "rows": rows,
+        "symbols": [binance_book.index.symbols[r] for r in rows],
+        "binance_rate": bn_rate,
+        "bybit_rate": bb_rate,
+        "rate_diff": np.abs(bn_rate - bb_rate),
+        "binance_price": bn_price,
+        "bybit_price": bb_price,
+        "price_diff_pct": price_diff_pct,
+        "binance_nft": bn_nft,
+        "bybit_nft": bb_nft,
+        "binance_interval": binance_book.interval_hours[rows],
+        "bybit_interval": bybit_book.interval_hours[rows],
+        "time_to_funding": next_funding - int(now_ms),
+        # Outliers / error codes (like -999) and exact zeros are placeholders, not real rates
+        "is_invalid": (np.abs(bn_rate) > 10) | (np.abs(bb_rate) > 10) | (bn_rate == 0) | (bb_rate == 0),
+        "data_age": data_age,
+        "is_stale": data_age > max_age,
+    }
+
+def rank_by_spread(binance_book, bybit_book):
+    """Symbols listed on both venues, best cross-venue funding spread first (invalid / stale quotes excluded)."""
+    table = compute_spread_table(binance_book, bybit_book)
+    valid = ~table["is_invalid"] & ~table["is_stale"]
+    order = np.argsort(-table["rate_diff"][valid], kind="stable")
+    symbols = [s for s, ok in zip(table["symbols"], valid) if ok]
+    return [symbols[i] for i in order]
+
+# Ranking keys accepted by OpportunityTable.top(); all sort best-first (largest first, soonest funding first)
+OPPORTUNITY_SORTS = ("rate_diff", "annualized_yield", "price_diff_pct", "time_to_funding")
+# Row fields of OpportunityTable.top(), in order: (row key, spread table column)
+OPPORTUNITY_FIELDS = (
+    ("binance_rate", "binance_rate"), ("bybit_rate", "bybit_rate"), ("rate_diff", "rate_diff"),
+    ("annualized_yield", "annualized_yield"), ("price_diff_pct", "price_diff_pct"),
+    ("binance_price", "binance_price"), ("bybit_price", "bybit_price"), ("next_funding_time", "next_funding"),
+    ("binance_interval", "binance_interval"), ("bybit_interval", "bybit_interval"), ("interval_mismatch", "interval_mismatch"),
+)
+
+class OpportunityTable:
+    """
+    Cross-venue opportunities for one environment, computed once and shared by auto_trade_service,
+    /api/opportunities and the /ws/clients "opportunities" channel.
+    The spread columns are only recomputed when either book changed; the clock-dependent ones
+    (time to funding, staleness) are refreshed on every read.
+    """
+
+    def __init__(self, hub, binance="binance_live", bybit="bybit"):
+        self.hub = hub
+        self.names = (binance, bybit)
+        self.key = None # (book, seq) of both books the table was computed from
+        self.table = None
+        self.version = 0 # Bumped whenever the spread columns are recomputed
+
+    def is_active(self):
+        return all(self.hub.is_active(name) for name in self.names)
+
+    def current(self, now_ms=None):
+        """compute_spread_table() columns plus annualized_yield, interval_mismatch, next_funding and updated_at."""
+        if now_ms is None:
+            now_ms = time.time() * 1000
+        bn_book, bb_book = (self.hub.get(name).book for name in self.names)
+        key = (id(bn_book), bn_book.seq, id(bb_book), bb_book.seq)
+        if key != self.key:
+            table = compute_spread_table(bn_book, bb_book, now_ms)
+            rows = table["rows"]
+            # Unknown intervals count as the default 8h
+            bn_interval = np.where(table["binance_interval"] > 0, table["binance_interval"], 8)
+            bb_interval = np.where(table["bybit_interval"] > 0, table["bybit_interval"], 8)
+            # Spread collected at every settlement of the faster venue, in % per year
+            table["annualized_yield"] = table["rate_diff"] * (24 / np.minimum(bn_interval, bb_interval)) * 365 * 100
+            table["interval_mismatch"] = bn_interval != bb_interval
+            table["next_funding"] = table["time_to_funding"] + int(now_ms)
+            table["updated_at"] = np.minimum(bn_book.updated_at[rows], bb_book.updated_at[rows])
+            self.key = key
+            self.table = table
+            self.version += 1
+            return table
+        # Books unchanged: only the clock moved
+        table = dict(self.table)
+        table["time_to_funding"] = table["next_funding"] - int(now_ms)
+        table["data_age"] = now_ms / 1000 - table["updated_at"]
+        table["is_stale"] = table["data_age"] > MARKET_DATA_STALE_SECONDS
+        return table
+
+    def top(self, n=None, sort="rate_diff", now_ms=None, clock_fields=True):
+        """
+        Best `n` opportunities (all if None) as row dicts, invalid and stale quotes excluded.
+        `clock_fields` = False leaves out time_to_funding / data_age, so rows only change when the books do.
+        """
+        if sort not in OPPORTUNITY_SORTS:
+            sort = "rate_diff"
+        table = self.current(now_ms)
+        valid = np.nonzero(~table["is_invalid"] & ~table["is_stale"])[0]
+        values = table[sort][valid]
+        order = valid[np.argsort(values if sort == "time_to_funding" else -values, kind="stable")]
+        if n:
+            order = order[:n]
+
+        fields = OPPORTUNITY_FIELDS
+        if clock_fields:
+            fields += (("time_to_funding", "time_to_funding"), ("data_age", "data_age"))
+        columns = [table[column][order].tolist() for _, column in fields]
+        names = [name for name, _ in fields]
+        symbols = table["symbols"]
+        return [dict(zip(names, values), symbol=symbols[i]) for i, values in zip(order.tolist(), zip(*columns))]
+
+# Optional faster JSON backend for the hot market-data path
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# "fast" = MarkPriceDecoder (change detection, reused records); "legacy" = plain json.loads loop
+BINANCE_DECODER = os.getenv("BINANCE_DECODER", "fast")
+
+class MarkPriceDecoder:
+    """
+    Fast path for Binance `!markPrice@arr` frames.
+    Keeps one preallocated record per raw symbol and only converts fields whose raw string changed.
+    """
+
+    def __init__(self, book):
+        self.book = book
+        self.records = {} # raw symbol ("BTCUSDT") -> [row, symbol, last p, last r, last T]
+        self.loads = orjson.loads if orjson else json.loads
+        self.intervals_seen = -1 # Interval cache version when intervals were last applied
+
+    def _record(self, raw):
+        symbol = raw.replace('USDT', '')
+        if not symbol:
+            return None
+        row = self.book.index.intern(symbol)
+        self.book.ensure_capacity(row + 1)
+        rec = [row, symbol, None, None, None]
+        self.records[raw] = rec
+        return rec
+
+    def invalidate(self):
+        """Forgets the last raw strings, so the next frame rewrites every row (e.g. over REST resync values)."""
+        for rec in self.records.values():
+            rec[2] = rec[3] = rec[4] = None
+
+    def decode(self, message, now, intervals, intervals_version=0):
+        """
+        Applies one frame to the book. Returns the number of symbols received.
+        `intervals_version` must change whenever the owner of `intervals` changes any value in it.
+        """
+        items = self.loads(message)
+        if not isinstance(items, list):
+            return 0
+        book = self.book
+        mark_price, funding_rate, next_funding_time = book.mark_price, book.funding_rate, book.next_funding_time
+        records = self.records
+        rows = []
+        changed = []
+        new_records = False
+
+        for item in items:
+            raw = item.get('s')
+            rec = records.get(raw)
+            if rec is None:
+                if not raw:
+                    continue
+                rec = self._record(raw)
+                if rec is None:
+                    continue
+                # ensure_capacity may have swapped the arrays
+                mark_price, funding_rate, next_funding_time = book.mark_price, book.funding_rate, book.next_funding_time
+                new_records = True
+            row = rec[0]
+            dirty = False
+
+            p = item.get('p')
+            if p != rec[2]:
+                rec[2] = p
+                mark_price[row] = float(p) if p else 0.0
+                dirty = True
+            r = item.get('r')
+            if r != rec[3]:
+                rec[3] = r
+                funding_rate[row] = float(r) if r else 0.0
+                dirty = True
+            t = item.get('T')
+            if t != rec[4]:
+                rec[4] = t
+                next_funding_time[row] = int(t) if t else 0
+                dirty = True
+            rows.append(row)
+            if dirty:
+                changed.append(row)
+
+        if rows:
+            book.updated_at[rows] = now
+            book.fields[rows] = FIELD_ALL
+
+        # Intervals arrive from REST after the stream starts (and are refreshed); re-apply whenever that cache changes
+        if new_records or intervals_version != self.intervals_seen:
+            self.intervals_seen = intervals_version
+            for row, symbol, *_ in records.values():
+                hours = intervals.get(symbol, 8)
+                if book.interval_hours[row] != hours:
+                    book.interval_hours[row] = hours
+                    changed.append(row)
+
+        if changed:
+            book.mark_changed(changed)
+        return len(rows)
 
 class BinanceWebSocketManager:
     """Manages WebSocket connection to Binance Futures for real-time mark price and funding rate."""
     
     def __init__(self):
-        self.data = {}  # symbol -> { markPrice, fundingRate, nextFundingTime }
+        self.book = RateBook() # markPrice, fundingRate, nextFundingTime, interval per symbol
+        self.decoder = MarkPriceDecoder(self.book) if BINANCE_DECODER == "fast" else None
+        self.name = "binance"
+        self.hub = None # Set by MarketDataHub.register
         self.is_live = False
         self.ws = None
         self.running = False
-        self.thread = None
-        self.loop = None
+        self.task = None
+        self.resync_task = None
+        self.state = STREAM_CONNECTING
+        self.last_message_at = 0 # Receive time of the last frame (or of the connect)
     
     def get_ws_url(self):
         return BINANCE_WS_LIVE if self.is_live else BINANCE_WS_TESTNET
+
+    async def fetch_snapshot(self):
+        return await fetch_binance_rates(self.is_live)
+
+    def resync_targets(self):
+        """Symbols the REST resync may overwrite; None = all (every frame carries the full market)."""
+        return None
     
     async def _connect(self):
         url = self.get_ws_url()
@@ -405,7 +1908,9 @@ class BinanceWebSocketManager:
         ssl_context.check_hostname = False
         ssl_context.verify_mode = ssl.CERT_NONE
         
+        backoff = Backoff()
         while self.running:
+            self.state = STREAM_CONNECTING
             try:
                 async with websockets.connect(
                     url, 
@@ -416,118 +1921,274 @@ class BinanceWebSocketManager:
                     close_timeout=5
                 ) as ws:
                     self.ws = ws
+                    self.last_message_at = time.time()
+                    if self.decoder:
+                        self.decoder.invalidate()
                     print(f"✅ Binance WS Connected ({'LIVE' if self.is_live else 'TESTNET'})")
                     
                     async for message in ws:
                         if not self.running:
                             break
-                        try:
-                            data = json.loads(message)
-                            if isinstance(data, list):
-                                count = 0
-                                for item in data:
-                                    symbol = item.get('s', '').replace('USDT', '')
-                                    if symbol:
-                                        self.data[symbol] = {
-                                            'markPrice': float(item.get('p', 0)),
-                                            'fundingRate': float(item.get('r', 0)),
-                                            'nextFundingTime': int(item.get('T', 0)),
-                                            'fundingIntervalHours': BINANCE_INTERVAL_CACHE.get(symbol, 8) # Default 8 if missing
-                                        }
-                                        count += 1
-                                if count > 0 and len(self.data) % 100 == 0:
-                                    print(f"📊 WS Data Updated: {len(self.data)} symbols")
-                        except Exception as parse_err:
-                            print(f"WS Parse Error: {parse_err}")
-                            
+                        self.last_message_at = time.time()
+                        if self.hub: self.hub.record(self.name, message, self.last_message_at)
+                        self._handle_message(message, self.last_message_at)
+                        if self.state != STREAM_STREAMING:
+                            # Every frame carries the whole market, so one frame means we have caught up
+                            self.state = STREAM_STREAMING
+                            backoff.reset()
+                reason = "Closed"
             except websockets.exceptions.ConnectionClosed as e:
-                if self.running:
-                    print(f"⚠️ Binance WS Disconnected: {e}. Reconnecting in 5s...")
-                    await asyncio.sleep(5)
+                reason = f"Disconnected: {e}"
             except asyncio.TimeoutError:
-                if self.running:
-                    print(f"⏱️ Binance WS Timeout. Reconnecting in 5s...")
-                    await asyncio.sleep(5)
+                reason = "Timeout"
             except Exception as e:
-                if self.running:
-                    print(f"❌ Binance WS Error: {type(e).__name__}: {e}. Reconnecting in 5s...")
-                    await asyncio.sleep(5)
-    
-    def _run_loop(self):
-        loop = asyncio.new_event_loop()
-        self.loop = loop
-        asyncio.set_event_loop(loop)
+                reason = f"Error: {type(e).__name__}: {e}"
+            self.ws = None
+            if self.running:
+                # REST resync keeps the book fresh until the next socket catches up
+                self.state = STREAM_BACKOFF
+                delay = backoff.next()
+                print(f"⚠️ Binance WS {reason}. Reconnecting in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+    def _handle_message(self, message, ts=None):
+        """
+        Applies one `!markPrice@arr` frame received at `ts` (default: now).
+        Runs without awaiting, so the whole frame lands at once.
+        """
         try:
-            loop.run_until_complete(self._connect())
-        except Exception as e:
-            print(f"WS Loop Error: {e}")
-        finally:
-            try:
-                # Cancel pending tasks to ensure clean exit
-                tasks = asyncio.all_tasks(loop)
-                for task in tasks:
-                    task.cancel()
-                if tasks:
-                    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
-                loop.close()
-            except Exception as e:
-                print(f"Error closing loop: {e}")
-
+            seq = self.book.seq
+            now = time.time() if ts is None else ts
+            if self.decoder:
+                self.decoder.decode(message, now, instruments.intervals["binance"], instruments.version)
+                if self.book.seq != seq and self.hub:
+                    self.hub.publish(self.name)
+                return
+
+            data = json.loads(message)
+            if isinstance(data, list):
+                count = 0
+                for item in data:
+                    symbol = item.get('s', '').replace('USDT', '')
+                    if symbol:
+                        self.book.update(
+                            symbol,
+                            mark_price=float(item.get('p', 0)),
+                            funding_rate=float(item.get('r', 0)),
+                            next_funding_time=int(item.get('T', 0)),
+                            interval_hours=instruments.intervals["binance"].get(symbol, 8), # Default 8 if missing
+                            ts=now
+                        )
+                        count += 1
+                if count > 0:
+                    if self.book.seq != seq and self.hub: self.hub.publish(self.name)
+                    if len(self.book) % 100 == 0:
+                        print(f"📊 WS Data Updated: {len(self.book)} symbols")
+        except Exception as parse_err:
+            print(f"WS Parse Error: {parse_err}")
 
     def start(self, is_live=False):
+        """Runs the stream as a task on the current (server) event loop."""
         if self.running:
             self.stop()
         
         # Clear stale data when switching modes
-        self.data = {}
+        self.book.clear()
+        if self.decoder:
+            self.decoder = MarkPriceDecoder(self.book)
 
         self.is_live = is_live
         self.running = True
-        self.thread = threading.Thread(target=self._run_loop, daemon=True)
-        self.thread.start()
+        self.state = STREAM_CONNECTING
+        loop = asyncio.get_running_loop()
+        self.task = loop.create_task(self._connect())
+        self.resync_task = loop.create_task(rest_resync_loop(self))
         print(f"🚀 Binance WS Manager Started ({'LIVE' if is_live else 'TESTNET'})")
     
     def stop(self):
         self.running = False
-        if self.ws:
-            asyncio.run_coroutine_threadsafe(self.ws.close(), self.loop)
-        if self.thread:
-            self.thread.join(timeout=2)
+        if self.task:
+            # Cancelling exits the `async with websockets.connect(...)` block, which closes the socket
+            self.task.cancel()
+            self.task = None
+        if self.resync_task:
+            self.resync_task.cancel()
+            self.resync_task = None
         print("🛑 Binance WS Manager Stopped")
     
     def get_rates(self):
         """Returns current cached rates for all symbols."""
-        return self.data
+        return self.book.to_dict()
+
+    def check_heartbeat(self, now, timeout):
+        """Closes a connected socket that went quiet; _connect then reconnects and the stream resumes."""
+        if self.ws is not None and now - self.last_message_at > timeout:
+            print(f"💤 {self.name} WS silent for {now - self.last_message_at:.0f}s. Forcing reconnect...")
+            ws, self.ws = self.ws, None
+            asyncio.create_task(ws.close())
+
+    def health(self, now=None):
+        """Freshness summary for /api/ws/status."""
+        now = time.time() if now is None else now
+        stale = self.book.stale_symbols(now)
+        return {
+            "last_message_age": round(now - self.last_message_at, 1) if self.last_message_at else None,
+            "stale_count": len(stale),
+            "stale_symbols": stale[:50]
+        }
+
+    @property
+    def version(self):
+        return self.book.seq
+
+    def changed_since(self, version):
+        """Returns (symbols changed after `version`, new version)."""
+        return self.book.changed_since(version)
 
 # Global WS Manager Instances
 binance_live_wm = BinanceWebSocketManager()
 binance_test_wm = BinanceWebSocketManager()
 
+class BybitShard:
+    """One Bybit public connection carrying a slice of the ticker subscriptions."""
+
+    def __init__(self, shard_id):
+        self.id = shard_id
+        self.symbols = [] # raw symbols, e.g. "BTCUSDT"
+        self.ws = None
+        self.task = None
+        self.last_message_at = 0
+        self.state = STREAM_CONNECTING
+        self.awaiting = set() # Raw symbols subscribed on this socket whose snapshot has not arrived yet
+
 class BybitWebSocketManager:
-    """Manages WebSocket connection to Bybit for real-time funding rates."""
+    """
+    Manages WebSocket connections to Bybit for real-time funding rates.
+    The linear USDT universe is spread across several connections (shards) that subscribe in parallel.
+    """
     
     def __init__(self):
-        self.data = {}  # symbol -> { markPrice, fundingRate, nextFundingTime, fundingIntervalHours }
+        self.book = RateBook() # markPrice, fundingRate, nextFundingTime, interval per symbol
+        self.name = "bybit"
+        self.hub = None # Set by MarketDataHub.register
         self.is_live = False
-        self.ws = None
         self.running = False
-        self.thread = None
-        self.loop = None
+        self.task = None
+        self.shards = []
+        self.universe = [] # Cached instrument list (raw symbols), survives reconnects
+        self.universe_fetched_at = 0
+        self.resync_task = None
+        self.intervals_seen = -1 # Interval cache version when intervals were last applied to every row
     
     def get_ws_url(self):
         # Always use Live WS for accurate funding scanner rates, even if account is Testnet
         return BYBIT_WS_LIVE
-    
+
+    @property
+    def state(self):
+        """STREAMING only when every shard has caught up; otherwise the least healthy shard's state."""
+        states = {shard.state for shard in self.shards}
+        if states == {STREAM_STREAMING}:
+            return STREAM_STREAMING
+        return STREAM_BACKOFF if STREAM_BACKOFF in states else STREAM_CONNECTING
+
+    async def fetch_snapshot(self):
+        return await fetch_bybit_rates(self.is_live)
+
+    def resync_targets(self):
+        """Symbols not yet covered by a live snapshot: those of disconnected shards plus any still awaiting one."""
+        targets = set()
+        for shard in self.shards:
+            if shard.state == STREAM_STREAMING:
+                continue
+            raw = shard.symbols if shard.ws is None else shard.awaiting
+            targets.update(s.replace("USDT", "").replace("PERP", "") for s in raw)
+        return targets
+
+    async def _load_universe(self):
+        """Fetches all trading linear USDT perpetuals (paginated). Returns None on failure."""
+        items = await fetch_bybit_instruments()
+        if items is None:
+            return None
+        return [item["symbol"] for item in items if item["symbol"].endswith("USDT") and item.get("status", "Trading") == "Trading"]
+
+    async def _subscribe(self, ws, symbols, op="subscribe"):
+        """Sends max-size subscribe batches back to back, without waiting for acks."""
+        topics = [f"tickers.{s}" for s in symbols]
+        batches = [topics[i : i + BYBIT_SUBSCRIBE_BATCH] for i in range(0, len(topics), BYBIT_SUBSCRIBE_BATCH)]
+        await asyncio.gather(*(ws.send(json.dumps({"op": op, "args": batch})) for batch in batches))
+
+    def _start_shard(self):
+        shard = BybitShard(len(self.shards))
+        self.shards.append(shard)
+        return shard
+
+    async def _apply_universe(self, symbols):
+        """Adds new listings to shards with spare room (or new shards) and drops delisted ones."""
+        current = {s for shard in self.shards for s in shard.symbols}
+        wanted = set(symbols)
+        added = [s for s in symbols if s not in current]
+        removed = current - wanted
+
+        for shard in self.shards:
+            gone = [s for s in shard.symbols if s in removed]
+            if gone:
+                shard.symbols = [s for s in shard.symbols if s not in removed]
+                shard.awaiting.difference_update(gone)
+                if shard.ws:
+                    try: await self._subscribe(shard.ws, gone, op="unsubscribe")
+                    except Exception: pass
+        # Unsubscribed rows would otherwise stay in the book with their last values
+        if self.book.remove([s.replace("USDT", "") for s in removed]) and self.hub:
+            self.hub.publish(self.name)
+
+        new_shards = []
+        pending = list(added)
+        for shard in self.shards:
+            room = BYBIT_WS_SHARD_SIZE - len(shard.symbols)
+            if room <= 0 or not pending:
+                continue
+            chunk, pending = pending[:room], pending[room:]
+            shard.symbols.extend(chunk)
+            if shard.ws:
+                shard.awaiting.update(chunk)
+                # Live connection: subscribe incrementally. Otherwise the next (re)connect picks them up.
+                try: await self._subscribe(shard.ws, chunk)
+                except Exception: pass
+        while pending:
+            shard = self._start_shard()
+            shard.symbols, pending = pending[:BYBIT_WS_SHARD_SIZE], pending[BYBIT_WS_SHARD_SIZE:]
+            new_shards.append(shard)
+
+        for shard in new_shards:
+            shard.task = asyncio.create_task(self._run_shard(shard))
+
     async def _connect(self):
+        """Loads the instrument list once, starts the shards, then polls for new listings."""
+        while self.running:
+            symbols = await self._load_universe()
+            if symbols:
+                self.universe = symbols
+                self.universe_fetched_at = time.time()
+            elif not self.universe:
+                print("Fallback: Subscribing to default tickers.")
+                self.universe = ["BTCUSDT", "ETHUSDT", "SOLUSDT"]
+
+            await self._apply_universe(self.universe)
+            # Retry quickly if we are still running on the fallback list
+            await asyncio.sleep(BYBIT_UNIVERSE_REFRESH_SECONDS if symbols else 10)
+
+    async def _run_shard(self, shard):
         url = self.get_ws_url()
-        print(f"🔌 Bybit WS Connecting to: {url}")
         
         import ssl
         ssl_context = ssl.create_default_context()
         ssl_context.check_hostname = False
         ssl_context.verify_mode = ssl.CERT_NONE
         
+        backoff = Backoff()
         while self.running:
+            shard.state = STREAM_CONNECTING
             try:
                 async with websockets.connect(
                     url, 
@@ -535,137 +2196,864 @@ class BybitWebSocketManager:
                     ping_timeout=10, 
                     ssl=ssl_context
                 ) as ws:
-                    self.ws = ws
-                    print(f"✅ Bybit WS Connected ({'LIVE' if self.is_live else 'TESTNET'})")
-                    
-                    # Bybit V5 Linear Tickers subscription topic is tickers.{symbol}
-                    # We can also use 'tickers.USDT' for SOME environments but it's not universal.
-                    # Best is to fetch symbols or use the shorthand if verified.
-                    # Given the ambiguity, we'll try 'tickers.USDT' first as it works in some Pro/Unified accounts,
-                    # but we'll also handle the individual symbol data correctly.
-                    subscribe_msg = {
-                        "op": "subscribe",
-                        "args": ["tickers.BTCUSDT", "tickers.ETHUSDT", "tickers.SOLUSDT", "tickers.BNBUSDT"] # Priority ones
-                    }
-                    # Add remaining symbols if we had a list, but for now let's try a broader one first
-                    # Search suggests "tickers.USDT" might not be an official "all" but is a common pattern for some categories.
-                    # Let's try to subscribe dynamically by fetching symbols once.
-                    
-                    # Subscribe to symbols
-                    try:
-                        print("DEBUG: Fetching Bybit symbols for WS subscription...")
-                        loop = asyncio.get_event_loop()
-                        resp = await loop.run_in_executor(None, functools.partial(requests.get, BYBIT_API_URL if self.is_live else BYBIT_API_TESTNET_URL, params={"category": "linear"}))
-                        
-                        if resp.status_code == 200:
-                            s_data = resp.json()
-                            if s_data.get("retCode") == 0:
-                                symbols = [f"tickers.{item['symbol']}" for item in s_data["result"]["list"] if item["symbol"].endswith("USDT")]
-                                print(f"DEBUG: Found {len(symbols)} Bybit symbols.")
-                                
-                                if not symbols:
-                                    print("WARN: No Bybit symbols found. Subscribing to default BTCUSDT.")
-                                    await ws.send(json.dumps({"op": "subscribe", "args": ["tickers.BTCUSDT", "tickers.ETHUSDT"]}))
-                                else:
-                                    # Subscribe in chunks
-                                    chunk_size = 10
-                                    for i in range(0, min(len(symbols), 500), chunk_size):
-                                        chunk = symbols[i : i + chunk_size]
-                                        await ws.send(json.dumps({"op": "subscribe", "args": chunk}))
-                                        await asyncio.sleep(0.1) # Prevent flooding
-                                    print(f"DEBUG: Subscribed to {min(len(symbols), 500)} symbols.")
-                            else:
-                                print(f"Bybit API Error (RetCode {s_data.get('retCode')}): {s_data.get('retMsg')}")
-                                raise Exception("Bybit API RetCode Error")
-                        else:
-                            print(f"Bybit API HTTP Error: {resp.status_code}")
-                            raise Exception("Bybit API HTTP Error")
-                            
-                    except Exception as e:
-                        print(f"Bybit WS Subscription error: {e}")
-                        print("Fallback: Subscribing to default tickers.")
-                        await ws.send(json.dumps({"op": "subscribe", "args": ["tickers.BTCUSDT", "tickers.ETHUSDT", "tickers.SOLUSDT"]}))
+                    # Records may be stale after a gap: ignore deltas for a symbol until its snapshot arrives
+                    initial = list(shard.symbols)
+                    shard.awaiting = set(initial)
+                    # Subscribe before publishing the socket, so _apply_universe never double-subscribes
+                    await self._subscribe(ws, initial)
+                    shard.ws = ws
+                    shard.last_message_at = time.time()
+                    late = [s for s in shard.symbols if s not in initial]
+                    if late:
+                        shard.awaiting.update(late)
+                        await self._subscribe(ws, late)
+                    print(f"✅ Bybit WS Shard {shard.id} Connected ({'LIVE' if self.is_live else 'TESTNET'}): {len(shard.symbols)} symbols")
                     
                     async for message in ws:
                         if not self.running:
                             break
-                        try:
-                            msg_data = json.loads(message)
-                            if "topic" in msg_data and msg_data["topic"].startswith("tickers"):
-                                data = msg_data.get("data", {})
-                                symbol = data.get("symbol", "")
-                                if symbol.endswith("USDT") or symbol.endswith("PERP"):
-                                    # Normalize symbol
-                                    norm_symbol = symbol.replace("USDT", "").replace("PERP", "")
-                                    
-                                    # Update if data is present (Bybit sends delta updates)
-                                    if norm_symbol not in self.data:
-                                        self.data[norm_symbol] = {}
-                                        
-                                    if "fundingRate" in data:
-                                        self.data[norm_symbol]["fundingRate"] = float(data["fundingRate"])
-                                    if "markPrice" in data:
-                                        self.data[norm_symbol]["markPrice"] = float(data["markPrice"])
-                                    if "nextFundingTime" in data:
-                                        # Bybit sends nft as milliseconds
-                                        self.data[norm_symbol]["nextFundingTime"] = int(data["nextFundingTime"])
-                                    
-                                    # Use cached interval from REST API, or default to 8
-                                    if "fundingIntervalHours" not in self.data[norm_symbol]:
-                                         self.data[norm_symbol]["fundingIntervalHours"] = BYBIT_INTERVAL_CACHE.get(norm_symbol, 8)
-                                         
-                        except Exception as parse_err:
-                            pass # Silent for high frequency
-                            
+                        shard.last_message_at = time.time()
+                        if self.hub: self.hub.record(self.name, message, shard.last_message_at)
+                        self._handle_message(message, shard, shard.last_message_at)
+                        if shard.state == STREAM_STREAMING:
+                            backoff.reset()
+                reason = "Closed"
             except Exception as e:
-                if self.running:
-                    print(f"❌ Bybit WS Error: {e}. Reconnecting in 5s...")
-                    await asyncio.sleep(5)
-    
-    def _run_loop(self):
-        loop = asyncio.new_event_loop()
-        self.loop = loop
-        asyncio.set_event_loop(loop)
+                reason = f"Error: {e}"
+            shard.ws = None
+            if self.running:
+                shard.state = STREAM_BACKOFF
+                delay = backoff.next()
+                print(f"❌ Bybit WS Shard {shard.id} {reason}. Reconnecting in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+    def _handle_message(self, message, shard=None, ts=None):
+        """Applies one tickers frame (snapshot or delta) received on `shard` at `ts` (default: now)."""
         try:
-            loop.run_until_complete(self._connect())
-        except Exception as e:
-            print(f"WS Loop Error: {e}")
-        finally:
-            try:
-                # Cancel pending tasks to ensure clean exit
-                tasks = asyncio.all_tasks(loop)
-                for task in tasks:
-                    task.cancel()
-                if tasks:
-                    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
-                loop.close()
-            except Exception as e:
-                print(f"Error closing loop: {e}")
+            msg_data = json.loads(message)
+            if "topic" in msg_data and msg_data["topic"].startswith("tickers"):
+                data = msg_data.get("data", {})
+                symbol = data.get("symbol", "")
+                if shard is not None and symbol in shard.awaiting:
+                    if msg_data.get("type") != "snapshot":
+                        return # Delta on top of a pre-reconnect record; wait for the snapshot
+                    shard.awaiting.discard(symbol)
+                    if not shard.awaiting:
+                        shard.state = STREAM_STREAMING
+                # A registry refresh reaches rows whose ticker stays quiet, not just the one in this frame
+                if instruments.version != self.intervals_seen and self._apply_intervals() and self.hub:
+                    self.hub.publish(self.name)
+                if symbol.endswith("USDT") or symbol.endswith("PERP"):
+                    # Normalize symbol
+                    norm_symbol = symbol.replace("USDT", "").replace("PERP", "")
+
+                    # Update if data is present (Bybit sends delta updates).
+                    # The book only exposes a symbol once all three fields have arrived.
+                    # Cached interval from REST (the row keeps its own value until the cache has one; 8 for a new row)
+                    hours = instruments.intervals["bybit"].get(norm_symbol)
+                    if hours is None and norm_symbol not in self.book:
+                        hours = 8
+                    changed = self.book.update(
+                        norm_symbol,
+                        mark_price=float(data["markPrice"]) if "markPrice" in data else None,
+                        funding_rate=float(data["fundingRate"]) if "fundingRate" in data else None,
+                        # Bybit sends nft as milliseconds
+                        next_funding_time=int(data["nextFundingTime"]) if "nextFundingTime" in data else None,
+                        interval_hours=hours,
+                        ts=ts
+                    )
+
+                    if changed and norm_symbol in self.book:
+                        if self.hub: self.hub.publish(self.name)
+            elif msg_data.get("op") == "subscribe" and not msg_data.get("success", True):
+                print(f"Bybit WS Subscription error: {msg_data.get('ret_msg')}")
+                if shard is not None:
+                    # No snapshot will ever come for a rejected topic; don't hold the shard in CONNECTING
+                    shard.awaiting.difference_update(re.findall(r"tickers\.(\w+)", msg_data.get("ret_msg") or ""))
+                    if not shard.awaiting:
+                        shard.state = STREAM_STREAMING
+
+        except Exception as parse_err:
+            pass # Silent for high frequency
+
+    def _apply_intervals(self):
+        """Writes the cached Bybit intervals onto every complete row. Returns True if any row changed."""
+        self.intervals_seen = instruments.version
+        intervals = instruments.intervals["bybit"]
+        book = self.book
+        symbols = book.index.symbols
+        changed = []
+        for row in np.nonzero(book.present())[0].tolist():
+            hours = intervals.get(symbols[row])
+            if hours is not None and book.interval_hours[row] != hours:
+                book.interval_hours[row] = hours
+                changed.append(row)
+        if changed:
+            book.mark_changed(changed)
+        return bool(changed)
 
     def start(self, is_live=False):
+        """Runs the stream as a task on the current (server) event loop."""
         if self.running:
             self.stop()
-        self.data = {}
+        self.book.clear()
+        self.intervals_seen = -1
         self.is_live = is_live
         self.running = True
-        self.thread = threading.Thread(target=self._run_loop, daemon=True)
-        self.thread.start()
+        loop = asyncio.get_running_loop()
+        self.task = loop.create_task(self._connect())
+        self.resync_task = loop.create_task(rest_resync_loop(self))
         print(f"🚀 Bybit WS Manager Started ({'LIVE' if is_live else 'TESTNET'})")
     
     def stop(self):
         self.running = False
-        if self.ws:
-            asyncio.run_coroutine_threadsafe(self.ws.close(), self.loop)
-        if self.thread:
-            self.thread.join(timeout=2)
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.resync_task:
+            self.resync_task.cancel()
+            self.resync_task = None
+        for shard in self.shards:
+            if shard.task:
+                shard.task.cancel()
+        self.shards = []
         print("🛑 Bybit WS Manager Stopped")
     
     def get_rates(self):
-        return self.data
+        return self.book.to_dict()
+
+    @property
+    def version(self):
+        return self.book.seq
+
+    def changed_since(self, version):
+        """Returns (symbols changed after `version`, new version)."""
+        return self.book.changed_since(version)
+
+    def connected_shards(self):
+        return sum(1 for shard in self.shards if shard.ws is not None)
+
+    def check_heartbeat(self, now, timeout):
+        """Closes every shard socket that went quiet; _run_shard reconnects and resubscribes its symbols."""
+        for shard in self.shards:
+            if shard.ws is not None and now - shard.last_message_at > timeout:
+                print(f"💤 Bybit WS Shard {shard.id} silent for {now - shard.last_message_at:.0f}s. Forcing resubscribe...")
+                ws, shard.ws = shard.ws, None
+                asyncio.create_task(ws.close())
+
+    def health(self, now=None):
+        """Freshness summary for /api/ws/status."""
+        now = time.time() if now is None else now
+        stale = self.book.stale_symbols(now)
+        ages = [round(now - shard.last_message_at, 1) if shard.last_message_at else None for shard in self.shards]
+        return {
+            "last_message_age": min((a for a in ages if a is not None), default=None),
+            "shard_message_ages": ages,
+            "stale_count": len(stale),
+            "stale_symbols": stale[:50]
+        }
+
+# Global instances - now redundant but kept for any legacy ref if needed (removed binance_ws_manager)
+# binance_ws_manager = BinanceWebSocketManager() 
+bybit_ws_manager = BybitWebSocketManager()
+
+async def rest_resync_loop(manager):
+    """
+    Re-seeds a stream's book from REST while its socket is not STREAMING (startup, backoff, catching up),
+    so rates never go dark for longer than REST_RESYNC_SECONDS around a reconnect.
+    """
+    while manager.running:
+        if manager.state != STREAM_STREAMING:
+            try:
+                rates = await manager.fetch_snapshot()
+                # Re-check after the await: the socket may have caught up while we were fetching
+                if rates and manager.running and manager.state != STREAM_STREAMING:
+                    targets = manager.resync_targets()
+                    if targets is not None:
+                        rates = {s: r for s, r in rates.items() if s in targets}
+                    if manager.book.apply_rates(rates) and manager.hub:
+                        manager.hub.publish(manager.name)
+            except Exception as e:
+                print(f"REST Resync Error ({manager.name}): {e}")
+        await asyncio.sleep(REST_RESYNC_SECONDS)
+
+# Segment frame: recv time (s), venue id, payload length, then the raw payload bytes
+RECORD_HEADER = struct.Struct("<dBI")
+# Index entry: recv time of the first frame in each second, byte offset of that frame in the segment
+RECORD_INDEX = struct.Struct("<dQ")
+
+def compress_segment(path):
+    """Gzips a closed segment to `<path>.gz` and removes the original. Runs in a worker thread."""
+    with open(path, "rb") as src, gzip.open(path + ".gz", "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.remove(path)
+
+class MarketDataRecorder:
+    """
+    Persists every raw market-data frame to append-only segments `md-<start>.seg` plus an `.idx` offset index.
+    Frames are queued without blocking the stream; a writer task does the disk work in a thread.
+    Segments roll by size or age and are gzipped in the background.
+    """
+
+    def __init__(self, directory, queue_size=None, segment_bytes=None, segment_seconds=None):
+        self.directory = directory
+        self.queue = asyncio.Queue(maxsize=queue_size or RECORD_QUEUE_SIZE)
+        self.segment_bytes = segment_bytes or RECORD_SEGMENT_BYTES
+        self.segment_seconds = segment_seconds or RECORD_SEGMENT_SECONDS
+        self.task = None
+        self.lock = threading.Lock() # Serializes the writer thread against close() on shutdown
+        self.pending = set() # Background compression tasks
+        self.writing = None # Batch handed to the writer thread and not written yet
+        self.stopped = False
+        self.written = 0
+        self.dropped = 0
+        self.segments = 0
+        self._seg = None
+        self._idx = None
+        self._seg_path = None
+        self._offset = 0
+        self._opened_at = 0
+        self._index_sec = None
+
+    def record(self, venue, message, ts):
+        """Called from the stream loop for every frame. Never blocks: a full queue drops the frame."""
+        try:
+            self.queue.put_nowait((ts, venue, message))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.task = asyncio.get_running_loop().create_task(self._writer())
+        # Segments left open by a previous run are complete up to their last frame
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".seg"):
+                self._compress(os.path.join(self.directory, name))
+        print(f"📼 Market data recorder writing to {self.directory}")
+
+    async def stop(self):
+        """Writes the frames still queued, then closes and compresses the last segment. Disk work runs in threads."""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        for path in await asyncio.to_thread(self._flush, batch):
+            if path:
+                self._compress(path)
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+
+    def _flush(self, batch):
+        """Final write on stop(). Returns (rolled segment, last segment) paths, either may be None."""
+        with self.lock:
+            self.stopped = True
+            # The writer thread may not have reached its batch yet: it goes first, ahead of the queued frames
+            if self.writing:
+                batch = self.writing + batch
+                self.writing = None
+            rolled = self._write_frames(batch) if batch else None
+            return rolled, self._close()
+
+    def _compress(self, path):
+        task = asyncio.create_task(asyncio.to_thread(compress_segment, path))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _writer(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < 2000:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                self.writing = batch
+                rolled = await asyncio.to_thread(self._write_batch, batch)
+                if rolled:
+                    self._compress(rolled)
+            except Exception as e:
+                print(f"Recorder Write Error: {e}")
+
+    def _open(self, ts):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(ts)) + f"-{int(ts * 1000) % 1000:03d}"
+        base = os.path.join(self.directory, f"md-{stamp}")
+        self._seg_path = base + ".seg"
+        self._seg = open(self._seg_path, "ab")
+        self._idx = open(base + ".idx", "ab")
+        self._offset = self._seg.tell()
+        self._opened_at = ts
+        self._index_sec = None
+        self.segments += 1
+
+    def close(self):
+        """Closes the current segment. Returns its path (still uncompressed), or None."""
+        with self.lock:
+            return self._close()
+
+    def _close(self):
+        if self._seg is None:
+            return None
+        self._seg.close()
+        self._idx.close()
+        path, self._seg, self._idx = self._seg_path, None, None
+        return path
+
+    def _write_batch(self, batch):
+        """Appends a batch of frames. Returns the path of a segment that was rolled over, if any."""
+        with self.lock:
+            if self.stopped:
+                return None # stop() already wrote it
+            self.writing = None
+            return self._write_frames(batch)
+
+    def _write_frames(self, batch):
+        """Appends frames to the current segment (rolling it first if due). Caller holds the lock."""
+        rolled = None
+        first_ts = batch[0][0]
+        if self._seg is not None and (self._offset >= self.segment_bytes or first_ts - self._opened_at >= self.segment_seconds):
+            rolled = self._close()
+        if self._seg is None:
+            self._open(first_ts)
+
+        chunks = []
+        index = []
+        offset = self._offset
+        for ts, venue, message in batch:
+            data = message.encode() if isinstance(message, str) else message
+            sec = int(ts)
+            if sec != self._index_sec:
+                self._index_sec = sec
+                index.append(RECORD_INDEX.pack(ts, offset))
+            chunks.append(RECORD_HEADER.pack(ts, venue, len(data)))
+            chunks.append(data)
+            offset += RECORD_HEADER.size + len(data)
+
+        self._seg.write(b"".join(chunks))
+        self._seg.flush()
+        if index:
+            self._idx.write(b"".join(index))
+            self._idx.flush()
+        self._offset = offset
+        self.written += len(batch)
+        return rolled
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "segment": self._seg_path,
+            "written": self.written,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "segments": self.segments
+        }
+
+class SegmentReader:
+    """
+    Iterates recorded frames as (recv ts, venue id, payload bytes) in the order they were received.
+    Reads `.seg` and rolled `.seg.gz` segments; uses the `.idx` files to skip ahead to `start`.
+    """
+
+    def __init__(self, directory, start=None, end=None):
+        self.directory = directory
+        self.start = start
+        self.end = end
+
+    def segments(self):
+        """[(segment path, index path)] sorted by segment start time."""
+        found = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".seg") or name.endswith(".seg.gz"):
+                base = name[:-len(".seg.gz")] if name.endswith(".gz") else name[:-len(".seg")]
+                found.append((os.path.join(self.directory, name), os.path.join(self.directory, base + ".idx")))
+        return found
+
+    @staticmethod
+    def read_index(path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        n = len(data) // RECORD_INDEX.size
+        return [RECORD_INDEX.unpack_from(data, i * RECORD_INDEX.size) for i in range(n)]
+
+    def __iter__(self):
+        segments = self.segments()
+        indexes = [self.read_index(idx) for _, idx in segments]
+        for i, (path, _) in enumerate(segments):
+            index = indexes[i]
+            offset = 0
+            if self.start is not None:
+                # Whole segment precedes `start` if the next one already began before it
+                nxt = indexes[i + 1] if i + 1 < len(indexes) else None
+                if nxt and nxt[0][0] <= self.start:
+                    continue
+                for ts, off in index:
+                    if ts > self.start:
+                        break
+                    offset = off
+            if self.end is not None and index and index[0][0] > self.end:
+                return
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rb") as f:
+                if offset:
+                    f.seek(offset)
+                while True:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break # End of segment (or a frame cut short by a crash)
+                    ts, venue, length = RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length:
+                        break
+                    if self.start is not None and ts < self.start:
+                        continue
+                    if self.end is not None and ts > self.end:
+                        return
+                    yield ts, venue, payload
+
+# --- MARKET DATA HUB ---
+class MarketDataHub:
+    """
+    Runs every exchange market-data stream as a task on the server's own event loop.
+    Frames are applied without awaiting, so readers always see a consistent snapshot.
+    """
+
+    def __init__(self):
+        self.streams = {} # name -> (manager, start kwargs)
+        self.version = 0 # Bumped on every applied frame, across all streams
+        self.last_update = {} # name -> time of last applied frame
+        self.watchdog_task = None
+        self.recorder = None # MarketDataRecorder when MARKET_DATA_RECORD_DIR is set
+        self.started = False
+        self.lazy = {} # name -> demand check () -> bool, for streams that only run while someone reads them
+        self.last_demand = {} # name -> last time the lazy stream was wanted
+        self.payloads = {} # name -> ((book, version), client payload) reused by snapshot() until the book changes
+        self.changed = asyncio.Event() # Set on every applied frame; the RateBroadcaster clears it
+        self.watchers = set() # More change events (one per MarketDataShare follower connection)
+        self.remote = None # Follower worker: stream names active on the owner (see MarketDataShare)
+        self.following = False # Multi-worker and not the owner: never connects to the exchanges itself
+
+    def register(self, name, manager, demand=None, **start_kwargs):
+        """`demand` makes the stream lazy: it runs only while demand() is true (or touch() was called recently)."""
+        manager.name = name
+        manager.hub = self
+        self.streams[name] = (manager, start_kwargs)
+        if demand is not None:
+            self.lazy[name] = demand
+
+    def get(self, name):
+        return self.streams[name][0]
+
+    def is_active(self, name):
+        """False for a lazy stream that is currently stopped (its book is not being read or refreshed)."""
+        if self.remote is not None:
+            return name in self.remote
+        return name not in self.lazy or self.streams[name][0].running
+
+    def touch(self, name):
+        """Marks a lazy stream as wanted right now, starting it if needed. Must be called from the server loop.
+        On a follower the demand is only recorded; MarketDataShare forwards it to the owner."""
+        if name not in self.lazy:
+            return
+        self.last_demand[name] = time.time()
+        manager, start_kwargs = self.streams[name]
+        if self.started and not self.following and not manager.running:
+            print(f"📈 Demand for {name}: starting stream")
+            manager.start(**start_kwargs)
+
+    def _reconcile_demand(self, now):
+        """Starts lazy streams someone wants; stops those idle for longer than STREAM_IDLE_GRACE_SECONDS."""
+        for name, demand in self.lazy.items():
+            try:
+                wanted = demand()
+            except Exception as e:
+                print(f"Demand Check Error ({name}): {e}")
+                wanted = True
+            if wanted:
+                self.touch(name)
+                continue
+            manager = self.streams[name][0]
+            if manager.running and now - self.last_demand.get(name, 0) > STREAM_IDLE_GRACE_SECONDS:
+                print(f"📉 No demand for {name} in {STREAM_IDLE_GRACE_SECONDS:.0f}s: stopping stream")
+                manager.stop()
+
+    def start(self):
+        """Starts any registered stream that is not running (lazy ones only if wanted). Must be called from the server loop.
+        A no-op on a follower: the owner's streams fill its books."""
+        if self.following:
+            return False
+        self.started = True
+        for name, (manager, start_kwargs) in self.streams.items():
+            if name in self.lazy:
+                continue
+            if not manager.running:
+                manager.start(**start_kwargs)
+        self._reconcile_demand(time.time())
+        if self.watchdog_task is None:
+            self.watchdog_task = asyncio.get_running_loop().create_task(self._watchdog())
+        if MARKET_DATA_RECORD_DIR and self.recorder is None:
+            self.recorder = MarketDataRecorder(MARKET_DATA_RECORD_DIR)
+            self.recorder.start()
+        return True
+
+    async def stop(self):
+        if self.following:
+            return False
+        self.started = False
+        for manager, _ in self.streams.values():
+            manager.stop()
+        if self.watchdog_task:
+            self.watchdog_task.cancel()
+            self.watchdog_task = None
+        if self.recorder:
+            recorder, self.recorder = self.recorder, None
+            await recorder.stop()
+        return True
+
+    async def _watchdog(self):
+        """
+        Heartbeat check: a connection that stops delivering frames is torn down and resubscribed.
+        Also starts / idles out the lazy streams.
+        """
+        while True:
+            await asyncio.sleep(MARKET_DATA_HEARTBEAT_TIMEOUT / 4)
+            now = time.time()
+            self._reconcile_demand(now)
+            for manager, _ in self.streams.values():
+                if manager.running:
+                    try:
+                        manager.check_heartbeat(now, MARKET_DATA_HEARTBEAT_TIMEOUT)
+                    except Exception as e:
+                        print(f"Watchdog Error ({manager.name}): {e}")
+
+    def record(self, name, message, ts):
+        """Hands a raw frame to the recorder (if enabled), before it is applied."""
+        if self.recorder:
+            self.recorder.record(RECORD_VENUES.get(name, 0), message, ts)
+
+    def publish(self, name):
+        """Called by a manager after it has fully applied a frame."""
+        self.version += 1
+        self.last_update[name] = time.time()
+        self.changed.set()
+        for event in self.watchers:
+            event.set()
+
+    def books(self):
+        """Returns { stream name -> RateBook } for vectorized readers."""
+        return {name: manager.book for name, (manager, _) in self.streams.items()}
+
+    def versions(self):
+        """Returns { stream name -> book version } for every active stream, a cursor for changed_since()."""
+        return {name: manager.version for name, (manager, _) in self.streams.items() if self.is_active(name)}
+
+    def changed_since(self, cursors):
+        """
+        Returns { stream name -> symbols changed after cursors[name] } and the new cursors.
+        A stream whose book was cleared since its cursor maps to None (caller must resync).
+        """
+        changes, new_cursors = {}, {}
+        for name, (manager, _) in self.streams.items():
+            if not self.is_active(name):
+                continue
+            since = cursors.get(name, 0)
+            if manager.book.needs_resync(since):
+                changes[name], new_cursors[name] = None, manager.version
+            else:
+                changes[name], new_cursors[name] = manager.changed_since(since)
+        return changes, new_cursors
+
+    def snapshot(self):
+        """
+        Returns { stream name -> client payload } for every active stream, taken between two frames.
+        Payloads are rebuilt only for books that changed; treat them as read-only.
+        """
+        out = {}
+        for name, (manager, _) in self.streams.items():
+            if not self.is_active(name):
+                continue
+            key = (id(manager.book), manager.version)
+            cached = self.payloads.get(name)
+            if cached is None or cached[0] != key:
+                cached = self.payloads[name] = (key, manager.book.to_payload())
+            out[name] = cached[1]
+        return out
+
+market_hub = MarketDataHub()
+market_hub.register("binance_live", binance_live_wm, is_live=True)
+# Testnet prices are only shown to testnet clients, so that connection runs on demand
+market_hub.register("binance_testnet", binance_test_wm, demand=lambda: manager.wants_testnet(), is_live=False)
+market_hub.register("bybit", bybit_ws_manager, is_live=True)
+
+SHARE_FRAME = struct.Struct("<I") # Length prefix of every MarketDataShare message
+
+class MarketDataShare:
+    """
+    Multi-worker mode (MARKET_DATA_SOCKET set): one uvicorn worker owns the exchange streams and the others only fan
+    out to their /ws/clients connections. The owner is whoever holds an flock on MARKET_DATA_LOCK_FILE; it publishes
+    book changes on a unix socket and followers apply them to their own books, so everything downstream of the hub
+    (encoders, broadcaster, opportunity tables) runs unchanged in every worker.
+    Backpressure: each follower is sent the changes since its own cursors only once its previous message has
+    drained, so a slow follower gets fewer, larger messages and never an unbounded queue.
+    Followers forward lazy-stream demand (testnet clients) and auto-trade HTTP requests to the owner, and take over
+    if the owner exits.
+    """
+
+    def __init__(self, hub, socket_path, lock_path):
+        self.hub = hub
+        hub.following = True # Until this worker takes the lock
+        self.socket_path = socket_path
+        self.lock_path = lock_path
+        self.lock_file = None
+        self.owner = False
+        self.server = None
+        self.on_owner = [] # Callbacks run once this worker becomes the owner
+        self.followers = 0
+        self.messages = 0 # Sent (owner) / applied (follower)
+        self.stale = {} # Follower: stream name -> stale symbols in the last owner message
+        self.writer = None # Follower: stream to the owner while connected
+        self.calls = {} # Follower: call id -> Future of a forwarded request's reply
+        self.call_id = 0
+        self.serving = set() # Owner: forwarded requests being run
+
+    def try_acquire(self):
+        """Takes the owner lock if nobody holds it."""
+        f = open(self.lock_path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.lock_file = f
+        return True
+
+    async def run(self):
+        """Follows the owner until this worker can take the lock, then owns the streams for good."""
+        while not self.try_acquire():
+            try:
+                await self.follow()
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                pass # Owner gone or silent: retry, or take over
+            except Exception as e:
+                print(f"Market Data Follower Error: {e}")
+            await asyncio.sleep(MARKET_DATA_SHARE_HEARTBEAT_SECONDS)
+        await self.become_owner()
+
+    async def become_owner(self):
+        print(f"👑 Worker {os.getpid()} owns the market-data streams")
+        self.owner = True
+        self.hub.following = False
+        self.hub.remote = None
+        self.hub.start()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path) # Left behind by the previous owner
+        self.server = await asyncio.start_unix_server(self._serve, path=self.socket_path)
+        for callback in self.on_owner:
+            callback()
+
+    def stop(self):
+        if self.server:
+            self.server.close()
+        if self.lock_file:
+            self.lock_file.close() # Releases the flock: a follower takes over
+            self.lock_file = None
+
+    # --- owner side ---
+
+    def _changes(self, cursors):
+        """Message with every row changed since `cursors` (updated in place), per active stream."""
+        books = {}
+        now = time.time()
+        for name, (manager, _) in self.hub.streams.items():
+            if not self.hub.is_active(name):
+                cursors.pop(name, None)
+                continue
+            book = manager.book
+            since = cursors.get(name, 0)
+            reset = name not in cursors or book.needs_resync(since)
+            rows = book.changed_rows_since(0 if reset else since)
+            cursors[name] = book.seq
+            symbols = book.index.symbols
+            books[name] = {
+                "reset": reset,
+                "rows": [[symbols[r], *values] for r, values in zip(rows.tolist(), zip(
+                    book.funding_rate[rows].tolist(), book.mark_price[rows].tolist(), book.next_funding_time[rows].tolist(),
+                    book.interval_hours[rows].tolist(), book.updated_at[rows].tolist()))],
+                # Freshness travels separately: quotes refreshed without a value change have no new version
+                "stale": book.stale_symbols(now)
+            }
+        return {"books": books, "active": [name for name in self.hub.streams if self.hub.is_active(name)], "ts": now}
+
+    async def _serve(self, reader, writer):
+        self.followers += 1
+        changed = asyncio.Event()
+        self.hub.watchers.add(changed)
+        demand = asyncio.create_task(self._read_follower(reader, writer))
+        cursors = {}
+        try:
+            while not demand.done():
+                changed.clear()
+                data = dump_bytes(self._changes(cursors))
+                writer.write(SHARE_FRAME.pack(len(data)) + data)
+                await writer.drain() # Backpressure: nothing more is built until the follower has taken this
+                self.messages += 1
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=MARKET_DATA_SHARE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.followers -= 1
+            self.hub.watchers.discard(changed)
+            demand.cancel()
+            writer.close()
+
+    async def _read_follower(self, reader, writer):
+        """
+        Lazy streams wanted by a follower's clients (kept running here) and forwarded requests (run here, answered
+        on the same stream). Returns when the follower leaves.
+        """
+        try:
+            while True:
+                header = await reader.readexactly(SHARE_FRAME.size)
+                message = json.loads(await reader.readexactly(SHARE_FRAME.unpack(header)[0]))
+                if "call" in message:
+                    task = asyncio.create_task(self._run_call(message, writer))
+                    self.serving.add(task)
+                    task.add_done_callback(self.serving.discard)
+                    continue
+                for name in message.get("demand", []):
+                    if name in self.hub.lazy:
+                        self.hub.touch(name)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def _run_call(self, message, writer):
+        """Runs a follower's HTTP request through this worker's app and writes the reply back."""
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://owner") as client:
+                response = await client.request(
+                    message["method"], message["path"], headers=message["headers"],
+                    content=base64.b64decode(message["body"]), timeout=MARKET_DATA_SHARE_CALL_TIMEOUT
+                )
+            # The body is already decoded; its encoding / length headers no longer apply
+            headers = [[k, v] for k, v in response.headers.items() if k not in ("content-encoding", "content-length", "transfer-encoding")]
+            reply = {"reply": message["call"], "status": response.status_code, "headers": headers,
+                     "body": base64.b64encode(response.content).decode()}
+        except Exception as e:
+            print(f"Forwarded Request Error ({message.get('path')}): {e}")
+            reply = {"reply": message["call"], "status": 502, "headers": [["content-type", "application/json"]],
+                     "body": base64.b64encode(dump_bytes({"detail": f"Owner worker failed the request: {e}"})).decode()}
+        try:
+            data = dump_bytes(reply)
+            writer.write(SHARE_FRAME.pack(len(data)) + data)
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass # Follower gone; its caller times out
+
+    # --- follower side ---
+
+    async def follow(self):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        print(f"🔗 Worker {os.getpid()} following the market-data owner")
+        demand = asyncio.create_task(self._send_demand(writer))
+        self.writer = writer
+        try:
+            while True:
+                header = await asyncio.wait_for(reader.readexactly(SHARE_FRAME.size), timeout=MARKET_DATA_SHARE_HEARTBEAT_SECONDS * 5)
+                message = json.loads(await reader.readexactly(SHARE_FRAME.unpack(header)[0]))
+                if "reply" in message:
+                    future = self.calls.get(message["reply"])
+                    if future and not future.done():
+                        future.set_result(message)
+                    continue
+                self.apply(message)
+        finally:
+            self.writer = None
+            for future in self.calls.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("market-data owner connection lost"))
+            demand.cancel()
+            writer.close()
+
+    async def forward(self, method, path, headers, body):
+        """
+        Runs an HTTP request on the owner, where the auto-trade sessions live. Returns (status, headers, body).
+        Raises ConnectionError while no owner is connected, asyncio.TimeoutError if it does not answer.
+        """
+        if self.writer is None:
+            raise ConnectionError("no market-data owner connected")
+        self.call_id += 1
+        call = self.call_id
+        future = self.calls[call] = asyncio.get_running_loop().create_future()
+        try:
+            data = dump_bytes({"call": call, "method": method, "path": path, "headers": headers,
+                               "body": base64.b64encode(body).decode()})
+            self.writer.write(SHARE_FRAME.pack(len(data)) + data)
+            await self.writer.drain()
+            reply = await asyncio.wait_for(future, timeout=MARKET_DATA_SHARE_CALL_TIMEOUT)
+        finally:
+            self.calls.pop(call, None)
+        return reply["status"], reply["headers"], base64.b64decode(reply["body"])
+
+    def apply(self, message):
+        """
+        Writes one owner message into this worker's books. Publishes only the streams it changed (rows, a reset,
+        a different stale set or an activity flip), so a heartbeat with nothing new wakes nobody.
+        """
+        active = set(message["active"])
+        flipped = active ^ (self.hub.remote or set())
+        self.hub.remote = active
+        now = time.time()
+        for name, update in message["books"].items():
+            if name not in self.hub.streams:
+                continue
+            book = self.hub.get(name).book
+            if update["reset"]:
+                book.clear()
+            for symbol, rate, mark_price, next_funding, interval, updated_at in update["rows"]:
+                book.update(symbol, mark_price, rate, next_funding, interval, ts=updated_at)
+            stale = set(update["stale"])
+            book.refresh(now, exclude=stale)
+            if update["reset"] or update["rows"] or stale != self.stale.get(name) or name in flipped:
+                self.hub.publish(name)
+            self.stale[name] = stale
+        self.messages += 1
+
+    async def _send_demand(self, writer):
+        while True:
+            now = time.time()
+            wanted = [name for name, demand in self.hub.lazy.items()
+                      if demand() or now - self.hub.last_demand.get(name, 0) < MARKET_DATA_SHARE_HEARTBEAT_SECONDS * 5]
+            data = dump_bytes({"demand": wanted})
+            writer.write(SHARE_FRAME.pack(len(data)) + data)
+            await writer.drain()
+            await asyncio.sleep(MARKET_DATA_SHARE_HEARTBEAT_SECONDS)
+
+    def status(self):
+        return {
+            "enabled": True,
+            "role": "owner" if self.owner else "follower",
+            "pid": os.getpid(),
+            "followers": self.followers,
+            "messages": self.messages
+        }
 
-# Global instances - now redundant but kept for any legacy ref if needed (removed binance_ws_manager)
-# binance_ws_manager = BinanceWebSocketManager() 
-bybit_ws_manager = BybitWebSocketManager()
+market_share = MarketDataShare(market_hub, MARKET_DATA_SOCKET, MARKET_DATA_LOCK_FILE) if MARKET_DATA_SOCKET and fcntl else None
+
+# Shared opportunity tables (auto-trader, /api/opportunities, /ws/clients opportunities channel)
+opportunity_tables = {
+    "live": OpportunityTable(market_hub, "binance_live"),
+    "testnet": OpportunityTable(market_hub, "binance_testnet")
+}
 
 async def fetch_binance_rates(is_live: bool = False):
     try:
@@ -673,8 +3061,7 @@ async def fetch_binance_rates(is_live: bool = False):
         url = "https://fapi.binance.com/fapi/v1/premiumIndex" if is_live else "https://testnet.binancefuture.com/fapi/v1/premiumIndex"
         print(f"DEBUG: Fetching Binance Rates from: {url}")
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, requests.get, url)
+        response = await public_api.get(url)
         if response.status_code == 200:
             data = response.json()
             rates = {}
@@ -685,7 +3072,7 @@ async def fetch_binance_rates(is_live: bool = False):
                         "rate": float(item['lastFundingRate']),
                         "markPrice": float(item['markPrice']),
                         "nextFundingTime": item['nextFundingTime'],
-                        "fundingIntervalHours": BINANCE_INTERVAL_CACHE.get(symbol, 8)
+                        "fundingIntervalHours": instruments.intervals["binance"].get(symbol, 8)
                     }
             return rates
     except Exception as e:
@@ -695,13 +3082,12 @@ async def fetch_binance_rates(is_live: bool = False):
 
 async def fetch_bybit_rates(is_live: bool = False):
     try:
-        loop = asyncio.get_event_loop()
         params = {"category": "linear"}
         # Always use Live API for accurate funding scanner rates
         url = BYBIT_API_URL
         print(f"DEBUG: Fetching Bybit Rates from: {url} (Scanner always uses Live)")
         
-        response = await loop.run_in_executor(None, functools.partial(requests.get, url, params=params))
+        response = await public_api.get(url, params=params)
         
         if response.status_code == 200:
             data = response.json()
@@ -775,9 +3161,9 @@ async def send_telegram_alert(req: TelegramAlertRequest):
             del payload["text"]
             # method = "sendPhoto" # Requires multipart if sending file, but URL works too
             # For simplicity, we use sendMessage if no image, or sendPhoto if image URL is provided.
-            response = requests.post(url + "sendPhoto", data=payload)
+            response = await http_pool.post(url + "sendPhoto", data=payload)
         else:
-            response = requests.post(url + "sendMessage", data=payload)
+            response = await http_pool.post(url + "sendMessage", data=payload)
             
         data = response.json()
         if data.get("ok"):
@@ -796,14 +3182,16 @@ async def get_rates(is_live: bool = False, use_websocket: bool = True):
     # 1. Binance Data
     # Select correct manager based on requested mode
     target_manager = binance_live_wm if is_live else binance_test_wm
+    if not is_live:
+        # Polling testnet readers keep the on-demand testnet stream alive (first calls fall back to REST)
+        market_hub.touch("binance_testnet")
     
     use_bn_ws = (use_websocket and target_manager.running)
                  
-    bn_ws_data = target_manager.get_rates() if use_bn_ws else {}
+    bn_ws_data = target_manager.book.to_payload() if use_bn_ws else {}
     
     if bn_ws_data:
-        binance_rates = {sym: {"rate": info['fundingRate'], "markPrice": info['markPrice'], "nextFundingTime": info['nextFundingTime'], "fundingIntervalHours": info.get('fundingIntervalHours', 8)} 
-                         for sym, info in bn_ws_data.items()}
+        binance_rates = bn_ws_data
     else:
         binance_rates = await fetch_binance_rates(is_live)
     
@@ -813,11 +3201,10 @@ async def get_rates(is_live: bool = False, use_websocket: bool = True):
                  bybit_ws_manager.running and 
                  bybit_ws_manager.is_live == is_live)
 
-    bb_ws_data = bybit_ws_manager.get_rates() if use_bb_ws else {}
+    bb_ws_data = bybit_ws_manager.book.to_payload() if use_bb_ws else {}
     
     if bb_ws_data:
-        bybit_rates = {sym: {"rate": info['fundingRate'], "markPrice": info['markPrice'], "nextFundingTime": info['nextFundingTime'], "fundingIntervalHours": info.get('fundingIntervalHours', 8)} 
-                       for sym, info in bb_ws_data.items()}
+        bybit_rates = bb_ws_data
     else:
         bybit_rates = await fetch_bybit_rates(is_live)
     
@@ -827,18 +3214,40 @@ async def get_rates(is_live: bool = False, use_websocket: bool = True):
         "source": "websocket" if (bn_ws_data or bb_ws_data) else "rest"
     }
 
+@app.get("/api/opportunities")
+async def get_opportunities(is_live: bool = True, top_n: int = 50, sort: str = "rate_diff"):
+    """
+    Ranked cross-venue opportunities from the shared OpportunityTable (rate diff, price divergence,
+    annualized yield, time to funding, interval mismatch). `sort` is one of OPPORTUNITY_SORTS.
+    """
+    env = "live" if is_live else "testnet"
+    if not is_live:
+        market_hub.touch("binance_testnet")
+    table = opportunity_tables[env]
+    if sort not in OPPORTUNITY_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(OPPORTUNITY_SORTS)}")
+    if not table.is_active():
+        return {"env": env, "sort": sort, "rows": [], "source": "warming_up"}
+    return {
+        "env": env,
+        "sort": sort,
+        "rows": table.top(top_n or None, sort),
+        "source": "websocket",
+        "timestamp": time.time() * 1000
+    }
+
 @app.post("/api/ws/start")
 async def start_websocket(is_live: bool = False):
     """
     Legacy Endpoint: Ensures connections are running.
     Now we run both permanently, so this just verifies they are up.
     """
-    if not binance_live_wm.running:
-        binance_live_wm.start(is_live=True)
-    if not binance_test_wm.running:
-        binance_test_wm.start(is_live=False)
-    if not bybit_ws_manager.running:
-        bybit_ws_manager.start(is_live=True)
+    if not market_hub.start():
+        return {
+            "status": "following",
+            "mode": "DUAL_STREAM",
+            "message": "Streams run on the market-data owner worker."
+        }
         
     return {
         "status": "started", 
@@ -849,9 +3258,8 @@ async def start_websocket(is_live: bool = False):
 @app.post("/api/ws/stop")
 async def stop_websocket():
     """Stop all WebSocket connections."""
-    binance_live_wm.stop()
-    binance_test_wm.stop()
-    bybit_ws_manager.stop()
+    if not await market_hub.stop():
+        return {"status": "following"}
     return {"status": "stopped"}
 
 @app.get("/api/ws/status")
@@ -860,20 +3268,38 @@ async def websocket_status():
     return {
         "binance_live": {
             "running": binance_live_wm.running,
+            "state": binance_live_wm.state,
             "url": binance_live_wm.get_ws_url(),
-            "symbols_count": len(binance_live_wm.data)
+            "symbols_count": len(binance_live_wm.book),
+            **binance_live_wm.health()
         },
         "binance_testnet": {
             "running": binance_test_wm.running,
+            "on_demand": True,
+            "testnet_clients": sum(1 for client in manager.clients.values() if client.is_live is False),
+            "state": binance_test_wm.state,
             "url": binance_test_wm.get_ws_url(),
-            "symbols_count": len(binance_test_wm.data)
+            "symbols_count": len(binance_test_wm.book),
+            **binance_test_wm.health()
         },
         "bybit": {
             "running": bybit_ws_manager.running,
+            "state": bybit_ws_manager.state,
             "mode": "LIVE" if bybit_ws_manager.is_live else "TESTNET",
             "url": bybit_ws_manager.get_ws_url(),
-            "symbols_count": len(bybit_ws_manager.data)
-        }
+            "symbols_count": len(bybit_ws_manager.book),
+            "subscribed_count": len(bybit_ws_manager.universe),
+            "shards": len(bybit_ws_manager.shards),
+            "shards_connected": bybit_ws_manager.connected_shards(),
+            **bybit_ws_manager.health()
+        },
+        "stale_after_seconds": MARKET_DATA_STALE_SECONDS,
+        "recorder": market_hub.recorder.stats() if market_hub.recorder else None,
+        "clients": manager.stats(),
+        "share": market_share.status() if market_share else {"enabled": False},
+        "http": {**http_pool.stats(), "public": public_api.stats(), "proxy": proxy_cache.stats()},
+        "instruments": instruments.stats(),
+        "loop": loop_watchdog.stats()
     }
 
 from pydantic import BaseModel
@@ -881,7 +3307,6 @@ import time
 import hmac
 import hashlib
 import json
-import requests
 
 # Request Model
 class OrderRequest(BaseModel):
@@ -956,7 +3381,7 @@ async def verify_bybit_keys(
         
         url = f"{base_url}{endpoint}?{params}"
         print(f"Verifying Bybit key at: {url}")
-        response = requests.get(url, headers=headers)
+        response = await http_pool.get(url, headers=headers)
         print(f"Bybit verify response status: {response.status_code}")
         print(f"Bybit verify response text: {response.text[:200] if response.text else 'EMPTY'}")
         
@@ -994,7 +3419,7 @@ async def verify_binance_keys(
         url = f"{base_url}{endpoint}?{query_string}&signature={signature}"
         headers = {"X-MBX-APIKEY": api_key}
         
-        response = requests.get(url, headers=headers)
+        response = await http_pool.get(url, headers=headers)
         
         if response.status_code == 200:
             return {"valid": True, "message": "API keys are valid"}
@@ -1021,31 +3446,26 @@ async def place_order(
 
 # --- REUSABLE LOGIC ---
 
-async def get_bybit_instrument_info_cached(symbol):
-    if symbol in INSTRUMENT_CACHE:
-        return INSTRUMENT_CACHE[symbol]
-    
+async def get_bybit_instrument(symbol):
+    """Registry entry for a Bybit symbol; a listing newer than the last bulk load is fetched once and added."""
+    symbol = symbol[:-4] if symbol.endswith("USDT") else symbol
+    info = instruments.get("bybit", symbol)
+    if info is not None:
+        return info
     try:
         url = "https://api.bybit.com/v5/market/instruments-info"
         params = {"category": "linear", "symbol": symbol + "USDT"}
-        
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, functools.partial(requests.get, url, params=params))
+        response = await public_api.get(url, params=params)
         data = response.json()
-        
         if data["retCode"] == 0 and len(data["result"]["list"]) > 0:
-             info = data["result"]["list"][0]["lotSizeFilter"]
-             INSTRUMENT_CACHE[symbol] = {
-                 "qtyStep": float(info["qtyStep"]),
-                 "minOrderQty": float(info["minOrderQty"]),
-                 "maxOrderQty": float(info["maxOrderQty"])
-             }
-             return INSTRUMENT_CACHE[symbol]
+            info = bybit_instrument(data["result"]["list"][0])
+            instruments.add("bybit", symbol, info)
+            return info
     except Exception as e:
         print(f"Instrument Info Error: {e}")
-    
-    # Fallback default
-    return {"qtyStep": 0.001, "minOrderQty": 0.001, "maxOrderQty": 10000}
+
+    print(f"⚠️ No Bybit instrument info for {symbol}, using default 0.001 step")
+    return {"stepSize": 0.001, "minQty": 0.001, "maxQty": 10000, "maxLeverage": None}
 
 def adjust_qty_to_step(qty, step_size, min_qty):
     if qty < min_qty: return min_qty
@@ -1082,15 +3502,15 @@ async def execute_bybit_logic(api_key, api_secret, symbol, side, qty, leverage,
                 "X-BAPI-RECV-WINDOW": win_lev,
                 "Content-Type": "application/json"
             }
-            requests.post(leverage_url, headers=headers_lev, data=lev_json)
+            await http_pool.post(leverage_url, headers=headers_lev, content=lev_json)
         except Exception as e:
             print(f"Set Leverage Warning: {e}")
 
         # 2. Prepare Order with Correct Precision
         # Fetch instrument info to fix "Qty invalid" errors
-        inst_info = await get_bybit_instrument_info_cached(symbol)
-        adjusted_qty = adjust_qty_to_step(float(qty), inst_info["qtyStep"], inst_info["minOrderQty"])
-        print(f"DEBUG: Adjusting Qty for {symbol}: {qty} -> {adjusted_qty} (Step: {inst_info['qtyStep']})")
+        inst_info = await get_bybit_instrument(symbol)
+        adjusted_qty = adjust_qty_to_step(float(qty), inst_info["stepSize"], inst_info["minQty"])
+        print(f"DEBUG: Adjusting Qty for {symbol}: {qty} -> {adjusted_qty} (Step: {inst_info['stepSize']})")
 
         order_payload = {
             "category": category,
@@ -1112,8 +3532,7 @@ async def execute_bybit_logic(api_key, api_secret, symbol, side, qty, leverage,
             "Content-Type": "application/json"
         }
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.post(url, headers=headers, data=payload_json))
+        response = await http_pool.post(url, headers=headers, content=payload_json)
         
         data = response.json()
         
@@ -1156,12 +3575,12 @@ async def execute_binance_logic(api_key, api_secret, symbol, side, qty, leverage
             lev_headers = { "X-MBX-APIKEY": api_key }
             lev_url = f"{base_url}{lev_endpoint}?{lev_qs}&signature={lev_sig}"
             
-            await asyncio.to_thread(requests.post, lev_url, headers=lev_headers, timeout=5)
+            await http_pool.post(lev_url, headers=lev_headers, timeout=5)
         except Exception as e:
             print(f"Binance Leverage Error (Non-fatal): {e}")
 
         # 2. Precision & Rounding (Use Cache)
-        info = BINANCE_SYMBOL_INFO.get(sym_only)
+        info = instruments.get("binance", sym_only)
         if info:
             qty_precision = info["quantityPrecision"]
             step_size = info["stepSize"]
@@ -1194,7 +3613,7 @@ async def execute_binance_logic(api_key, api_secret, symbol, side, qty, leverage
         final_url = f"{base_url}/fapi/v1/order?{query_string}&signature={signature}"
         headers = { "X-MBX-APIKEY": api_key }
         
-        response = await asyncio.to_thread(requests.post, final_url, headers=headers, timeout=10)
+        response = await http_pool.post(final_url, headers=headers, timeout=10)
         data = response.json()
         
         if "code" in data and data["code"] != 0:
@@ -1242,8 +3661,7 @@ async def get_wallet_balance(
         
         final_url = f"{url}?{params}"
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(final_url, headers=headers))
+        response = await http_pool.get(final_url, headers=headers)
         
         if response.status_code != 200:
             print(f"Bybit Wallet Error ({response.status_code}): {response.text}")
@@ -1299,8 +3717,7 @@ async def set_bybit_demo_balance(
         
         final_url = f"{base_url}{endpoint}?{params}"
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(final_url, headers=headers))
+        response = await http_pool.get(final_url, headers=headers)
         
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=f"Failed to get current balance: {response.text[:200]}")
@@ -1363,10 +3780,7 @@ async def set_bybit_demo_balance(
         }
         
         print(f"Adding {amount_to_add} {request.coin} to demo account...")
-        apply_response = await loop.run_in_executor(
-            None, 
-            lambda: requests.post(apply_url, headers=apply_headers, data=payload_json)
-        )
+        apply_response = await http_pool.post(apply_url, headers=apply_headers, content=payload_json)
         
         apply_data = apply_response.json()
         print(f"Demo apply money response: {apply_data}")
@@ -1431,8 +3845,7 @@ async def get_transaction_log(
         
         final_url = f"{url}?{params}"
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(final_url, headers=headers))
+        response = await http_pool.get(final_url, headers=headers)
         
         return response.json()
     except Exception as e:
@@ -1481,8 +3894,7 @@ async def place_binance_order(
 async def get_testnet_symbols():
     try:
         url = "https://testnet.binancefuture.com/fapi/v1/exchangeInfo"
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, requests.get, url)
+        response = await public_api.get(url)
         
         if response.status_code == 200:
             data = response.json()
@@ -1523,8 +3935,7 @@ async def get_binance_balance(
         
         print(f"Binance Balance Request: {final_url[:80]}...")
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(final_url, headers=headers))
+        response = await http_pool.get(final_url, headers=headers)
         
         if response.status_code != 200:
              print(f"Binance Wallet Error ({response.status_code}): {response.text}")
@@ -1577,8 +3988,7 @@ async def get_binance_orders(
         final_url = f"{base_url}{endpoint}?{query_string}&signature={signature}"
         headers = { "X-MBX-APIKEY": api_key }
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(final_url, headers=headers))
+        response = await http_pool.get(final_url, headers=headers)
         
         return response.json()
     except Exception as e:
@@ -1589,83 +3999,156 @@ async def get_binance_orders(
 # These endpoints proxy requests to Binance API to avoid CORS issues in production
 # The frontend calls /api/binance/* and the backend forwards to fapi.binance.com
 
-@app.get("/api/binance/fapi/v1/exchangeInfo")
-async def proxy_binance_exchange_info():
-    """Proxy Binance exchangeInfo endpoint for production deployment."""
-    try:
-        url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "application/json"
-        }
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None, 
-            lambda: requests.get(url, headers=headers, timeout=10)
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Binance API returned {response.status_code}: {response.text[:200]}")
+# Seconds a proxied response is served from memory. Past PROXY_REFRESH_AHEAD of its TTL the next request triggers
+# a background refresh, so browsers never wait on Binance for a warm endpoint.
+PROXY_TTL_SECONDS = {
+    "exchangeInfo": float(os.getenv("PROXY_TTL_EXCHANGE_INFO", "300")),
+    "fundingInfo": float(os.getenv("PROXY_TTL_FUNDING_INFO", "300")),
+    "premiumIndex": float(os.getenv("PROXY_TTL_PREMIUM_INDEX", "2")) # Only used while the live stream is down
+}
+PROXY_REFRESH_AHEAD = 0.8
+# Bodies smaller than this are not worth gzipping
+PROXY_GZIP_MIN_BYTES = 1024
+PROXY_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept": "application/json"
+}
+
+class ProxyBody:
+    """One proxied response: serialized once, gzipped once, and tagged with an ETag of its bytes.
+    Building one can take tens of ms for a large payload, so callers on the server loop construct it in a thread."""
+    __slots__ = ("data", "gzipped", "etag", "fetched_at")
+
+    def __init__(self, payload, fetched_at=None):
+        self.data = dump_bytes(payload)
+        self.gzipped = gzip.compress(self.data, compresslevel=6) if len(self.data) >= PROXY_GZIP_MIN_BYTES else None
+        self.etag = '"' + hashlib.blake2b(self.data, digest_size=16).hexdigest() + '"'
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    def response(self, request, max_age):
+        headers = {"ETag": self.etag, "Cache-Control": f"public, max-age={int(max_age)}", "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if self.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if self.gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+            return Response(self.gzipped, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+        return Response(self.data, media_type="application/json", headers=headers)
+
+class ProxyCache:
+    """Proxied Binance responses kept per endpoint, refreshed in the background before they expire."""
+
+    def __init__(self, ttls):
+        self.ttls = ttls
+        self.entries = {} # endpoint -> ProxyBody
+        self.refreshing = {} # endpoint -> Task
+        self.live = None # (book seq, expires_at, Task -> ProxyBody) for premiumIndex built from the live stream
+        self.upstream = collections.Counter() # endpoint -> Binance fetches
+
+    async def get(self, name, url):
+        entry = self.entries.get(name)
+        age = time.time() - entry.fetched_at if entry else None
+        if entry is None or age >= self.ttls[name]:
+            try:
+                return await asyncio.shield(self.refresh(name, url))
+            except Exception as e:
+                if entry is None:
+                    raise
+                # Binance unreachable: keep serving the last good body
+                print(f"⚠️ Proxy {name} refresh failed, serving {age:.0f}s old copy: {e}")
+                return entry
+        if age >= self.ttls[name] * PROXY_REFRESH_AHEAD:
+            self.refresh(name, url)
+        return entry
+
+    def refresh(self, name, url):
+        """Starts (or joins) the one refresh of `name`."""
+        task = self.refreshing.get(name)
+        if task is None:
+            task = self.refreshing[name] = asyncio.ensure_future(self._load(name, url))
+            task.add_done_callback(lambda t: self._refreshed(name, t))
+        return task
+
+    def _refreshed(self, name, task):
+        self.refreshing.pop(name, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Binance {name} Proxy Error: {task.exception()}")
+
+    async def _load(self, name, url):
+        self.upstream[name] += 1
+        response = await public_api.get(url, headers=PROXY_HEADERS, timeout=10)
+        if response.status_code != 200:
+            print(f"Binance {name} API returned {response.status_code}: {response.text[:200]}")
             raise HTTPException(status_code=response.status_code, detail=f"Binance API error: {response.status_code}")
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Binance Exchange Info Proxy Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        body = self.entries[name] = await asyncio.to_thread(ProxyBody, response.json())
+        return body
 
-@app.get("/api/binance/fapi/v1/premiumIndex")
-async def proxy_binance_premium_index():
-    """Proxy Binance premiumIndex endpoint for production deployment."""
-    try:
-        url = "https://fapi.binance.com/fapi/v1/premiumIndex"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "application/json"
+    async def live_premium_index(self, book):
+        """premiumIndex built from the live mark-price stream (fresh rows only), or None while it has none.
+        The body is reused until the book changes or its oldest row goes stale, so a stalled stream drops out."""
+        now = time.time()
+        cached = self.live
+        if cached and cached[0] == book.seq and now <= cached[1]:
+            return await asyncio.shield(cached[2])
+        self.live = None
+        rows = np.nonzero(book.present() & ~book.stale(now))[0]
+        if not len(rows):
+            return None
+        symbols = book.index.symbols
+        payload = [
+            {
+                "symbol": symbols[r] + "USDT",
+                "markPrice": str(book.mark_price[r]),
+                "lastFundingRate": str(book.funding_rate[r]),
+                "nextFundingTime": int(book.next_funding_time[r]),
+                "time": int(book.updated_at[r] * 1000)
+            }
+            for r in rows.tolist() if not symbols[r].endswith("USDC") # Book keys are Binance symbols minus "USDT"
+        ]
+        if not payload:
+            return None
+        # Requests arriving while it is built share the one thread job
+        task = asyncio.ensure_future(asyncio.to_thread(ProxyBody, payload))
+        self.live = (book.seq, float(book.updated_at[rows].min()) + MARKET_DATA_STALE_SECONDS, task)
+        return await asyncio.shield(task)
+
+    def stats(self):
+        now = time.time()
+        return {
+            "upstream_fetches": dict(self.upstream),
+            "ages": {name: round(now - body.fetched_at, 1) for name, body in self.entries.items()}
         }
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None, 
-            lambda: requests.get(url, headers=headers, timeout=10)
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Binance Premium API returned {response.status_code}: {response.text[:200]}")
-            raise HTTPException(status_code=response.status_code, detail=f"Binance API error: {response.status_code}")
+
+proxy_cache = ProxyCache(PROXY_TTL_SECONDS)
+
+async def proxy_binance(request, name):
+    """Serves /api/binance/fapi/v1/<name> from proxy_cache, with ETag/304 and gzip when the browser accepts it."""
+    try:
+        body = await proxy_cache.get(name, f"https://fapi.binance.com/fapi/v1/{name}")
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Binance Premium Index Proxy Error: {e}")
+        print(f"Binance {name} Proxy Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return body.response(request, PROXY_TTL_SECONDS[name])
+
+@app.get("/api/binance/fapi/v1/exchangeInfo")
+async def proxy_binance_exchange_info(request: Request):
+    """Proxy Binance exchangeInfo endpoint for production deployment."""
+    return await proxy_binance(request, "exchangeInfo")
+
+@app.get("/api/binance/fapi/v1/premiumIndex")
+async def proxy_binance_premium_index(request: Request):
+    """Proxy Binance premiumIndex endpoint; answered from the live mark-price stream while it is up."""
+    if market_hub.is_active("binance_live"):
+        body = await proxy_cache.live_premium_index(binance_live_wm.book)
+        if body is not None:
+            return body.response(request, 1)
+    return await proxy_binance(request, "premiumIndex")
 
 @app.get("/api/binance/fapi/v1/fundingInfo")
-async def proxy_binance_funding_info():
+async def proxy_binance_funding_info(request: Request):
     """Proxy Binance fundingInfo endpoint for production deployment."""
-    try:
-        url = "https://fapi.binance.com/fapi/v1/fundingInfo"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "application/json"
-        }
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None, 
-            lambda: requests.get(url, headers=headers, timeout=10)
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Binance Funding API returned {response.status_code}: {response.text[:200]}")
-            raise HTTPException(status_code=response.status_code, detail=f"Binance API error: {response.status_code}")
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Binance Funding Info Proxy Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return await proxy_binance(request, "fundingInfo")
 
 
 
@@ -1673,60 +4156,15 @@ async def proxy_binance_funding_info():
 # --- LEVERAGE HELPERS ---
 
 async def get_bybit_max_leverage(symbol: str):
-    """Fetch max leverage for a symbol from Bybit."""
-    try:
-        # Use existing instrument info functionality if possible, or fetch new
-        # /v5/market/instruments-info is public
-        url = "https://api.bybit.com/v5/market/instruments-info"
-        params = {"category": "linear", "symbol": symbol + "USDT" if not symbol.endswith("USDT") else symbol}
-        loop = asyncio.get_event_loop()
-        r = await loop.run_in_executor(None, lambda: requests.get(url, params=params))
-        data = r.json()
-        if data["retCode"] == 0:
-            lev_filter = data["result"]["list"][0]["leverageFilter"]
-            return float(lev_filter["maxLeverage"])
-    except Exception as e:
-        print(f"Bybit Max Lev Error: {e}")
-    return 10.0 # Default safe fallback
+    """Max leverage for a symbol on Bybit, from the instrument registry."""
+    info = await get_bybit_instrument(symbol)
+    return info["maxLeverage"] or 10.0 # Default safe fallback
 
 async def get_binance_max_leverage(symbol: str):
-    """Fetch max leverage for a symbol from Binance."""
-    try:
-        # Binance /fapi/v1/exchangeInfo contains generic limits, but Bracket is better.
-        # However, public exchangeInfo often has it. Let's check common logic.
-        # Ideally use /fapi/v1/leverageBracket but requires auth for precise user limits.
-        # BUT exchangeInfo has valid limits for the symbol generally.
-        # Actually, for unauthorized generic check, exchangeInfo is best.
-        url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
-        loop = asyncio.get_event_loop()
-        r = await loop.run_in_executor(None, requests.get, url)
-        data = r.json()
-        target = symbol + "USDT" if not symbol.endswith("USDT") else symbol
-        for s in data["symbols"]:
-            if s["symbol"] == target:
-                # Binance doesn't always explicitly list max leverage in exchangeInfo directly 
-                # in a simple field for all pairs (it used to be in limits).
-                # But it is standard practice to assume 20x or fetch bracket.
-                # Let's try to find a safe default or parse if available.
-                # Actually, most pairs are 20x, 50x, 75x, 125x.
-                # Without an auth key (to call leverageBracket), we can't be 100% sure of USER limit,
-                # but we can get system max. 
-                # Alternative: Try to set 20x, if fail, retry lower? No, that's messy.
-                # Using a hardcoded list or generic fallback is safer if API doesn't give it easily.
-                # WAIT: Bybit GIVES it. Binance usually implies it via margin tiers.
-                # Let's assume 20x is safe for almost all perps, but user might want 50x.
-                # If specific low cap, it might be 10x?
-                # Let's iterate filters? No.
-                # Let's use `leverageBracket` with the user's keys if available in function!
-                pass
-        
-        # If we have keys context in the calling function, we should use them.
-        # But this is a helper. Let's return 20 as a safe default for now if we can't find it.
-        # Actually, let's allow passing keys to this helper if possible.
-        return 20.0 
-    except Exception as e:
-        print(f"Binance Max Lev Error: {e}")
-    return 20.0
+    """Max leverage for a symbol on Binance. Public exchangeInfo doesn't carry it (only the signed leverageBracket
+    does, see get_min_common_leverage), so this is 20x unless the registry knows better."""
+    info = instruments.get("binance", symbol[:-4] if symbol.endswith("USDT") else symbol)
+    return (info and info["maxLeverage"]) or 20.0
 
 async def get_min_common_leverage(user_leverage, symbol, keys):
     """Get the minimum available leverage between User Setting, Bybit Max, and Binance Max."""
@@ -1745,8 +4183,7 @@ async def get_min_common_leverage(user_leverage, symbol, keys):
                  query = urlencode(params)
                  sig = hmac.new(keys["binance_secret"].encode(), query.encode(), hashlib.sha256).hexdigest()
                  headers = {"X-MBX-APIKEY": keys["binance_key"]}
-                 loop = asyncio.get_event_loop()
-                 r = await loop.run_in_executor(None, lambda: requests.get(f"{base_url}{endpoint}?{query}&signature={sig}", headers=headers))
+                 r = await http_pool.get(f"{base_url}{endpoint}?{query}&signature={sig}", headers=headers)
                  if r.status_code == 200:
                      # Returns list of brackets. Max leverage is the first bracket's initialLeverage? 
                      # Actually it returns brackets where each has 'initialLeverage'. max is usually the highest one available.
@@ -1772,54 +4209,14 @@ async def get_min_common_leverage(user_leverage, symbol, keys):
 @app.get("/api/metadata")
 async def get_metadata():
     """
-    Fetches instrument info (Funding Intervals) from Bybit and Binance.
-    Returns a map: Symbol -> { bybitInterval: int (hours), binanceInterval: int (hours) }
+    Funding intervals for both venues, from the instrument registry.
+    Returns a map: Symbol -> { bybit: int (hours), binance: int (hours) }
     """
-    try:
-        loop = asyncio.get_event_loop()
-        
-        # 1. Fetch Bybit Intervals
-        bybit_url = "https://api.bybit.com/v5/market/instruments-info?category=linear"
-        bybit_task = loop.run_in_executor(None, requests.get, bybit_url)
-        
-        # 2. Fetch Binance Intervals (Use fundingInfo for accurate hours)
-        binance_url = "https://fapi.binance.com/fapi/v1/fundingInfo"
-        binance_task = loop.run_in_executor(None, requests.get, binance_url)
-        
-        r_bybit, r_binance = await asyncio.gather(bybit_task, binance_task)
-        
-        metadata = {}
-        
-        # Process Bybit
-        if r_bybit.status_code == 200:
-            d = r_bybit.json()
-            if d['retCode'] == 0:
-                for item in d['result']['list']:
-                    if not item['symbol'].endswith("USDT"): continue
-                    sym = item['symbol'].replace("USDT", "") 
-                    
-                    interval_min = int(item.get('fundingInterval', 480))
-                    metadata[sym] = { "bybit": interval_min // 60 } # Convert to hours
-        
-        # Process Binance (fundingInfo returns list of objects)
-        if r_binance.status_code == 200:
-            d = r_binance.json()
-            # Binance returns list of { symbol, fundingIntervalHours, ... }
-            if isinstance(d, list):
-                for item in d:
-                    if not item['symbol'].endswith("USDT"): continue
-                    sym = item['symbol'].replace("USDT", "")
-                    
-                    interval_hours = item.get('fundingIntervalHours', 8)
-                    
-                    if sym not in metadata: metadata[sym] = {}
-                    metadata[sym]["binance"] = interval_hours
-
-        return metadata
-
-    except Exception as e:
-        print(f"Metadata Error: {e}")
-        return {}
+    metadata = {}
+    for venue in InstrumentRegistry.VENUES:
+        for sym, hours in instruments.intervals[venue].items():
+            metadata.setdefault(sym, {})[venue] = hours
+    return metadata
 
 
 # --- SCHEDULER LOGIC ---
@@ -1897,8 +4294,7 @@ async def close_all_positions(
                 "X-BAPI-RECV-WINDOW": recv_window
             }
             
-            loop = asyncio.get_event_loop()
-            res = await loop.run_in_executor(None, lambda: requests.get(f"{url}?{params}", headers=headers))
+            res = await http_pool.get(f"{url}?{params}", headers=headers)
             data = res.json()
             
             if data['retCode'] == 0:
@@ -1942,8 +4338,7 @@ async def close_all_positions(
             signature = hmac.new(api_secret.encode('utf-8'), query_string.encode('utf-8'), hashlib.sha256).hexdigest()
             
             headers = { "X-MBX-APIKEY": api_key }
-            loop = asyncio.get_event_loop()
-            res = await loop.run_in_executor(None, lambda: requests.get(f"{base_url}{endpoint}?{query_string}&signature={signature}", headers=headers))
+            res = await http_pool.get(f"{base_url}{endpoint}?{query_string}&signature={signature}", headers=headers)
             
             if res.status_code == 200:
                 data = res.json()
@@ -1969,20 +4364,14 @@ async def close_all_positions(
 
     return results
 
-@app.get("/api/positions")
-async def get_positions(
-    symbol: str, 
-    x_user_bybit_key: Optional[str] = Header(None),
-    x_user_bybit_secret: Optional[str] = Header(None),
-    x_user_binance_key: Optional[str] = Header(None),
-    x_user_binance_secret: Optional[str] = Header(None)
-):
+async def fetch_positions(symbol, bybit_key, bybit_secret, binance_key, binance_secret):
+    """Open Bybit / Binance positions on `symbol` for one set of keys (used by /api/positions and the positions channel)."""
     positions = {"bybit": None, "binance": None}
     
     # --- BYBIT POSITIONS ---
     try:
-        if x_user_bybit_key and x_user_bybit_secret:
-            api_key, api_secret = get_api_credentials(x_user_bybit_key, x_user_bybit_secret)
+        if bybit_key and bybit_secret:
+            api_key, api_secret = get_api_credentials(bybit_key, bybit_secret)
             endpoint = "/v5/position/list"
             url = BYBIT_DEMO_URL + endpoint
             params = f"category=linear&symbol={symbol}USDT"
@@ -1995,8 +4384,7 @@ async def get_positions(
                 "X-BAPI-RECV-WINDOW": recv_window
             }
             
-            loop = asyncio.get_event_loop()
-            res = await loop.run_in_executor(None, lambda: requests.get(f"{url}?{params}", headers=headers))
+            res = await http_pool.get(f"{url}?{params}", headers=headers)
             data = res.json()
             
             if data['retCode'] == 0:
@@ -2015,8 +4403,8 @@ async def get_positions(
 
     # --- BINANCE POSITIONS ---
     try:
-        if x_user_binance_key and x_user_binance_secret:
-            api_key, api_secret = get_binance_credentials(x_user_binance_key, x_user_binance_secret)
+        if binance_key and binance_secret:
+            api_key, api_secret = get_binance_credentials(binance_key, binance_secret)
             is_testnet = True 
             base_url = "https://testnet.binancefuture.com" if is_testnet else "https://fapi.binance.com"
             
@@ -2027,8 +4415,7 @@ async def get_positions(
             signature = hmac.new(api_secret.encode('utf-8'), query_string.encode('utf-8'), hashlib.sha256).hexdigest()
             
             headers = { "X-MBX-APIKEY": api_key }
-            loop = asyncio.get_event_loop()
-            res = await loop.run_in_executor(None, lambda: requests.get(f"{base_url}{endpoint}?{query_string}&signature={signature}", headers=headers))
+            res = await http_pool.get(f"{base_url}{endpoint}?{query_string}&signature={signature}", headers=headers)
             
             if res.status_code == 200:
                 data = res.json()
@@ -2047,6 +4434,16 @@ async def get_positions(
 
     return positions
 
+@app.get("/api/positions")
+async def get_positions(
+    symbol: str, 
+    x_user_bybit_key: Optional[str] = Header(None),
+    x_user_bybit_secret: Optional[str] = Header(None),
+    x_user_binance_key: Optional[str] = Header(None),
+    x_user_binance_secret: Optional[str] = Header(None)
+):
+    return await fetch_positions(symbol, x_user_bybit_key, x_user_bybit_secret, x_user_binance_key, x_user_binance_secret)
+
 # --- Auto-Trade State & Logic ---
 
 
@@ -2093,6 +4490,8 @@ class SessionManager:
         return hashlib.sha256(raw.encode()).hexdigest()
 
     def save_sessions(self):
+        if not is_trading_worker():
+            return # A follower's copies would overwrite the trading worker's sessions
         try:
             data = {}
             for uid, sess in self.sessions.items():
@@ -2153,6 +4552,33 @@ class SessionManager:
 session_manager = SessionManager()
 
 # --- HELPER FOR ENDPOINTS ---
+def is_trading_worker():
+    """True in the worker that runs auto_trade_service: the only one, or the market-data owner in multi-worker mode."""
+    return market_share is None or market_share.owner
+
+def require_trading_worker():
+    """
+    Sessions live in each worker's memory, but only the trading worker runs them. A session started or read on a
+    follower would show as running and never trade. forward_auto_trade sends these requests to the owner, so this
+    only refuses one that reached a follower some other way.
+    """
+    if not is_trading_worker():
+        raise HTTPException(status_code=503, detail="Auto-trade runs in another worker process; retry the request")
+
+@app.middleware("http")
+async def forward_auto_trade(request: Request, call_next):
+    """Multi-worker: a follower runs /api/auto-trade/* requests on the owner over the market-data share socket."""
+    if is_trading_worker() or not request.url.path.startswith("/api/auto-trade/"):
+        return await call_next(request)
+    path = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+    headers = [[k, v] for k, v in request.headers.items() if k not in ("host", "content-length")]
+    try:
+        status, headers, body = await market_share.forward(request.method, path, headers, await request.body())
+    except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+        # Owner restarting (a follower is taking over): the client retries
+        return JSONResponse({"detail": f"Auto-trade worker unavailable: {e}"}, status_code=503)
+    return Response(body, status_code=status, headers=dict(headers))
+
 def get_current_session(
     x_user_bybit_key: Optional[str] = Header(None),
     x_user_bybit_secret: Optional[str] = Header(None),
@@ -2183,6 +4609,7 @@ async def set_auto_trade_config(
     x_user_binance_key: Optional[str] = Header(None),
     x_user_binance_secret: Optional[str] = Header(None)
 ):
+    require_trading_worker()
     session = get_current_session(x_user_bybit_key, x_user_bybit_secret, x_user_binance_key, x_user_binance_secret)
     if not session:
         return {"status": "error", "message": "API Keys required to save configuration."}
@@ -2235,6 +4662,7 @@ async def close_manual_trade(
     x_user_binance_key: Optional[str] = Header(None),
     x_user_binance_secret: Optional[str] = Header(None)
 ):
+    require_trading_worker()
     session = get_current_session(x_user_bybit_key, x_user_bybit_secret, x_user_binance_key, x_user_binance_secret)
     if not session:
         raise HTTPException(status_code=400, detail="Session not found or keys missing")
@@ -2296,6 +4724,7 @@ async def simulate_auto_exit(
     x_user_binance_secret: Optional[str] = Header(None)
 ):
     """Manually triggers the exit logic for an active trade immediately (for testing)."""
+    require_trading_worker()
     session = get_current_session(x_user_bybit_key, x_user_bybit_secret, x_user_binance_key, x_user_binance_secret)
     if not session:
         raise HTTPException(status_code=400, detail="Session not found")
@@ -2360,6 +4789,7 @@ async def get_auto_trade_status(
     x_user_binance_key: Optional[str] = Header(None),
     x_user_binance_secret: Optional[str] = Header(None)
 ):
+    require_trading_worker()
     session = get_current_session(x_user_bybit_key, x_user_bybit_secret, x_user_binance_key, x_user_binance_secret)
     
     if not session:
@@ -2371,6 +4801,10 @@ async def get_auto_trade_status(
              "logs": []
         }
 
+    return {**session_status(session), "logs": session.logs[-50:]}
+
+def session_status(session: UserSession):
+    """Auto-trade status of a session without its logs (/api/auto-trade/status and the session channel)."""
     safe_config = session.config.copy()
     safe_config["has_keys"] = True
     
@@ -2387,10 +4821,170 @@ async def get_auto_trade_status(
         "active_trades": len(session.active_trades),
         "active_symbols": list(session.active_trades.keys()),
         "active_positions": active_positions_list,
-        "pending_opportunities": session.pending_opportunities[:10],
-        "logs": session.logs[-50:]
+        "pending_opportunities": session.pending_opportunities[:10]
     }
 
+class SessionChannels:
+    """
+    Per-session event channels on /ws/clients, replacing the dashboard's status / scheduler / positions polling:
+      "session"   - auto-trade status when it changes, and new log entries
+      "scheduler" - scheduled task transitions
+      "positions" - exchange positions on one symbol
+    Session state is diffed in memory every SESSION_PUSH_SECONDS and only changes are pushed, serialized once per
+    session however many tabs it has open. Positions come from one poller per (session, symbol), not one per tab.
+    """
+
+    def __init__(self, connections, sessions):
+        self.connections = connections
+        self.sessions = sessions
+        self.status = {} # user_id -> (status frame, active symbols) last pushed
+        self.logs_sent = {} # user_id -> len(session.logs) last pushed
+        self.scheduler_frame = None
+        self.positions = {} # (user_id, symbol) -> positions frame last pushed
+        self.pollers = {} # (user_id, symbol) -> positions poller task
+        self.refresh = {} # (user_id, symbol) -> Event that cuts a poller's sleep short
+        self.wake = asyncio.Event()
+
+    def subscribe(self, client, channel, symbol=None, on=True):
+        """Returns an error message, or None once the client is (un)subscribed."""
+        if channel not in ("session", "scheduler", "positions"):
+            return f"Unknown channel {channel}"
+        if channel != "scheduler" and client.session_id is None:
+            return "auth required"
+        if channel == "session" and on and not is_trading_worker():
+            return "session runs in another worker" # Client falls back to REST, which retries until it lands there
+        if not on:
+            client.channels.discard(channel)
+            return None
+        if channel == "positions":
+            if not symbol:
+                return "symbol required"
+            client.positions_symbol = str(symbol).upper().replace("USDT", "")
+            self._ensure_poller((client.session_id, client.positions_symbol))
+        client.channels.add(channel)
+        client.channels_pending.add(channel) # First push is the full state
+        self.wake.set()
+        return None
+
+    def _subscribers(self, channel):
+        return [c for c in list(self.connections.clients.values()) if channel in c.channels and not c.closed]
+
+    def _send(self, frame, clients, channel, changed):
+        """Changed state goes to every subscriber; unchanged state only to those still waiting for their first push."""
+        targets = clients if changed else [c for c in clients if channel in c.channels_pending]
+        for client in targets:
+            client.channels_pending.discard(channel)
+        if targets:
+            self.connections.send_to(frame, targets)
+
+    def push(self):
+        """Sends every subscriber what changed since the last push."""
+        by_session = {}
+        for client in self._subscribers("session"):
+            by_session.setdefault(client.session_id, []).append(client)
+        for user_id, clients in by_session.items():
+            session = self.sessions.sessions.get(user_id)
+            if session is None:
+                continue
+            status = session_status(session)
+            frame = BroadcastFrame({"op": "session", "status": status})
+            last = self.status.get(user_id)
+            changed = last is None or last[0].data != frame.data
+            if changed:
+                if last is not None and last[1] != status["active_symbols"]:
+                    self._refresh_positions(user_id) # Entries / exits move positions: don't wait for the next poll
+                self.status[user_id] = (frame, status["active_symbols"])
+            waiting = [c for c in clients if "session" in c.channels_pending]
+            self._send(frame, clients, "session", changed)
+
+            # Logs: new entries to everyone already up to date, the last 50 to new subscribers
+            sent = self.logs_sent.get(user_id, len(session.logs))
+            if len(session.logs) > sent:
+                up_to_date = [c for c in clients if c not in waiting]
+                if up_to_date:
+                    self.connections.send_to(BroadcastFrame({"op": "session_logs", "logs": session.logs[sent:]}), up_to_date)
+            self.logs_sent[user_id] = len(session.logs)
+            if waiting:
+                self.connections.send_to(BroadcastFrame({"op": "session_logs", "logs": session.logs[-50:], "reset": True}), waiting)
+
+        clients = self._subscribers("scheduler")
+        if clients:
+            frame = BroadcastFrame({"op": "scheduler", "tasks": scheduler.tasks, "profit_log": scheduler.profit_log})
+            changed = self.scheduler_frame is None or self.scheduler_frame.data != frame.data
+            self.scheduler_frame = frame
+            self._send(frame, clients, "scheduler", changed)
+
+        # Positions already fetched for a new subscriber's key go out right away
+        for client in self._subscribers("positions"):
+            frame = self.positions.get((client.session_id, client.positions_symbol))
+            if frame is not None and "positions" in client.channels_pending:
+                self._send(frame, [client], "positions", False)
+
+        # Forget sessions nobody watches anymore
+        for user_id in [u for u in self.status if u not in by_session]:
+            del self.status[user_id]
+            self.logs_sent.pop(user_id, None)
+
+    def _position_subscribers(self, key):
+        return [c for c in self._subscribers("positions") if (c.session_id, c.positions_symbol) == key]
+
+    def _refresh_positions(self, user_id):
+        for key, event in self.refresh.items():
+            if key[0] == user_id:
+                event.set()
+
+    def _ensure_poller(self, key):
+        if key not in self.pollers:
+            self.refresh[key] = asyncio.Event()
+            self.pollers[key] = asyncio.create_task(self._poll_positions(key))
+
+    async def _poll_positions(self, key):
+        """Fetches one session's positions on one symbol while any tab subscribes to them."""
+        user_id, symbol = key
+        try:
+            while self._position_subscribers(key):
+                session = self.sessions.sessions.get(user_id)
+                if session is None:
+                    break
+                keys = session.keys
+                try:
+                    positions = await fetch_positions(symbol, keys.get("bybit_key"), keys.get("bybit_secret"),
+                                                      keys.get("binance_key"), keys.get("binance_secret"))
+                    frame = BroadcastFrame({"op": "positions", "symbol": symbol, "positions": positions})
+                    last = self.positions.get(key)
+                    self.positions[key] = frame
+                    self._send(frame, self._position_subscribers(key), "positions", last is None or last.data != frame.data)
+                except Exception as e:
+                    print(f"Positions Channel Error ({symbol}): {e}")
+                event = self.refresh[key]
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=POSITIONS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        finally:
+            self.pollers.pop(key, None)
+            self.refresh.pop(key, None)
+            self.positions.pop(key, None)
+
+    async def run(self):
+        print("🚀 Session Channels Started")
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=SESSION_PUSH_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self.wake.clear()
+                self.push()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Session Channels Error: {e}")
+                await asyncio.sleep(1)
+
+session_channels = SessionChannels(manager, session_manager)
+
 async def _internal_force_trade_logic(session: UserSession):
     try:
         # Use session-specific config
@@ -2398,8 +4992,7 @@ async def _internal_force_trade_logic(session: UserSession):
         
         # 1. Fetch Rates (Shared logic? No, live/testnet depends on user config)
         base_url = "https://fapi.binance.com" if config["is_live"] else "https://testnet.binancefuture.com"
-        loop = asyncio.get_event_loop()
-        r = await loop.run_in_executor(None, requests.get, f"{base_url}/fapi/v1/premiumIndex")
+        r = await public_api.get(f"{base_url}/fapi/v1/premiumIndex")
         data_binance = r.json()
         data_bybit_map = await fetch_bybit_rates(is_live=config["is_live"])
         
@@ -2496,6 +5089,7 @@ async def force_auto_trade(
     x_user_binance_key: Optional[str] = Header(None),
     x_user_binance_secret: Optional[str] = Header(None)
 ):
+    require_trading_worker()
     session = get_current_session(x_user_bybit_key, x_user_bybit_secret, x_user_binance_key, x_user_binance_secret)
     if not session: return {"status": "error", "message": "Session not found"}
 
@@ -2522,6 +5116,7 @@ async def simulate_trade(
     x_user_binance_key: Optional[str] = Header(None),
     x_user_binance_secret: Optional[str] = Header(None)
 ):
+    require_trading_worker()
     session = get_current_session(x_user_bybit_key, x_user_bybit_secret, x_user_binance_key, x_user_binance_secret)
     if not session: return {"status": "error", "message": "Session not found"}
 
@@ -2531,8 +5126,7 @@ async def simulate_trade(
     
     try:
         base_url = "https://fapi.binance.com" if is_live else "https://testnet.binancefuture.com"
-        loop = asyncio.get_event_loop()
-        r = await loop.run_in_executor(None, requests.get, f"{base_url}/fapi/v1/premiumIndex")
+        r = await public_api.get(f"{base_url}/fapi/v1/premiumIndex")
         data_binance = r.json()
         data_bybit_map = await fetch_bybit_rates(is_live=is_live)
         
@@ -2774,6 +5368,7 @@ async def sync_auto_trade_positions(
     x_user_binance_secret: Optional[str] = Header(None),
     is_live: bool = False # Query param default, but frontend should send it
 ):
+    require_trading_worker()
     session = get_current_session(x_user_bybit_key, x_user_bybit_secret, x_user_binance_key, x_user_binance_secret)
     if not session: return {"status": "error", "message": "Session not found"}
     
@@ -2794,8 +5389,7 @@ async def sync_auto_trade_positions(
              q = f"timestamp={ts}"
              sig = hmac.new(api_secret.encode('utf-8'), q.encode('utf-8'), hashlib.sha256).hexdigest()
              
-             loop = asyncio.get_event_loop()
-             res = await loop.run_in_executor(None, lambda: requests.get(f"{base_url}{endpoint}?{q}&signature={sig}", headers={"X-MBX-APIKEY": api_key}))
+             res = await http_pool.get(f"{base_url}{endpoint}?{q}&signature={sig}", headers={"X-MBX-APIKEY": api_key})
              
              if res.status_code == 200:
                  for p in res.json():
@@ -2829,8 +5423,7 @@ async def sync_auto_trade_positions(
                 "X-BAPI-RECV-WINDOW": recv
              }
              
-             loop = asyncio.get_event_loop()
-             res = await loop.run_in_executor(None, lambda: requests.get(f"{url_base}{endpoint}?{params}", headers=headers))
+             res = await http_pool.get(f"{url_base}{endpoint}?{params}", headers=headers)
              data = res.json()
              
              if data['retCode'] == 0:
@@ -2873,8 +5466,7 @@ async def sync_auto_trade_positions(
     if restored:
         try:
              base_url = "https://fapi.binance.com" # Sync NFT from Live usually
-             loop = asyncio.get_event_loop()
-             r = await loop.run_in_executor(None, requests.get, f"{base_url}/fapi/v1/premiumIndex")
+             r = await public_api.get(f"{base_url}/fapi/v1/premiumIndex")
              data = r.json()
              for item in data:
                  s = item['symbol'].replace("USDT","")
@@ -2896,6 +5488,123 @@ async def sync_auto_trade_positions(
         "active_count": len(session.active_trades)
     }
 
+# --- AUTO-TRADE DECISIONS ---
+# Pure functions of (session, spread table, clock), shared by auto_trade_service and the offline replay (replay.py)
+
+def auto_trade_tradable(table):
+    """Mask of symbols whose quotes are usable at all: priced, with a funding time, and fresh on both venues."""
+    tradable = (table["binance_price"] > 0) & (table["bybit_price"] > 0) & (table["binance_nft"] != 0) & (table["bybit_nft"] != 0)
+    # Never trade on a quote a stalled socket has frozen
+    return tradable & ~table["is_stale"]
+
+def find_session_candidates(session, table, cols, tradable, now_s, valid_symbols=None):
+    """
+    Entry candidates for one session, sorted by time to funding, then by rate diff.
+    Expires the session's cooldowns as of `now_s`. `valid_symbols` = None skips the Binance symbol check.
+    """
+    candidates = []
+    min_diff_cfg = session.config["min_diff"]
+    # Default max price diff to 2% if not set
+    max_price_diff_cfg = session.config.get("max_price_diff", 2.0)
+
+    # Vectorized pre-filter over every symbol at once; only matches reach the Python loop
+    mask = tradable & (table["rate_diff"] * 100 > min_diff_cfg) & (table["price_diff_pct"] <= max_price_diff_cfg)
+
+    for i in np.nonzero(mask)[0]:
+        symbol = cols["symbols"][i]
+
+        if symbol in session.active_trades: continue
+
+        # Check Cooldowns
+        if symbol in session.manual_closed_trades:
+            if now_s - session.manual_closed_trades[symbol] < 300:
+                continue
+            else:
+                del session.manual_closed_trades[symbol]
+
+        if symbol in session.failed_trades:
+            if now_s - session.failed_trades[symbol] < 120: # 2 min cooldown for failed entries
+                continue
+            else:
+                del session.failed_trades[symbol]
+
+        # Safety: Ensure symbol is present in our Binance cache (valid futures symbol)
+        if valid_symbols is not None and symbol not in valid_symbols:
+            continue
+
+        candidates.append({
+            "symbol": symbol,
+            "binance_rate": cols["binance_rate"][i],
+            "bybit_rate": cols["bybit_rate"][i],
+            "rate_diff": cols["rate_diff"][i],
+            "markPrice": cols["binance_price"][i],
+            "nextFundingTime": cols["binance_nft"][i],
+            "nextFundingTimeBybit": cols["bybit_nft"][i],
+            "priceDiff": cols["price_diff_pct"][i],
+            "bybitPrice": cols["bybit_price"][i],
+            "is_invalid": cols["is_invalid"][i]
+        })
+
+    # Sort by Time to Funding
+    candidates.sort(key=lambda x: (min(x['nextFundingTime'], x['nextFundingTimeBybit'] if x['nextFundingTimeBybit'] > 0 else x['nextFundingTime']), -x['rate_diff']))
+    return candidates
+
+def pick_auto_entry(session, candidates, now_ms, now_s):
+    """
+    The candidate an active session should enter this cycle (at most one), or None.
+    `now_ms` is the clock the spread table was built with; `now_s` drives the cooldowns.
+    """
+    # If we recently hit a balance error, wait 30s before trying ANY auto-entries again
+    if (now_s - session.last_balance_warning) < 30:
+        return None
+
+    # Gap between ANY two auto-entries (global session cooldown)
+    if (now_s - session.last_entry_time) < 10:
+        return None
+
+    ignore_timing = session.config.get("ignore_timing", False)
+    window_ms = session.config.get("entry_before_seconds", 60) * 1000
+
+    for cand in candidates[:30]:
+        if cand.get("is_invalid"):
+            continue
+
+        # Already failed recently?
+        if cand['symbol'] in session.failed_trades:
+            if now_s - session.failed_trades[cand['symbol']] < 120:
+                continue
+
+        time_to_funding = cand['nextFundingTime'] - now_ms
+        if ignore_timing or 10000 < time_to_funding < window_ms:
+            # Safety Check: Enforce Max Price Diff for Auto-Execution
+            if cand['priceDiff'] > session.config.get("max_price_diff", 2.0):
+                continue
+
+            # Check Max Trades
+            if len(session.active_trades) >= session.config["max_trades"]:
+                return None
+            return cand
+    return None
+
+def auto_trade_sides(cand):
+    """(Binance side, Bybit side): short the venue paying the higher rate, long the other."""
+    if cand['binance_rate'] > cand['bybit_rate']:
+        return "Sell", "Buy"
+    return "Buy", "Sell"
+
+def auto_exit_delay(session, time_to_funding):
+    """(seconds to wait before the auto-exit, reason), counted from when the exit is scheduled."""
+    exit_delay = session.config.get("exit_after_seconds", 30)
+
+    if session.config.get("ignore_timing", False):
+        # When ignore_timing is ON, we entry IMMEDIATELY.
+        # The exit is just a quick scalp/test duration.
+        return max(exit_delay, 1), "Force/Test Mode (Immediate)"
+
+    # Standard funding-based timing
+    # We wait exactly until funding triggers, plus the configured seconds
+    return max((time_to_funding / 1000) + exit_delay, 1), f"Funding Disbursal (+{exit_delay}s)"
+
 async def auto_trade_service():
     """
     Background loop for Auto-Trading.
@@ -2904,22 +5613,25 @@ async def auto_trade_service():
     
     while True:
         try:
-            # 1. Fetch Rates (Fetch ONCE for all users to save API calls)
-            data_binance = []
-            data_bybit_map = {}
-            
+            # 1. Build the cross-venue spread table ONCE for all users
+            now = time.time() * 1000
             try:
-                base_url = "https://fapi.binance.com"
-                loop = asyncio.get_event_loop()
-                r = await loop.run_in_executor(None, requests.get, f"{base_url}/fapi/v1/premiumIndex")
-                data_binance = r.json()
-                data_bybit_map = await fetch_bybit_rates(is_live=True)
+                if len(binance_live_wm.book) and len(bybit_ws_manager.book):
+                    # Same table /api/opportunities and the opportunities channel read
+                    table = opportunity_tables["live"].current(now)
+                else:
+                    # Streams not warmed up yet: fall back to REST snapshots
+                    bn_book = RateBook.from_rates(await fetch_binance_rates(is_live=True))
+                    bb_book = RateBook.from_rates(await fetch_bybit_rates(is_live=True))
+                    table = compute_spread_table(bn_book, bb_book, now)
             except Exception as e:
                 print(f"Global Data Fetch Error: {e}")
                 await asyncio.sleep(5)
                 continue
-                
-            now = time.time() * 1000
+
+            # Plain Python columns, converted once and shared by every session
+            cols = {k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in table.items()}
+            tradable = auto_trade_tradable(table)
             
             # 2. Iterate over all Active Sessions
             current_sessions = list(session_manager.sessions.values()) # Snapshot
@@ -2937,95 +5649,7 @@ async def auto_trade_service():
                      except: pass
 
                 # Always scan to update pending_opportunities based on user config
-                    
-                # Analyze candidates for THIS session
-                candidates = []
-                
-                # Check for active trade exits (Timing checks)
-                for sym, info in list(session.active_trades.items()):
-                    pass
-
-                for item in data_binance:
-                    if not item['symbol'].endswith('USDT'): continue
-                    symbol = item['symbol'].replace('USDT', '')
-                    
-                    if symbol in session.active_trades: continue
-                    
-                    # Check Cooldowns
-                    if symbol in session.manual_closed_trades:
-                        if time.time() - session.manual_closed_trades[symbol] < 300:
-                            continue
-                        else:
-                            del session.manual_closed_trades[symbol]
-                    
-                    if symbol in session.failed_trades:
-                        if time.time() - session.failed_trades[symbol] < 120: # 2 min cooldown for failed entries
-                            continue
-                        else:
-                            del session.failed_trades[symbol]
-                    
-                    if symbol not in data_bybit_map: continue
-
-                    # Safety: Ensure symbol is present in our Binance cache (valid futures symbol)
-                    if symbol not in BINANCE_SYMBOL_INFO:
-                        continue
-                    
-                    bybit_price = data_bybit_map[symbol]['markPrice']
-                    bybit_rate = data_bybit_map[symbol].get('rate', 0)
-                    bybit_nft = int(data_bybit_map[symbol].get('nextFundingTime', 0))
-
-                    if bybit_price == 0: continue
-                    
-                    try:
-                        binance_rate = float(item['lastFundingRate'])
-                        mark_price_binance = float(item['markPrice'])
-                        next_funding_binance = int(item['nextFundingTime'])
-                        
-                        if mark_price_binance == 0: continue
-                        
-                        # --- VALIDATION: Check for Invalid/Suspicious Rates ---
-                        is_invalid = False
-                        # High outlier or error codes (like -999)
-                        if abs(binance_rate) > 10 or abs(bybit_rate) > 10:
-                            is_invalid = True
-                        # Exact zero is usually an error/placeholder
-                        if binance_rate == 0 or bybit_rate == 0:
-                            is_invalid = True
-                        
-                        # Hard skip only if funding time is absolutely 0 (breaks logic)
-                        if next_funding_binance == 0 or bybit_nft == 0:
-                            continue
-                        # ----------------------------------------
-
-                        rate_diff = abs(binance_rate - bybit_rate)
-                        
-                        price_diff_pct = 0
-                        if mark_price_binance > 0:
-                            price_diff_pct = abs(mark_price_binance - bybit_price) / mark_price_binance * 100
-                        
-                        min_diff_cfg = session.config["min_diff"]
-                        # Default max price diff to 2% if not set
-                        max_price_diff_cfg = session.config.get("max_price_diff", 2.0) 
-                        
-                        if (rate_diff * 100) > min_diff_cfg and price_diff_pct <= max_price_diff_cfg:
-                            candidates.append({
-                                "symbol": symbol,
-                                "binance_rate": binance_rate,
-                                "bybit_rate": bybit_rate,
-                                "rate_diff": rate_diff,
-                                "markPrice": mark_price_binance,
-                                "nextFundingTime": next_funding_binance,
-                                "nextFundingTimeBybit": bybit_nft,
-                                "priceDiff": price_diff_pct,
-                                "bybitPrice": bybit_price,
-                                "is_invalid": is_invalid
-                            })
-                    except Exception as e:
-                        print(f"Error processing symbol {symbol}: {e}")
-                        continue
-
-                # Sort by Time to Funding
-                candidates.sort(key=lambda x: (min(x['nextFundingTime'], x['nextFundingTimeBybit'] if x['nextFundingTimeBybit'] > 0 else x['nextFundingTime']), -x['rate_diff']))
+                candidates = find_session_candidates(session, table, cols, tradable, time.time(), instruments.venues["binance"])
                 
                 # Update Pending Opportunities (Always Visible)
                 session.pending_opportunities = candidates[:20] 
@@ -3036,236 +5660,173 @@ async def auto_trade_service():
                     continue
 
                 # --- AUTO ENTRY EXECUTION ---
-                # If we recently hit a balance error, wait 30s before trying ANY auto-entries again
-                if (time.time() - session.last_balance_warning) < 30:
+                cand = pick_auto_entry(session, candidates, now, time.time())
+                if cand is None:
                     continue
+
+                symbol = cand['symbol']
+                nft = cand['nextFundingTime']
+                time_to_funding = nft - now
+
+                # Mark as entry intent identified
+                session.last_entry_time = time.time()
                 
-                # Gap between ANY two auto-entries (global session cooldown)
-                if (time.time() - session.last_entry_time) < 10:
-                    continue
+                # Leverage
+                target_leverage = session.config["leverage"]
+                effective_leverage = await get_min_common_leverage(target_leverage, symbol, session.keys)
+                
+                # Direction
+                side_binance, side_bybit = auto_trade_sides(cand)
 
-                execution_candidates = candidates[:30]
-                ignore_timing = session.config.get("ignore_timing", False)
-                entries_this_cycle = 0
+                inv = session.config["total_investment"]
+                per_trade_amt = inv / max(1, session.config["max_trades"])
                 
-                for cand in execution_candidates:
-                    if cand.get("is_invalid"):
-                        continue
-                    
-                    # Limit entries per cycle strictly
-                    if entries_this_cycle >= 1:
-                        break
+                qty_binance = round((per_trade_amt * effective_leverage) / cand['markPrice'], 3)
+                qty_bybit = round((per_trade_amt * effective_leverage) / cand['bybitPrice'], 3)
+                
+                # Execute
+                user_prefix = f"[{session.user_id[:8]}] "
+                exec_msg = f"🚀 {user_prefix}AUTO-ENTRY: {symbol} | BN: {side_binance} {qty_binance} | BB: {side_bybit} {qty_bybit}"
+                print(exec_msg)
+                try:
+                    await manager.broadcast(json.dumps({"type": "log", "msg": exec_msg, "color": "cyan"}))
+                except:
+                    pass
 
-                    symbol = cand['symbol']
+                try:
+                    # TIMING START
+                    t_start = time.time()
                     
-                    # Already failed recently?
-                    if symbol in session.failed_trades:
-                        if time.time() - session.failed_trades[symbol] < 120:
-                            continue
-
-                    nft = cand['nextFundingTime']
+                    await execute_auto_trade_entry(symbol, side_binance, side_bybit, qty_binance, qty_bybit, effective_leverage, session.keys)
+                    
+                    # TIMING END
+                    t_end = time.time()
+                    duration_ms = int((t_end - t_start) * 1000)
                     
-                    time_to_funding = nft - now
-                    entry_seconds = session.config.get("entry_before_seconds", 60)
-                    window_ms = entry_seconds * 1000
+                    # Log Execution Time
+                    timing_msg = f"⏱️ TRADE EXECUTED in {duration_ms}ms"
+                    print(f"{user_prefix} {timing_msg}")
+                    session.logs.append({
+                        "time": time.time(),
+                        "type": "TIMING", 
+                        "symbol": symbol,
+                        "msg": timing_msg
+                    })
+
+                    session.active_trades[symbol] = {
+                        "entry_time": time.time(),
+                        "amount": per_trade_amt,
+                        "qty_binance": qty_binance,
+                        "qty_bybit": qty_bybit,
+                        "nft": nft,
+                        "sides": {"binance": side_binance, "bybit": side_bybit},
+                        "keys": session.keys
+                    }
                     
-                    should_enter = False
-                    if ignore_timing:
-                         should_enter = True
-                    elif 10000 < time_to_funding < window_ms:
-                         should_enter = True
+                    session.logs.append({
+                        "time": time.time(),
+                        "type": "ENTRY (AUTO)",
+                        "symbol": symbol,
+                        "msg": f"BN:{side_binance} BB:{side_bybit} | Diff:{cand['rate_diff']*100:.4f}%"
+                    })
                     
-                    if should_enter:
-                        # Safety Check: Enforce Max Price Diff for Auto-Execution
-                        if cand['priceDiff'] > session.config.get("max_price_diff", 2.0):
-                             continue
+                    # Update record
+                    session.last_entry_time = time.time()
 
-                        # Check Max Trades
-                        if len(session.active_trades) >= session.config["max_trades"]:
-                            break
-                        
-                        # Mark as entry intent identified
-                        session.last_entry_time = time.time()
-                        entries_this_cycle += 1
-                        
-                        # Leverage
-                        target_leverage = session.config["leverage"]
-                        effective_leverage = await get_min_common_leverage(target_leverage, symbol, session.keys)
-                        
-                        # Direction
-                        if cand['binance_rate'] > cand['bybit_rate']:
-                            side_binance = "Sell"
-                            side_bybit = "Buy"
-                        else:
-                            side_binance = "Buy"
-                            side_bybit = "Sell"
+                    # Standard Delay
+                    await asyncio.sleep(3) 
 
-                        inv = session.config["total_investment"]
-                        per_trade_amt = inv / max(1, session.config["max_trades"])
+                    # Schedule Auto-Exit
+                    if session.config["auto_exit"]:
+                        wait_seconds, schedule_reason = auto_exit_delay(session, time_to_funding)
                         
-                        qty_binance = round((per_trade_amt * effective_leverage) / cand['markPrice'], 3)
-                        qty_bybit = round((per_trade_amt * effective_leverage) / cand['bybitPrice'], 3)
+                        # Inform User of Schedule
+                        print(f"{user_prefix}🕒 Scheduled Auto-Exit in {wait_seconds:.1f}s | Reason: {schedule_reason}")
                         
-                        # Execute
-                        user_prefix = f"[{session.user_id[:8]}] "
-                        exec_msg = f"🚀 {user_prefix}AUTO-ENTRY: {symbol} | BN: {side_binance} {qty_binance} | BB: {side_bybit} {qty_bybit}"
-                        print(exec_msg)
-                        try:
-                            await manager.broadcast(json.dumps({"type": "log", "msg": exec_msg, "color": "cyan"}))
-                        except:
-                            pass
+                        async def scheduled_exit_task(s_symbol, s_wait, s_session): # Closure capture
+                            try:
+                                await asyncio.sleep(s_wait)
+                                # Check if still active
+                                if s_symbol in s_session.active_trades:
+                                    trade = s_session.active_trades[s_symbol]
+                                    e_bin = trade['sides']['binance']
+                                    e_byb = trade['sides']['bybit']
+                                    
+                                    t_exit_start = time.time()
+                                    await execute_auto_trade_exit(s_symbol, e_bin, e_byb, trade['qty_binance'], trade['qty_bybit'], effective_leverage, s_session.config["is_live"], s_session)
+                                    t_exit_end = time.time()
+                                    dur_exit = int((t_exit_end - t_exit_start) * 1000)
+                                    
+                                    # Calculate Total Lifecycle Duration (Entry to Exit)
+                                    entry_time = trade.get('entry_time', t_exit_end)
+                                    total_duration = t_exit_end - entry_time
+                                    total_dur_str = f"{total_duration:.2f}s"
+
+                                    log_msg = f"Auto Exit after Funding ({dur_exit}ms API) | Total Held: {total_dur_str}"
+                                    print(f"{user_prefix}✅ {log_msg}")
 
+                                    s_session.logs.append({
+                                        "time": time.time(),
+                                        "type": "EXIT (AUTO)",
+                                        "symbol": s_symbol,
+                                        "msg": log_msg
+                                    })
+                                    if s_symbol in s_session.active_trades:
+                                        del s_session.active_trades[s_symbol]
+                            except Exception as e:
+                                print(f"{user_prefix}❌ Scheduled Exit Task Failed: {e}")
+
+                        asyncio.create_task(scheduled_exit_task(symbol, wait_seconds, session))
+                
+                except Exception as e:
+                    # If ANY leg fails, we do NOT add it to active_trades mapping
+                    err_str = str(e).lower()
+                    curr_time = time.time()
+                    if "not enough" in err_str or "balance" in err_str or "110007" in err_str:
+                        # ALWAYS SHOW WARNING (Removed 30s throttle for immediate feedback as requested)
+                        balance_msg = "⚠️ INSUFFICIENT BALANCE: Ensure you have enough USDT in Bybit Unified and Binance Futures."
+                        print(f"{user_prefix}{balance_msg}")
+                        
+                        # Broadcast to frontend toast/log
                         try:
-                            # TIMING START
-                            t_start = time.time()
-                            
-                            await execute_auto_trade_entry(symbol, side_binance, side_bybit, qty_binance, qty_bybit, effective_leverage, session.keys)
-                            
-                            # TIMING END
-                            t_end = time.time()
-                            duration_ms = int((t_end - t_start) * 1000)
-                            
-                            # Log Execution Time
-                            timing_msg = f"⏱️ TRADE EXECUTED in {duration_ms}ms"
-                            print(f"{user_prefix} {timing_msg}")
-                            session.logs.append({
-                                "time": time.time(),
-                                "type": "TIMING", 
-                                "symbol": symbol,
-                                "msg": timing_msg
-                            })
+                            await manager.broadcast(json.dumps({"type": "error", "msg": balance_msg}))
+                        except: pass
+                        
+                        # Also append to session logs so it stays in terminal
+                        session.logs.append({
+                            "time": time.time(),
+                            "type": "ERROR",
+                            "symbol": symbol,
+                            "msg": "Insufficient Balance (Trade Skipped)"
+                        })
+
+                        session.last_balance_warning = curr_time
+                        # Keep the cooldown to prevent spamming the exchange, not the user
+                    else:
+                        err_msg = str(e)
+                        if hasattr(e, "detail"): err_msg = e.detail
+                        print(f"❌ {user_prefix}FAILED TO OPEN ARBITRAGE FOR {symbol}: {err_msg}")
+                        session.failed_trades[symbol] = time.time() 
+                        session.last_entry_time = time.time()
 
-                            session.active_trades[symbol] = {
-                                "entry_time": time.time(),
-                                "amount": per_trade_amt,
-                                "qty_binance": qty_binance,
-                                "qty_bybit": qty_bybit,
-                                "nft": nft,
-                                "sides": {"binance": side_binance, "bybit": side_bybit},
-                                "keys": session.keys
-                            }
-                            
+                        # Auto-Deactivate on persistent key errors
+                        if "API Key is Invalid" in err_msg or "10003" in err_msg or "-2015" in err_msg:
+                            session.config["active"] = False
+                            session_manager.save_sessions()
+                            session_manager.save_sessions()
+                            deact_msg = f"🛑 {user_prefix}AUTO-TRADE DEACTIVATED: Invalid API keys or permissions."
+                            print(deact_msg)
+                            # Persist in session logs so frontend sees it on refresh
                             session.logs.append({
                                 "time": time.time(),
-                                "type": "ENTRY (AUTO)",
-                                "symbol": symbol,
-                                "msg": f"BN:{side_binance} BB:{side_bybit} | Diff:{cand['rate_diff']*100:.4f}%"
+                                "type": "ERROR",
+                                "symbol": "SYSTEM",
+                                "msg": "Auto-Deactivated: Invalid API Keys. Check settings."
                             })
-                            
-                            # Update record
-                            session.last_entry_time = time.time()
-                            entries_this_cycle += 1
-                            
-                            # Standard Delay
-                            await asyncio.sleep(3) 
-
-                            # Schedule Auto-Exit
-                            if session.config["auto_exit"]:
-                                exit_delay = session.config.get("exit_after_seconds", 30)
-                                
-                                if ignore_timing:
-                                    # When ignore_timing is ON, we entry IMMEDIATELY.
-                                    # The exit is just a quick scalp/test duration.
-                                    wait_seconds = exit_delay
-                                    schedule_reason = "Force/Test Mode (Immediate)"
-                                else:
-                                    # Standard funding-based timing
-                                    # We wait exactly until funding triggers, plus the configured seconds
-                                    wait_seconds = (time_to_funding / 1000) + exit_delay
-                                    schedule_reason = f"Funding Disbursal (+{exit_delay}s)"
-                                
-                                if wait_seconds < 1: wait_seconds = 1
-                                
-                                # Inform User of Schedule
-                                print(f"{user_prefix}🕒 Scheduled Auto-Exit in {wait_seconds:.1f}s | Reason: {schedule_reason}")
-                                
-                                async def scheduled_exit_task(s_symbol, s_wait, s_session): # Closure capture
-                                    try:
-                                        await asyncio.sleep(s_wait)
-                                        # Check if still active
-                                        if s_symbol in s_session.active_trades:
-                                            trade = s_session.active_trades[s_symbol]
-                                            e_bin = trade['sides']['binance']
-                                            e_byb = trade['sides']['bybit']
-                                            
-                                            t_exit_start = time.time()
-                                            await execute_auto_trade_exit(s_symbol, e_bin, e_byb, trade['qty_binance'], trade['qty_bybit'], effective_leverage, s_session.config["is_live"], s_session)
-                                            t_exit_end = time.time()
-                                            dur_exit = int((t_exit_end - t_exit_start) * 1000)
-                                            
-                                            # Calculate Total Lifecycle Duration (Entry to Exit)
-                                            entry_time = trade.get('entry_time', t_exit_end)
-                                            total_duration = t_exit_end - entry_time
-                                            total_dur_str = f"{total_duration:.2f}s"
-
-                                            log_msg = f"Auto Exit after Funding ({dur_exit}ms API) | Total Held: {total_dur_str}"
-                                            print(f"{user_prefix}✅ {log_msg}")
-
-                                            s_session.logs.append({
-                                                "time": time.time(),
-                                                "type": "EXIT (AUTO)",
-                                                "symbol": s_symbol,
-                                                "msg": log_msg
-                                            })
-                                            if s_symbol in s_session.active_trades:
-                                                del s_session.active_trades[s_symbol]
-                                    except Exception as e:
-                                        print(f"{user_prefix}❌ Scheduled Exit Task Failed: {e}")
-
-                                asyncio.create_task(scheduled_exit_task(symbol, wait_seconds, session))
-                        
-                        except Exception as e:
-                            # If ANY leg fails, we do NOT add it to active_trades mapping
-                            err_str = str(e).lower()
-                            curr_time = time.time()
-                            if "not enough" in err_str or "balance" in err_str or "110007" in err_str:
-                                # ALWAYS SHOW WARNING (Removed 30s throttle for immediate feedback as requested)
-                                balance_msg = "⚠️ INSUFFICIENT BALANCE: Ensure you have enough USDT in Bybit Unified and Binance Futures."
-                                print(f"{user_prefix}{balance_msg}")
-                                
-                                # Broadcast to frontend toast/log
-                                try:
-                                    await manager.broadcast(json.dumps({"type": "error", "msg": balance_msg}))
-                                except: pass
-                                
-                                # Also append to session logs so it stays in terminal
-                                session.logs.append({
-                                    "time": time.time(),
-                                    "type": "ERROR",
-                                    "symbol": symbol,
-                                    "msg": "Insufficient Balance (Trade Skipped)"
-                                })
-
-                                session.last_balance_warning = curr_time
-                                # Keep the cooldown to prevent spamming the exchange, not the user
-                            else:
-                                err_msg = str(e)
-                                if hasattr(e, "detail"): err_msg = e.detail
-                                print(f"❌ {user_prefix}FAILED TO OPEN ARBITRAGE FOR {symbol}: {err_msg}")
-                                session.failed_trades[symbol] = time.time() 
-                                session.last_entry_time = time.time() 
-                                entries_this_cycle += 1 
-                                
-                                # Auto-Deactivate on persistent key errors
-                                if "API Key is Invalid" in err_msg or "10003" in err_msg or "-2015" in err_msg:
-                                    session.config["active"] = False
-                                    session_manager.save_sessions()
-                                    session_manager.save_sessions()
-                                    deact_msg = f"🛑 {user_prefix}AUTO-TRADE DEACTIVATED: Invalid API keys or permissions."
-                                    print(deact_msg)
-                                    # Persist in session logs so frontend sees it on refresh
-                                    session.logs.append({
-                                        "time": time.time(),
-                                        "type": "ERROR",
-                                        "symbol": "SYSTEM",
-                                        "msg": "Auto-Deactivated: Invalid API Keys. Check settings."
-                                    })
-                                    try: await manager.broadcast(json.dumps({"type": "error", "msg": deact_msg}))
-                                    except: pass
+                            try: await manager.broadcast(json.dumps({"type": "error", "msg": deact_msg}))
+                            except: pass
 
-                                await asyncio.sleep(5) 
-                                break # Force stop this cycle for this session
-                            pass
+                        await asyncio.sleep(5)
 
             await asyncio.sleep(1) # Loop Throttle
             
@@ -3303,8 +5864,7 @@ async def verify_binance_keys(
         url = f"{base_url}{endpoint}?{query_string}&signature={signature}"
         headers = {"X-MBX-APIKEY": x_user_binance_key}
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(url, headers=headers))
+        response = await http_pool.get(url, headers=headers)
         
         if response.status_code == 200:
              return {"valid": True, "message": "API keys are valid"}
@@ -3365,8 +5925,7 @@ async def verify_bybit_keys(
         
         # print(f"Verifying Bybit: {full_url}")
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(full_url, headers=headers))
+        response = await http_pool.get(full_url, headers=headers)
         
         if response.status_code == 200:
             data = response.json()
@@ -3588,8 +6147,7 @@ async def rebuild_history(
             "X-BAPI-RECV-WINDOW": recv_window
         }
         
-        loop = asyncio.get_event_loop()
-        res = await loop.run_in_executor(None, lambda: requests.get(f"{url}?{params}", headers=headers))
+        res = await http_pool.get(f"{url}?{params}", headers=headers)
         data = res.json()
         
         added_count = 0
@@ -3640,7 +6198,9 @@ if __name__ == "__main__":
     # Hugging Face Spaces uses port 7860 by default
     port = int(os.getenv("PORT", 8000))
     # Listen on all interfaces
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
+    # permessage-deflate compresses every WS message per connection; turn it off when clients use encoding=deflate / msgpack
+    per_message_deflate = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes")
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False, ws_per_message_deflate=per_message_deflate)
 
 
 
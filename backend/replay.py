@@ -0,0 +1,174 @@
+import argparse
+import heapq
+import json
+import time
+
+import numpy as np
+
+from main import (
+    BinanceWebSocketManager, BybitWebSocketManager, MarketDataHub, OpportunityTable, SegmentReader, UserSession, RECORD_VENUES,
+    auto_trade_tradable, find_session_candidates, pick_auto_entry, auto_trade_sides, auto_exit_delay
+)
+
+# Offline replay: feeds recorded market-data frames (see MarketDataRecorder) through the same rate books and
+# auto-trade decision functions as auto_trade_service, on a virtual clock, with order execution stubbed out.
+# Usage: python replay.py <record dir> [--start TS] [--end TS] [--min-diff 0.01] [--json]
+
+class ReplayEngine:
+    """Deterministic scanner replay: same frames + same config = same entries and exits."""
+
+    def __init__(self, config=None, tick=1.0, entry_delay=3.0):
+        self.hub = MarketDataHub()
+        self.binance = BinanceWebSocketManager()
+        self.bybit = BybitWebSocketManager()
+        self.hub.register("binance_live", self.binance)
+        self.hub.register("bybit", self.bybit)
+        self.venues = {RECORD_VENUES["binance_live"]: self.binance, RECORD_VENUES["bybit"]: self.bybit}
+        self.opportunities = OpportunityTable(self.hub) # Same table auto_trade_service scans
+
+        self.session = UserSession("replay", {})
+        self.session.config.update(config or {})
+        self.session.config["active"] = True
+
+        self.tick = tick # auto_trade_service scans about once a second
+        self.entry_delay = entry_delay # Live service sleeps this long after an entry before scheduling its exit
+        self.clock = None # Virtual time (s) of the next scan
+        self.exits = [] # heap of (exit time, symbol)
+        self.events = []
+        self.frames = 0
+
+    def feed(self, ts, venue, payload):
+        """Applies one recorded frame, first running every scan that was due before it arrived."""
+        manager = self.venues.get(venue)
+        if manager is None:
+            return
+        if self.clock is None:
+            self.clock = ts
+        while self.clock <= ts:
+            self.scan(self.clock)
+            self.clock += self.tick
+        manager._handle_message(payload.decode(), ts=ts)
+        self.frames += 1
+
+    def finish(self):
+        """Runs the exits still scheduled after the last frame, against the last known rates."""
+        while self.exits:
+            self._exit(*heapq.heappop(self.exits))
+
+    def scan(self, now_s):
+        while self.exits and self.exits[0][0] <= now_s:
+            self._exit(*heapq.heappop(self.exits))
+
+        now_ms = now_s * 1000
+        table = self.opportunities.current(now_ms)
+        cols = {k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in table.items()}
+        session = self.session
+        # Replays have no exchangeInfo, so the Binance symbol check is skipped
+        candidates = find_session_candidates(session, table, cols, auto_trade_tradable(table), now_s)
+        session.pending_opportunities = candidates[:20]
+
+        cand = pick_auto_entry(session, candidates, now_ms, now_s)
+        if cand is None:
+            return
+        self._enter(cand, now_s, now_ms)
+
+    def _enter(self, cand, now_s, now_ms):
+        session = self.session
+        symbol = cand['symbol']
+        # Stubbed execution: fills instantly at mark price, target leverage (no exchange max-leverage lookup)
+        leverage = session.config["leverage"]
+        side_binance, side_bybit = auto_trade_sides(cand)
+        per_trade_amt = session.config["total_investment"] / max(1, session.config["max_trades"])
+        time_to_funding = cand['nextFundingTime'] - now_ms
+
+        session.last_entry_time = now_s
+        session.active_trades[symbol] = {
+            "entry_time": now_s,
+            "amount": per_trade_amt,
+            "qty_binance": round((per_trade_amt * leverage) / cand['markPrice'], 3),
+            "qty_bybit": round((per_trade_amt * leverage) / cand['bybitPrice'], 3),
+            "nft": cand['nextFundingTime'],
+            "sides": {"binance": side_binance, "bybit": side_bybit}
+        }
+        self.events.append({
+            "time": now_s,
+            "type": "ENTRY",
+            "symbol": symbol,
+            "binance_side": side_binance,
+            "bybit_side": side_bybit,
+            "binance_rate": cand['binance_rate'],
+            "bybit_rate": cand['bybit_rate'],
+            "rate_diff": cand['rate_diff'],
+            "price_diff_pct": cand['priceDiff'],
+            "time_to_funding_s": time_to_funding / 1000
+        })
+
+        if session.config["auto_exit"]:
+            wait_seconds, reason = auto_exit_delay(session, time_to_funding)
+            heapq.heappush(self.exits, (now_s + self.entry_delay + wait_seconds, symbol))
+
+    def _exit(self, exit_at, symbol):
+        trade = self.session.active_trades.pop(symbol, None)
+        if trade is None:
+            return
+        event = {"time": exit_at, "type": "EXIT", "symbol": symbol, "held_s": exit_at - trade["entry_time"]}
+        for venue, book in (("binance", self.binance.book), ("bybit", self.bybit.book)):
+            if symbol in book:
+                row = book.index.ids[symbol]
+                event[f"{venue}_rate"] = float(book.funding_rate[row])
+                event[f"{venue}_price"] = float(book.mark_price[row])
+        self.events.append(event)
+
+def format_event(event):
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(event["time"]))
+    if event["type"] == "ENTRY":
+        return (f"{stamp}  ENTRY {event['symbol']:<12} BN:{event['binance_side']:<4} BB:{event['bybit_side']:<4} "
+                f"diff {event['rate_diff'] * 100:.4f}%  price diff {event['price_diff_pct']:.3f}%  "
+                f"funding in {event['time_to_funding_s']:.0f}s")
+    return f"{stamp}  EXIT  {event['symbol']:<12} held {event['held_s']:.0f}s"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded market data through the auto-trade scanner.")
+    parser.add_argument("directory", help="MARKET_DATA_RECORD_DIR of the recording")
+    parser.add_argument("--start", type=float, help="Unix time to start from")
+    parser.add_argument("--end", type=float, help="Unix time to stop at")
+    parser.add_argument("--min-diff", type=float, default=0.01)
+    parser.add_argument("--max-price-diff", type=float, default=2.0)
+    parser.add_argument("--entry-before", type=int, default=60, help="entry_before_seconds")
+    parser.add_argument("--exit-after", type=int, default=30, help="exit_after_seconds")
+    parser.add_argument("--max-trades", type=int, default=1)
+    parser.add_argument("--investment", type=float, default=100.0)
+    parser.add_argument("--leverage", type=int, default=10)
+    parser.add_argument("--ignore-timing", action="store_true")
+    parser.add_argument("--no-auto-exit", action="store_true")
+    parser.add_argument("--json", action="store_true", help="Print events as JSON lines")
+    args = parser.parse_args()
+
+    engine = ReplayEngine({
+        "min_diff": args.min_diff,
+        "max_price_diff": args.max_price_diff,
+        "entry_before_seconds": args.entry_before,
+        "exit_after_seconds": args.exit_after,
+        "max_trades": args.max_trades,
+        "total_investment": args.investment,
+        "leverage": args.leverage,
+        "ignore_timing": args.ignore_timing,
+        "auto_exit": not args.no_auto_exit
+    })
+
+    t0 = time.perf_counter()
+    first = last = None
+    for ts, venue, payload in SegmentReader(args.directory, args.start, args.end):
+        first = ts if first is None else first
+        last = ts
+        engine.feed(ts, venue, payload)
+    engine.finish()
+    elapsed = time.perf_counter() - t0
+
+    for event in engine.events:
+        print(json.dumps(event) if args.json else format_event(event))
+    if not args.json:
+        span = (last - first) if first is not None else 0
+        entries = sum(1 for e in engine.events if e["type"] == "ENTRY")
+        print(f"\n{engine.frames} frames, {span:.0f}s of market data replayed in {elapsed:.1f}s. "
+              f"{entries} entries, {len(engine.events) - entries} exits.")
@@ -0,0 +1,1077 @@
+import asyncio
+import json
+import time
+import zlib
+
+import pytest
+
+import main
+from main import MarketDataHub, BinanceWebSocketManager, BybitWebSocketManager, RateBook, SymbolIndex, compute_spread_table
+
+# -------------------------------------------------------------------
+# MOCK FRAMES
+# -------------------------------------------------------------------
+
+BINANCE_FRAME = json.dumps([
+    {"e": "markPriceUpdate", "s": "BTCUSDT", "p": "50000.00", "r": "0.00010000", "T": 1700000000000},
+    {"e": "markPriceUpdate", "s": "ETHUSDT", "p": "3000.00", "r": "-0.00020000", "T": 1700000000000},
+])
+
+def bybit_frame(msg_type, **data):
+    return json.dumps({"topic": f"tickers.{data['symbol']}", "type": msg_type, "data": data})
+
+def make_hub():
+    hub = MarketDataHub()
+    bn = BinanceWebSocketManager()
+    bb = BybitWebSocketManager()
+    hub.register("binance_live", bn, is_live=True)
+    hub.register("bybit", bb, is_live=True)
+    return hub, bn, bb
+
+# -------------------------------------------------------------------
+# TESTS
+# -------------------------------------------------------------------
+
+def test_binance_frame_is_published_to_hub():
+    hub, bn, _ = make_hub()
+    bn._handle_message(BINANCE_FRAME)
+
+    books = hub.snapshot()
+    assert books["binance_live"]["BTC"]["markPrice"] == 50000.0
+    assert books["binance_live"]["ETH"]["rate"] == -0.0002
+    assert hub.version == 1
+    assert "binance_live" in hub.last_update
+
+def test_bybit_partial_record_is_not_exposed():
+    hub, _, bb = make_hub()
+    bb._handle_message(bybit_frame("delta", symbol="SOLUSDT", markPrice="150.5"))
+    assert "SOL" not in hub.snapshot()["bybit"]
+    assert hub.version == 0
+
+    bb._handle_message(bybit_frame("delta", symbol="SOLUSDT", fundingRate="0.0001", nextFundingTime="1700000000000"))
+    record = hub.snapshot()["bybit"]["SOL"]
+    assert record["markPrice"] == 150.5
+    assert record["rate"] == 0.0001
+    assert record["nextFundingTime"] == 1700000000000
+    assert hub.version == 1
+
+def test_bybit_row_picks_up_interval_loaded_after_it_completed(monkeypatch):
+    _, _, bb = make_hub()
+    monkeypatch.setitem(main.instruments.intervals, "bybit", {})
+    bb._handle_message(bybit_frame("snapshot", symbol="SOLUSDT", markPrice="150", fundingRate="0.0001", nextFundingTime="1700000000000"))
+    assert bb.book.to_payload()["SOL"]["fundingIntervalHours"] == 8
+
+    main.instruments.intervals["bybit"]["SOL"] = 4 # REST load finishes later
+    bb._handle_message(bybit_frame("delta", symbol="SOLUSDT", markPrice="151"))
+    assert bb.book.to_payload()["SOL"]["fundingIntervalHours"] == 4
+
+def test_bybit_rows_pick_up_registry_refresh_without_their_own_ticker(monkeypatch):
+    hub, _, bb = make_hub()
+    registry = main.InstrumentRegistry()
+    registry.replace("bybit", {"SOL": {"fundingIntervalHours": 4}, "ETH": {"fundingIntervalHours": 8}})
+    monkeypatch.setattr(main, "instruments", registry)
+    for symbol in ("SOLUSDT", "ETHUSDT"):
+        bb._handle_message(bybit_frame("snapshot", symbol=symbol, markPrice="150", fundingRate="0.0001", nextFundingTime="1700000000000"))
+    assert bb.book.to_payload()["SOL"]["fundingIntervalHours"] == 4
+
+    # Same-size refresh changes SOL's value; an ETH tick is enough to re-apply it
+    registry.replace("bybit", {"SOL": {"fundingIntervalHours": 2}, "ETH": {"fundingIntervalHours": 8}})
+    cursor = bb.book.seq
+    bb._handle_message(bybit_frame("delta", symbol="ETHUSDT", markPrice="151"))
+    assert bb.book.to_payload()["SOL"]["fundingIntervalHours"] == 2
+    assert set(bb.book.changed_since(cursor)[0]) == {"SOL", "ETH"}
+
+def test_rate_book_rows_align_across_venues():
+    bn = RateBook(SymbolIndex())
+    bb = RateBook(bn.index)
+    bn.update("BTC", 50000.0, 0.0001, 1700000000000, 8)
+    bn.update("ETH", 3000.0, 0.0003, 1700000000000, 8)
+    bb.update("ETH", 3003.0, -0.0001, 1699990000000, 4)
+    bb.update("DOGE", mark_price=0.1) # Incomplete record
+
+    assert len(bn) == 2 and len(bb) == 1
+    assert "DOGE" not in bb
+    assert bb.to_payload() == {"ETH": {"rate": -0.0001, "markPrice": 3003.0, "nextFundingTime": 1699990000000, "fundingIntervalHours": 4}}
+
+    table = compute_spread_table(bn, bb, now_ms=1699980000000)
+    assert table["symbols"] == ["ETH"]
+    assert table["rate_diff"][0] == pytest.approx(0.0004)
+    assert table["price_diff_pct"][0] == pytest.approx(0.1)
+    assert table["time_to_funding"][0] == 10000000
+    assert not table["is_invalid"][0]
+
+def test_rate_book_grows_past_capacity():
+    book = RateBook(SymbolIndex(), capacity=2)
+    for n in range(5):
+        book.update(f"S{n}", 1.0, 0.001, 1, 8)
+    assert len(book) == 5
+    assert book.interval_hours[4] == 8
+
+def test_bybit_universe_is_sharded_without_cap(monkeypatch):
+    monkeypatch.setattr(main, "BYBIT_WS_SHARD_SIZE", 250)
+    bb = BybitWebSocketManager()
+
+    async def no_connect(shard):
+        pass
+    bb._run_shard = no_connect
+
+    asyncio.run(bb._apply_universe([f"C{n}USDT" for n in range(600)]))
+    assert [len(shard.symbols) for shard in bb.shards] == [250, 250, 100]
+
+    # New listings fill the shard with spare room; delistings are dropped, book rows included
+    bb._handle_message(bybit_frame("snapshot", symbol="C0USDT", markPrice="1", fundingRate="0.0001", nextFundingTime="1700000000000"))
+    bb._handle_message(bybit_frame("snapshot", symbol="C1USDT", markPrice="1", fundingRate="0.0001", nextFundingTime="1700000000000"))
+    asyncio.run(bb._apply_universe([f"C{n}USDT" for n in range(1, 602)]))
+    assert sum(len(shard.symbols) for shard in bb.shards) == 601
+    assert len(bb.shards) == 3
+    assert "C0" not in bb.book and "C1" in bb.book
+    assert bb.book.needs_resync(bb.book.reset_seq - 1) # Delta readers resync to drop the row
+
+def test_fast_decoder_matches_legacy_loop(monkeypatch):
+    fast = BinanceWebSocketManager()
+    legacy = BinanceWebSocketManager()
+    legacy.decoder = None
+    registry = main.InstrumentRegistry()
+    registry.replace("binance", {"BTC": {"fundingIntervalHours": 4}})
+    monkeypatch.setattr(main, "instruments", registry)
+
+    frame2 = json.dumps([
+        {"s": "BTCUSDT", "p": "50100.00", "r": "0.00010000", "T": 1700000000000},
+        {"s": "ETHUSDT", "p": "3000.00", "r": "-0.00020000", "T": 1700028800000},
+    ])
+    for frame in (BINANCE_FRAME, frame2):
+        fast._handle_message(frame)
+        legacy._handle_message(frame)
+        assert fast.get_rates() == legacy.get_rates()
+    assert fast.get_rates()["BTC"]["fundingIntervalHours"] == 4
+
+    # Interval cache filled after the stream started is picked up on the next frame
+    registry.add("binance", "ETH", {"fundingIntervalHours": 1})
+    fast._handle_message(frame2)
+    assert fast.get_rates()["ETH"]["fundingIntervalHours"] == 1
+
+    # So is a changed value for a known symbol (same cache size)
+    registry.replace("binance", {"BTC": {"fundingIntervalHours": 8}, "ETH": {"fundingIntervalHours": 1}})
+    fast._handle_message(frame2)
+    assert fast.get_rates()["BTC"]["fundingIntervalHours"] == 8
+
+def test_changed_since_tracks_per_symbol_versions():
+    hub, bn, bb = make_hub()
+    bn._handle_message(BINANCE_FRAME)
+    cursors = hub.versions()
+
+    # Same frame again: nothing changed, nothing published
+    bn._handle_message(BINANCE_FRAME)
+    changes, cursors2 = hub.changed_since(cursors)
+    assert changes["binance_live"] == [] and cursors2 == cursors
+    assert hub.version == 1
+
+    frame = json.dumps([{"s": "ETHUSDT", "p": "3001.00", "r": "-0.00020000", "T": 1700000000000}])
+    bn._handle_message(frame)
+    changes, cursors = hub.changed_since(cursors)
+    assert changes["binance_live"] == ["ETH"]
+    assert changes["bybit"] == []
+
+    bn.book.clear()
+    changes, _ = hub.changed_since(cursors)
+    assert changes["binance_live"] is None
+
+def test_stale_rows_are_flagged_and_quiet_sockets_closed():
+    bn = RateBook(SymbolIndex())
+    bb = RateBook(bn.index)
+    bn.update("BTC", 50000.0, 0.0001, 1700000000000, 8, ts=1000.0)
+    bb.update("BTC", 50010.0, 0.0003, 1700000000000, 8, ts=1000.0)
+    bn.update("ETH", 3000.0, 0.0001, 1700000000000, 8, ts=1000.0)
+    bb.update("ETH", 3001.0, 0.0003, 1700000000000, 8, ts=1030.0)
+
+    assert bb.stale_symbols(now=1031.0, max_age=15) == ["BTC"]
+    table = compute_spread_table(bn, bb, now_ms=1031000, max_age=15)
+    assert table["symbols"] == ["BTC", "ETH"]
+    assert table["is_stale"].tolist() == [True, True] # ETH is stale on the Binance side
+    assert table["data_age"][0] == pytest.approx(31.0)
+
+    class FakeSocket:
+        closed = False
+        async def close(self):
+            self.closed = True
+
+    async def run():
+        bm = BinanceWebSocketManager()
+        bm.ws = socket = FakeSocket()
+        bm.last_message_at = 1000.0
+        bm.check_heartbeat(1010.0, 20)
+        assert bm.ws is socket
+        bm.check_heartbeat(1030.0, 20)
+        await asyncio.sleep(0)
+        assert bm.ws is None and socket.closed
+
+    asyncio.run(run())
+
+def test_bybit_ignores_deltas_until_snapshot_after_reconnect():
+    hub, _, bb = make_hub()
+    shard = bb._start_shard()
+    shard.symbols = ["SOLUSDT", "ETHUSDT"]
+    shard.awaiting = set(shard.symbols)
+    shard.ws = object() # connected, still catching up
+
+    bb._handle_message(bybit_frame("delta", symbol="SOLUSDT", markPrice="1.0"), shard)
+    assert hub.version == 0
+    assert bb.resync_targets() == {"SOL", "ETH"}
+
+    bb._handle_message(bybit_frame("snapshot", symbol="SOLUSDT", markPrice="150.5", fundingRate="0.0001", nextFundingTime="1700000000000"), shard)
+    assert bb.book.to_payload()["SOL"]["markPrice"] == 150.5
+    assert bb.resync_targets() == {"ETH"} and bb.state == main.STREAM_CONNECTING
+
+    bb._handle_message(bybit_frame("snapshot", symbol="ETHUSDT", markPrice="3000", fundingRate="0.0001", nextFundingTime="1700000000000"), shard)
+    assert bb.state == main.STREAM_STREAMING and bb.resync_targets() == set()
+
+def test_rest_resync_reseeds_book_until_streaming(monkeypatch):
+    monkeypatch.setattr(main, "REST_RESYNC_SECONDS", 0)
+    hub, bn, _ = make_hub()
+    calls = []
+
+    async def fetch_snapshot():
+        calls.append(1)
+        if len(calls) == 2:
+            bn.state = main.STREAM_STREAMING # socket caught up mid-fetch: drop this snapshot
+        elif len(calls) == 3:
+            bn.running = False
+        return {"BTC": {"rate": 0.0001, "markPrice": 50000.0 + len(calls), "nextFundingTime": 1700000000000, "fundingIntervalHours": 8}}
+    bn.fetch_snapshot = fetch_snapshot
+    bn.running = True
+
+    async def run():
+        task = asyncio.create_task(main.rest_resync_loop(bn))
+        await asyncio.sleep(0.01)
+        bn.state = main.STREAM_BACKOFF
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(run())
+    assert bn.get_rates()["BTC"]["markPrice"] == 50001.0
+    assert hub.version == 1
+
+def test_backoff_is_jittered_and_capped():
+    backoff = main.Backoff(base=1, cap=8)
+    delays = [backoff.next() for _ in range(10)]
+    assert all(0.5 <= d <= 8 for d in delays)
+    assert delays[0] <= 1
+    backoff.reset()
+    assert backoff.next() <= 1
+
+def test_recorder_writes_rolling_indexed_segments(tmp_path):
+    import gzip, os
+
+    async def run():
+        rec = main.MarketDataRecorder(str(tmp_path), segment_bytes=200)
+        rec.start()
+        rec.record(1, BINANCE_FRAME, 1000.0)
+        rec.record(3, "x" * 10, 1000.5)
+        await asyncio.sleep(0.2)
+        rec.record(3, "y" * 10, 1002.0) # segment is over 200 bytes: rolls and compresses
+        await asyncio.sleep(0.2)
+        await asyncio.gather(*rec.pending)
+        await rec.stop()
+        return rec
+
+    rec = asyncio.run(run())
+    assert rec.written == 3 and rec.dropped == 0 and rec.segments == 2
+    names = sorted(os.listdir(tmp_path))
+    first = [n for n in names if n.endswith(".seg.gz")][0]
+    with gzip.open(tmp_path / first) as f:
+        data = f.read()
+    ts, venue, length = main.RECORD_HEADER.unpack_from(data, 0)
+    assert (ts, venue) == (1000.0, 1)
+    assert data[main.RECORD_HEADER.size:main.RECORD_HEADER.size + length].decode() == BINANCE_FRAME
+
+    # One index entry per second, pointing at the first frame of that second
+    idx = (tmp_path / first.replace(".seg.gz", ".idx")).read_bytes()
+    assert [main.RECORD_INDEX.unpack_from(idx, 0)] == [(1000.0, 0)] and len(idx) == main.RECORD_INDEX.size
+
+def test_recorder_stop_flushes_queue_and_compresses_last_segment(tmp_path):
+    import gzip, os
+
+    async def run():
+        rec = main.MarketDataRecorder(str(tmp_path))
+        rec.start()
+        rec.record(1, "a" * 10, 1000.0)
+        await asyncio.sleep(0.1)
+        rec.record(1, "b" * 10, 1000.5) # Still queued at shutdown
+        # The loop keeps turning while stop() writes and compresses
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+        task = asyncio.create_task(ticker())
+        await rec.stop()
+        task.cancel()
+        assert ticks > 1 and not rec.pending
+        return rec
+
+    rec = asyncio.run(run())
+    assert rec.written == 2
+    names = os.listdir(tmp_path)
+    assert not [n for n in names if n.endswith(".seg")]
+    with gzip.open(tmp_path / [n for n in names if n.endswith(".seg.gz")][0]) as f:
+        data = f.read()
+    assert data.endswith(b"b" * 10)
+
+def test_recorder_drops_instead_of_blocking(tmp_path):
+    async def run():
+        rec = main.MarketDataRecorder(str(tmp_path), queue_size=2)
+        for n in range(5):
+            rec.record(1, "frame", float(n))
+        return rec
+    rec = asyncio.run(run())
+    assert rec.dropped == 3 and rec.queue.qsize() == 2
+
+def test_replay_reproduces_entry_and_exit(tmp_path):
+    from replay import ReplayEngine
+
+    t0 = 1700000000.0
+    nft = int(t0 * 1000) + 40000 # funding 40s after the recording starts
+    rec = main.MarketDataRecorder(str(tmp_path))
+    batch = []
+    for n in range(80):
+        ts = t0 + n
+        batch.append((ts, 1, json.dumps([{"s": "BTCUSDT", "p": "50000.00", "r": "0.00010000", "T": nft}])))
+        batch.append((ts + 0.5, 3, bybit_frame("snapshot", symbol="BTCUSDT", markPrice="50010", fundingRate="-0.0002", nextFundingTime=str(nft))))
+    rec._write_batch(batch)
+    rec.close()
+
+    def run(start=None):
+        engine = ReplayEngine({"min_diff": 0.01, "entry_before_seconds": 60, "exit_after_seconds": 30})
+        for frame in main.SegmentReader(str(tmp_path), start=start):
+            engine.feed(*frame)
+        engine.finish()
+        return engine
+
+    engine = run()
+    assert engine.frames == 160
+    assert [(e["type"], e["symbol"]) for e in engine.events] == [("ENTRY", "BTC"), ("EXIT", "BTC")]
+    entry, exit_ = engine.events
+    assert entry["time"] == t0 + 1 and entry["binance_side"] == "Sell" and entry["bybit_side"] == "Buy"
+    assert exit_["time"] == pytest.approx(t0 + 1 + 3 + 39 + 30)
+    assert run().events == engine.events # deterministic
+
+    # Starting mid-recording skips the earlier frames via the index
+    assert run(start=t0 + 50).frames == 60
+
+def test_lazy_stream_runs_only_while_wanted(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_IDLE_GRACE_SECONDS", 60)
+    hub, bn, bb = make_hub()
+    test_wm = BinanceWebSocketManager()
+    wanted = []
+    hub.register("binance_testnet", test_wm, demand=lambda: bool(wanted), is_live=False)
+    started = []
+    test_wm.start = lambda is_live: (started.append(is_live), setattr(test_wm, "running", True))
+    test_wm.stop = lambda: setattr(test_wm, "running", False)
+    bn.start = bb.start = lambda is_live: None
+
+    async def run():
+        hub.start()
+        hub.watchdog_task.cancel()
+        assert started == [] and "binance_testnet" not in hub.snapshot()
+
+        wanted.append("client")
+        hub._reconcile_demand(time.time())
+        assert started == [False] and "binance_testnet" in hub.snapshot()
+
+        # Reader gone: keeps running through the grace period, then stops
+        wanted.clear()
+        hub._reconcile_demand(time.time() + 30)
+        assert test_wm.running
+        hub._reconcile_demand(time.time() + 61)
+        assert not test_wm.running and "binance_testnet" not in hub.versions()
+
+        hub.touch("binance_testnet") # e.g. a REST poll for testnet rates
+        assert started == [False, False]
+
+    asyncio.run(run())
+
+class FakeClientSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        if self.fail:
+            raise RuntimeError("socket closed")
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def send_bytes(self, data):
+        await self.send_text(data)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+def test_fan_out_isolates_slow_clients(monkeypatch):
+    monkeypatch.setattr(main, "CLIENT_MAX_LAG_SECONDS", 0.3)
+
+    async def run():
+        cm = main.ConnectionManager()
+        fast, slow, dead = FakeClientSocket(), FakeClientSocket(delay=1.0), FakeClientSocket(fail=True)
+        for ws in (fast, slow, dead):
+            await cm.connect(ws)
+
+        for n in range(5):
+            cm.broadcast_snapshot(f"snap{n}")
+            await asyncio.sleep(0.01)
+        await cm.broadcast("log")
+        await asyncio.sleep(0.05)
+
+        # The fast client got everything; the slow one is stuck on snap0 with only the latest snapshot queued
+        assert fast.sent == ["snap0", "snap1", "snap2", "snap3", "snap4", "log"]
+        slow_client = cm.clients[slow]
+        assert slow_client.snapshot == "snap4" and slow_client.coalesced == 3
+
+        # Dead socket is dropped on the next fan-out; the slow client once it is too far behind
+        await asyncio.sleep(0.3)
+        cm.broadcast_snapshot("snap5")
+        await asyncio.sleep(0.01)
+        assert set(cm.clients) == {fast}
+        assert slow.close_code == 1013 and cm.evicted == 2
+        assert cm.stats()["evictions"] == {"socket closed": 1, "lagging": 1}
+        assert cm.stats()["connected"] == 1
+
+    asyncio.run(run())
+
+def test_delta_encoder_sends_changed_fields_only():
+    hub, bn, bb = make_hub()
+    bn._handle_message(BINANCE_FRAME)
+    encoder = main.DeltaEncoder(hub)
+
+    kind, message = encoder.step()
+    snap = json.loads(message.data)
+    assert kind == "snapshot" and snap["seq"] == 1
+    assert set(snap["books"]) == {"binance_live", "bybit"} # each venue once
+    assert snap["books"]["binance_live"]["ETH"]["rate"] == -0.0002
+    assert encoder.step() == (None, None)
+
+    bn._handle_message(json.dumps([{"s": "ETHUSDT", "p": "3001.00", "r": "-0.00020000", "T": 1700000000000}]))
+    bb._handle_message(bybit_frame("snapshot", symbol="ETHUSDT", markPrice="3002", fundingRate="0.0001", nextFundingTime="1700000000000"))
+    kind, message = encoder.step()
+    delta = json.loads(message.data)
+    assert kind == "delta" and delta["seq"] == 2
+    assert delta["books"]["binance_live"] == {"ETH": {"markPrice": 3001.0}}
+    assert delta["books"]["bybit"]["ETH"] == {"rate": 0.0001, "markPrice": 3002.0, "nextFundingTime": 1700000000000, "fundingIntervalHours": 8}
+
+    # Late joiners get a snapshot at the current seq, consistent with the deltas that follow
+    assert json.loads(encoder.snapshot().data)["seq"] == 2
+    assert json.loads(encoder.snapshot().data)["books"]["binance_live"]["ETH"]["markPrice"] == 3001.0
+
+    # A cleared book can't be expressed as a delta: everyone restarts from a snapshot
+    bn.book.clear()
+    kind, message = encoder.step()
+    assert kind == "snapshot" and json.loads(message.data)["books"]["binance_live"] == {}
+
+def test_view_follows_top_spreads_and_reports_removals():
+    hub, bn, bb = make_hub()
+    bn._handle_message(BINANCE_FRAME)
+    for sym in ("BTCUSDT", "ETHUSDT"):
+        bb._handle_message(bybit_frame("snapshot", symbol=sym, markPrice="100", fundingRate="0.0001", nextFundingTime="1700000000000"))
+    view = main.ClientView.from_request(is_live=True, venues="bybit", top_n=1)
+    assert view == main.ClientView("live", ["bybit"], None, 1) and view.streams() == {"bybit": "bybit"}
+
+    def members():
+        books = hub.books()
+        return view.members({"live": main.rank_by_spread(books["binance_live"], books["bybit"])})
+
+    encoder = main.DeltaEncoder(hub, view)
+    kind, message = encoder.step(members())
+    snap = json.loads(message.data)
+    assert kind == "snapshot" and snap["books"] == {"bybit": {"ETH": snap["books"]["bybit"]["ETH"]}}
+
+    # BTC overtakes ETH: it enters with a full record, ETH is listed as removed
+    bb._handle_message(bybit_frame("delta", symbol="BTCUSDT", fundingRate="0.001"))
+    kind, message = encoder.step(members())
+    delta = json.loads(message.data)
+    assert kind == "delta"
+    assert delta["books"]["bybit"]["BTC"]["rate"] == 0.001 and delta["books"]["bybit"]["BTC"]["markPrice"] == 100.0
+    assert delta["removed"] == {"bybit": ["ETH"]}
+
+    # Watchlists filter the full-protocol payload the same way
+    watch = main.ClientView("live", None, ["ethusdt"])
+    payload = json.loads(main.view_message(watch, hub.snapshot(), watch.members({})).data)
+    assert set(payload["live"]["binance"]) == {"ETH"} and set(payload["live"]["bybit"]) == {"ETH"}
+
+def test_frame_is_serialized_once_for_every_encoding(monkeypatch):
+    calls = []
+    real_dump = main.dump_bytes
+    monkeypatch.setattr(main, "dump_bytes", lambda payload: calls.append(1) or real_dump(payload))
+
+    async def run():
+        cm = main.ConnectionManager()
+        sockets = {enc: FakeClientSocket() for enc in main.CLIENT_ENCODINGS}
+        for enc, ws in sockets.items():
+            (await cm.connect(ws)).encoding = enc
+
+        frame = main.BroadcastFrame({"live": {"binance": {"BTC": {"rate": 0.0001}}}})
+        cm.broadcast_snapshot(frame)
+        await asyncio.sleep(0.01)
+
+        assert len(calls) == 1
+        assert sockets["binary"].sent == [frame.data]
+        assert sockets["text"].sent[0] is frame.text # same str object for every text client
+        assert zlib.decompress(sockets["deflate"].sent[0]) == frame.data
+        assert cm.stats()["encodings"] == {"text": 1, "binary": 1, "deflate": 1}
+
+    asyncio.run(run())
+
+def test_broadcaster_pushes_on_change_only(monkeypatch):
+    monkeypatch.setattr(main, "BROADCAST_COALESCE_MS", 20)
+    monkeypatch.setattr(main, "BROADCAST_MAX_HZ", 20)
+    monkeypatch.setattr(main, "BROADCAST_IDLE_SECONDS", 0.2)
+
+    async def run():
+        hub, bn, bb = make_hub()
+        cm = main.ConnectionManager()
+        broadcaster = main.RateBroadcaster(hub, cm)
+        ws = FakeClientSocket()
+        await cm.connect(ws)
+
+        # A new client wakes the broadcaster and gets a full message right away
+        t0 = time.monotonic()
+        await broadcaster.wait()
+        broadcaster.tick()
+        await asyncio.sleep(0.01)
+        assert time.monotonic() - t0 < 0.15 and len(ws.sent) == 1
+
+        # Quiet: the idle re-check sends nothing
+        await broadcaster.wait()
+        broadcaster.tick()
+        await asyncio.sleep(0.01)
+        assert len(ws.sent) == 1
+
+        # A burst of frames goes out as one message, within the coalescing window
+        async def burst():
+            await asyncio.sleep(0.05)
+            bn._handle_message(BINANCE_FRAME)
+            bb._handle_message(bybit_frame("snapshot", symbol="BTCUSDT", markPrice="50010", fundingRate="0.0003", nextFundingTime="1700000000000"))
+        task = asyncio.create_task(burst())
+        t0 = time.monotonic()
+        await broadcaster.wait()
+        broadcaster.tick()
+        await asyncio.sleep(0.01)
+        await task
+        assert 0.05 <= time.monotonic() - t0 < 0.15
+        assert len(ws.sent) == 2
+        payload = json.loads(ws.sent[-1])
+        assert payload["live"]["binance"]["BTC"]["rate"] == 0.0001 and payload["live"]["bybit"]["BTC"]["rate"] == 0.0003
+
+    asyncio.run(run())
+
+def test_compact_encoder_sends_symbol_table_and_positional_rows():
+    hub, bn, bb = make_hub()
+    bn._handle_message(BINANCE_FRAME)
+    encoder = main.CompactEncoder(hub)
+    table = []
+
+    kind, message = encoder.step()
+    snap = json.loads(message.data)
+    table.extend(snap["symbols"])
+    assert kind == "snapshot" and snap["fields"] == list(main.RATE_FIELDS)
+    rows = {table[row[0]]: row[1:] for row in snap["books"]["binance_live"]}
+    assert rows["ETH"] == [-0.0002, 3000.0, 1700000000000, 8]
+    assert b'"markPrice":' not in message.data # key names only once, in "fields"
+
+    # A delta nulls unchanged fields and appends newly interned symbols to the table
+    bn._handle_message(json.dumps([
+        {"s": "ETHUSDT", "p": "3001.00", "r": "-0.00020000", "T": 1700000000000},
+        {"s": "ZZCOMPACTUSDT", "p": "1.50", "r": "0.00050000", "T": 1700000000000},
+    ]))
+    kind, message = encoder.step()
+    delta = json.loads(message.data)
+    table.extend(delta["symbols"])
+    assert kind == "delta" and "ZZCOMPACT" in delta["symbols"]
+    rows = {table[row[0]]: row[1:] for row in delta["books"]["binance_live"]}
+    assert rows == {"ETH": [None, 3001.0, None, None], "ZZCOMPACT": [0.0005, 1.5, 1700000000000, 8]}
+    assert len(table) == len(main.SYMBOLS)
+
+def test_compact_late_joiner_snapshot_keeps_delta_table_in_step():
+    hub, bn, bb = make_hub()
+    bn._handle_message(BINANCE_FRAME)
+    encoder = main.CompactEncoder(hub)
+
+    def extend(table, delta):
+        for i, sym in enumerate(delta["symbols"]):
+            if delta["symbols_from"] + i < len(table):
+                assert table[delta["symbols_from"] + i] == sym
+            else:
+                table.append(sym)
+
+    _, message = encoder.step()
+    a = list(json.loads(message.data)["symbols"]) # Client A: on the delta chain from the start
+    bn._handle_message(json.dumps([{"s": "ETHUSDT", "p": "3001.00", "r": "-0.00020000", "T": 1700000000000}]))
+    _, message = encoder.step()
+    extend(a, json.loads(message.data))
+
+    # A partial Bybit row interns a symbol without changing any book, then client B joins
+    bb._handle_message(bybit_frame("delta", symbol="NEWPARTUSDT", markPrice="1"))
+    b = list(json.loads(encoder.snapshot().data)["symbols"])
+
+    bn._handle_message(json.dumps([{"s": "ZZNEWUSDT", "p": "2.00", "r": "0.00010000", "T": 1700000000000}]))
+    kind, message = encoder.step()
+    delta = json.loads(message.data)
+    assert kind == "delta"
+    for table in (a, b):
+        extend(table, delta)
+        rows = {table[row[0]]: row[1:] for row in delta["books"]["binance_live"]}
+        assert rows["ZZNEW"][1] == 2.0
+    assert a == b == main.SYMBOLS.symbols
+
+def test_opportunity_table_ranks_and_streams_changes(monkeypatch):
+    monkeypatch.setitem(main.instruments.intervals["bybit"], "BTC", 4)
+    hub, bn, bb = make_hub()
+    bn._handle_message(BINANCE_FRAME)
+    bb._handle_message(bybit_frame("snapshot", symbol="BTCUSDT", markPrice="50100", fundingRate="0.0004",
+                                   nextFundingTime="1700000000000"))
+    bb._handle_message(bybit_frame("snapshot", symbol="ETHUSDT", markPrice="3000", fundingRate="-0.0001",
+                                   nextFundingTime="1700000000000"))
+    table = main.OpportunityTable(hub)
+
+    rows = table.top()
+    assert [r["symbol"] for r in rows] == ["BTC", "ETH"]
+    btc = rows[0]
+    assert btc["rate_diff"] == pytest.approx(0.0003)
+    assert btc["interval_mismatch"] is True and btc["bybit_interval"] == 4
+    assert btc["annualized_yield"] == pytest.approx(0.0003 * 6 * 365 * 100) # settles every 4h on Bybit
+    assert btc["price_diff_pct"] == pytest.approx(0.2)
+    assert [r["symbol"] for r in table.top(1, "price_diff_pct")] == ["BTC"]
+
+    # Unchanged books: the spread columns are reused, only the clock fields move
+    version = table.version
+    later = table.top(now_ms=time.time() * 1000 + 1000)
+    assert table.version == version and later[0]["time_to_funding"] < rows[0]["time_to_funding"]
+
+    async def run():
+        cm = main.ConnectionManager()
+        broadcaster = main.RateBroadcaster(hub, cm, {"live": table})
+        ws = FakeClientSocket()
+        client = await cm.connect(ws)
+        cm.set_opportunities(client, 1, "annualized_yield")
+        broadcaster.send_opportunities()
+        broadcaster.send_opportunities() # Same ranking: not resent
+        await asyncio.sleep(0.01)
+        assert len(ws.sent) == 1
+        message = json.loads(ws.sent[0])
+        assert message["op"] == "opportunities" and [r["symbol"] for r in message["rows"]] == ["BTC"]
+        assert "time_to_funding" not in message["rows"][0]
+
+        bb._handle_message(bybit_frame("delta", symbol="ETHUSDT", fundingRate="-0.003"))
+        broadcaster.send_opportunities()
+        await asyncio.sleep(0.01)
+        assert [r["symbol"] for r in json.loads(ws.sent[-1])["rows"]] == ["ETH"]
+
+    asyncio.run(run())
+
+def test_session_channels_push_changes_once_per_session(monkeypatch):
+    monkeypatch.setattr(main, "POSITIONS_POLL_SECONDS", 0.05)
+    fetches = []
+
+    async def fake_fetch_positions(symbol, *keys):
+        fetches.append(symbol)
+        return {"bybit": None, "binance": {"side": "Buy", "size": 1.0, "entryPrice": 100.0, "pnl": 0.0}}
+    monkeypatch.setattr(main, "fetch_positions", fake_fetch_positions)
+
+    async def run():
+        cm = main.ConnectionManager()
+        sessions = main.SessionManager.__new__(main.SessionManager)
+        sessions.sessions = {"u1": main.UserSession("u1", {})}
+        session = sessions.sessions["u1"]
+        channels = main.SessionChannels(cm, sessions)
+
+        tabs = [FakeClientSocket(), FakeClientSocket()]
+        clients = [await cm.connect(ws) for ws in tabs]
+        assert channels.subscribe(clients[0], "session") == "auth required"
+        for client in clients:
+            client.session_id = "u1"
+            assert channels.subscribe(client, "session") is None
+            assert channels.subscribe(client, "positions", "btcusdt") is None
+
+        session.logs.append({"time": 1, "type": "INFO", "msg": "first"})
+        channels.push()
+        channels.push() # Nothing changed: nothing sent
+        await asyncio.sleep(0.02)
+        for ws in tabs:
+            ops = [json.loads(m)["op"] for m in ws.sent]
+            assert sorted(ops) == ["positions", "session", "session_logs"]
+        assert fetches == ["BTC"] # One poller for both tabs
+
+        session.logs.append({"time": 2, "type": "INFO", "msg": "second"})
+        session.active_trades["ETH"] = {"entry_time": 2}
+        channels.push()
+        await asyncio.sleep(0.02)
+        new = [json.loads(m) for m in tabs[0].sent[3:]]
+        assert {m["op"] for m in new} >= {"session", "session_logs"}
+        logs = next(m for m in new if m["op"] == "session_logs")
+        assert [e["msg"] for e in logs["logs"]] == ["second"] and "reset" not in logs
+        # The active-trade change cut the positions poller's sleep short (positions unchanged: not resent)
+        assert len(fetches) == 2 and not any(m["op"] == "positions" for m in new)
+
+        for client in clients:
+            channels.subscribe(client, "positions", on=False)
+        await asyncio.sleep(0.1)
+        assert channels.pollers == {}
+
+    asyncio.run(run())
+
+def test_reaper_pings_then_drops_silent_clients(monkeypatch):
+    monkeypatch.setattr(main, "CLIENT_IDLE_TIMEOUT", 30)
+
+    async def run():
+        cm = main.ConnectionManager()
+        alive, zombie = FakeClientSocket(), FakeClientSocket()
+        alive_client = await cm.connect(alive)
+        await cm.connect(zombie)
+        now = time.time()
+
+        cm.reap(now + 31) # Both silent: probed
+        await asyncio.sleep(0.01)
+        assert json.loads(alive.sent[-1]) == {"op": "ping"} and json.loads(zombie.sent[-1]) == {"op": "ping"}
+
+        cm.heard_from(alive_client) # Its pong
+        alive_client.last_seen = now + 40
+        cm.reap(now + 62)
+        await asyncio.sleep(0.01)
+        assert set(cm.clients) == {alive} and zombie.close_code == 1001
+
+        stats = cm.stats()
+        assert stats["connected_total"] == 2 and stats["reaped"] == 1 and stats["connected"] == 1
+
+    asyncio.run(run())
+
+def test_share_follower_mirrors_owner_books(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "MARKET_DATA_SHARE_HEARTBEAT_SECONDS", 0.05)
+
+    async def run():
+        lock, sock = str(tmp_path / "md.lock"), str(tmp_path / "md.sock")
+        owner_hub, bn, bb = make_hub()
+        follower_hub, fbn, fbb = make_hub()
+        owner = main.MarketDataShare(owner_hub, sock, lock)
+        follower = main.MarketDataShare(follower_hub, sock, lock)
+
+        # Only one worker gets the lock
+        assert owner.try_acquire() and not follower.try_acquire()
+        monkeypatch.setattr(owner_hub, "start", lambda: None) # No exchange connections in tests
+        await owner.become_owner()
+        task = asyncio.create_task(follower.follow())
+
+        bn._handle_message(BINANCE_FRAME)
+        bb._handle_message(bybit_frame("snapshot", symbol="BTCUSDT", markPrice="50010", fundingRate="0.0003", nextFundingTime="1700000000000"))
+        await asyncio.sleep(0.2)
+        assert follower_hub.snapshot()["binance_live"] == owner_hub.snapshot()["binance_live"]
+        assert follower_hub.snapshot()["bybit"]["BTC"]["rate"] == 0.0003
+        assert follower_hub.remote == {"binance_live", "bybit"} # Lazy testnet is idle on the owner
+        assert not follower_hub.is_active("binance_testnet")
+
+        # A cleared owner book clears the follower's (its encoders resync)
+        bn.book.clear()
+        await asyncio.sleep(0.2)
+        assert follower_hub.snapshot()["binance_live"] == {}
+        assert follower.messages > 0 and owner.followers == 1
+
+        # Owner exits: the follower can take over
+        owner.stop()
+        task.cancel()
+        assert follower.try_acquire()
+        follower.stop()
+
+    asyncio.run(run())
+
+def test_follower_never_connects_to_exchanges(monkeypatch):
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(main.market_hub, "following", True)
+    client = TestClient(main.app)
+    assert client.post("/api/ws/start?is_live=true").json()["status"] == "following"
+    assert not main.market_hub.started
+    main.market_hub.started = True # Even a hub marked started leaves lazy streams to the owner
+    main.market_hub.touch("binance_testnet")
+    main.market_hub.started = False
+    assert "binance_testnet" in main.market_hub.last_demand # Still forwarded as demand
+    assert client.post("/api/ws/stop").json()["status"] == "following"
+    assert not any(manager.running for manager, _ in main.market_hub.streams.values())
+
+def test_follower_forwards_auto_trade_requests_to_owner(tmp_path, monkeypatch):
+    from fastapi import FastAPI, Request
+    monkeypatch.setattr(main, "MARKET_DATA_SHARE_HEARTBEAT_SECONDS", 0.05)
+    real_app = main.app
+    owner_app = FastAPI() # Stands in for the owner worker's app (this process can only be one of them)
+
+    @owner_app.post("/api/auto-trade/config")
+    async def config(request: Request):
+        return {"body": await request.json(), "key": request.headers.get("x-user-bybit-key"), "q": request.url.query}
+
+    async def run():
+        lock, sock = str(tmp_path / "md.lock"), str(tmp_path / "md.sock")
+        owner_hub, _, _ = make_hub()
+        follower_hub, _, _ = make_hub()
+        owner = main.MarketDataShare(owner_hub, sock, lock)
+        follower = main.MarketDataShare(follower_hub, sock, lock)
+        monkeypatch.setattr(main, "market_share", follower)
+        async with main.httpx.AsyncClient(transport=main.httpx.ASGITransport(app=real_app), base_url="http://w") as client:
+            # No owner yet: a clean 503 the client can retry
+            r = await client.post("/api/auto-trade/config", json={"enabled": True})
+            assert r.status_code == 503
+
+            assert owner.try_acquire()
+            monkeypatch.setattr(owner_hub, "start", lambda: None) # No exchange connections in tests
+            await owner.become_owner()
+            monkeypatch.setattr(main, "app", owner_app)
+            task = asyncio.create_task(follower.follow())
+            await asyncio.sleep(0.1)
+
+            r = await client.post("/api/auto-trade/config?x=1", json={"enabled": True}, headers={"X-User-Bybit-Key": "k"})
+            assert r.status_code == 200
+            assert r.json() == {"body": {"enabled": True}, "key": "k", "q": "x=1"}
+            assert (await client.get("/api/auto-trade/nope")).status_code == 404 # Owner's answer, passed through
+            assert not follower.calls
+
+            owner.stop()
+            task.cancel()
+
+    asyncio.run(run())
+
+def test_http_pool_reuses_one_client_per_host(monkeypatch):
+    seen = []
+    def handler(request):
+        seen.append((request.method, str(request.url), request.content))
+        return main.httpx.Response(200, json={"retCode": 0})
+    real_client = main.httpx.AsyncClient
+    monkeypatch.setattr(main.httpx, "AsyncClient", lambda **kw: real_client(transport=main.httpx.MockTransport(handler), **kw))
+
+    async def run():
+        pool = main.HTTPPool()
+        r = await pool.get("https://api.bybit.com/v5/market/tickers", params={"category": "linear"})
+        await pool.post("https://api.bybit.com/v5/order/create", content='{"qty": "1"}', timeout=5)
+        await pool.get("https://fapi.binance.com/fapi/v1/premiumIndex")
+        assert r.json() == {"retCode": 0}
+        assert seen[0][1] == "https://api.bybit.com/v5/market/tickers?category=linear"
+        assert seen[1][0] == "POST" and seen[1][2] == b'{"qty": "1"}'
+        assert pool.client("https://api.bybit.com/v5/x") is pool.client("https://api.bybit.com/v5/y")
+        assert pool.stats()["requests"] == {"https://api.bybit.com": 4, "https://fapi.binance.com": 1}
+        await pool.close()
+        assert pool.clients == {}
+
+    asyncio.run(run())
+
+def test_watchdog_flags_blocking_calls_but_not_order_legs(monkeypatch):
+    async def exchange(request):
+        await asyncio.sleep(0.1) # Slow exchange round-trip
+        return main.httpx.Response(200, json={"retCode": 0, "retMsg": "OK", "result": {"orderId": "1"}})
+    real_client = main.httpx.AsyncClient
+    monkeypatch.setattr(main.httpx, "AsyncClient", lambda **kw: real_client(transport=main.httpx.MockTransport(exchange), **kw))
+    monkeypatch.setitem(main.instruments.venues["bybit"], "BTC", {"stepSize": 0.001, "minQty": 0.001, "maxQty": 100, "maxLeverage": 50.0})
+
+    async def run():
+        monkeypatch.setattr(main, "http_pool", main.HTTPPool())
+        watchdog = main.LoopWatchdog(threshold_ms=50, interval=0.01)
+        watchdog.start()
+        await asyncio.sleep(0.05)
+
+        # Both order requests wait on the network without holding the loop
+        result = await main.execute_bybit_logic("key", "secret", "BTC", "Buy", 0.01, 5)
+        assert result["status"] == "success"
+        assert watchdog.blocks == 0
+
+        time.sleep(0.12) # A synchronous call on the loop is caught
+        await asyncio.sleep(0.05)
+        assert watchdog.blocks == 1 and watchdog.max_lag_ms >= 50
+        watchdog.stop()
+        await main.http_pool.close()
+
+    asyncio.run(run())
+
+def test_single_flight_shares_public_requests(monkeypatch):
+    calls = []
+    async def exchange(request):
+        calls.append(str(request.url))
+        await asyncio.sleep(0.05)
+        if request.url.path == "/fapi/v1/fundingInfo":
+            return main.httpx.Response(418, text="banned")
+        if request.url.path == "/fapi/v1/exchangeInfo":
+            return main.httpx.Response(400, json={"code": -1121, "msg": "Invalid symbol."})
+        return main.httpx.Response(200, json=[{"symbol": "BTCUSDT"}])
+    real_client = main.httpx.AsyncClient
+    monkeypatch.setattr(main.httpx, "AsyncClient", lambda **kw: real_client(transport=main.httpx.MockTransport(exchange), **kw))
+
+    async def run():
+        flight = main.SingleFlight(main.HTTPPool(), {"/fapi/v1/premiumIndex": 0.2})
+        url = "https://fapi.binance.com/fapi/v1/premiumIndex"
+        results = await asyncio.gather(*[flight.get(url) for _ in range(5)])
+        assert len(calls) == 1 and all(r.json() is results[0].json() for r in results)
+        await flight.get(url) # Within the TTL
+        assert len(calls) == 1 and flight.stats() == {"fetches": 1, "coalesced": 4, "cache_hits": 1}
+
+        await asyncio.sleep(0.25)
+        await flight.get(url)
+        assert len(calls) == 2
+
+        # Errors are shared with concurrent callers but never cached
+        bad = "https://fapi.binance.com/fapi/v1/fundingInfo"
+        errors = await asyncio.gather(flight.get(bad), flight.get(bad))
+        assert [r.status_code for r in errors] == [418, 418] and errors[0].text == "banned"
+        await flight.get(bad)
+        assert len(calls) == 4
+
+        # A JSON error body stays readable; different headers or timeouts are different calls
+        info = "https://fapi.binance.com/fapi/v1/exchangeInfo"
+        err = await flight.get(info)
+        assert err.status_code == 400 and err.json()["code"] == -1121
+        await asyncio.gather(flight.get(url, headers={"User-Agent": "x"}), flight.get(url, timeout=10))
+        assert len(calls) == 7
+        await flight.pool.close()
+
+    asyncio.run(run())
+
+def test_proxy_serves_cached_gzip_with_etags(monkeypatch):
+    from fastapi.testclient import TestClient
+    calls = []
+    def exchange(request):
+        calls.append(request.url.path)
+        if request.url.path == "/fapi/v1/premiumIndex":
+            return main.httpx.Response(200, json=[{"symbol": "RESTUSDT", "markPrice": "1"}])
+        if len(calls) > 1:
+            return main.httpx.Response(503, text="down")
+        return main.httpx.Response(200, json={"symbols": [{"symbol": f"C{n}USDT", "status": "TRADING"} for n in range(200)]})
+    real_client = main.httpx.AsyncClient
+    monkeypatch.setattr(main.httpx, "AsyncClient", lambda **kw: real_client(transport=main.httpx.MockTransport(exchange), **kw))
+    monkeypatch.setattr(main, "public_api", main.SingleFlight(main.HTTPPool(), {}))
+    monkeypatch.setattr(main, "proxy_cache", main.ProxyCache({**main.PROXY_TTL_SECONDS, "exchangeInfo": 60}))
+    hub, bn, _ = make_hub()
+    monkeypatch.setattr(main, "market_hub", hub)
+    monkeypatch.setattr(main, "binance_live_wm", bn)
+    client = TestClient(main.app)
+
+    r = client.get("/api/binance/fapi/v1/exchangeInfo", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200 and r.headers["content-encoding"] == "gzip"
+    assert len(r.json()["symbols"]) == 200
+    r2 = client.get("/api/binance/fapi/v1/exchangeInfo", headers={"If-None-Match": r.headers["etag"]})
+    assert r2.status_code == 304 and r2.content == b""
+    assert calls == ["/fapi/v1/exchangeInfo"] # Second request never reached Binance
+
+    # premiumIndex comes straight from the live mark-price book
+    bn._handle_message(BINANCE_FRAME)
+    r = client.get("/api/binance/fapi/v1/premiumIndex")
+    rows = {row["symbol"]: row for row in r.json()}
+    assert float(rows["BTCUSDT"]["markPrice"]) == 50000.0 and rows["ETHUSDT"]["nextFundingTime"] == 1700000000000
+    assert len(calls) == 1
+
+    # Once the stream stalls the cached live body is dropped and Binance's REST answer is proxied instead
+    clock = time.time
+    monkeypatch.setattr(main.time, "time", lambda: clock() + 3600)
+    r = client.get("/api/binance/fapi/v1/premiumIndex")
+    monkeypatch.setattr(main.time, "time", clock)
+    assert r.json() == [{"symbol": "RESTUSDT", "markPrice": "1"}]
+    assert calls[-1] == "/fapi/v1/premiumIndex"
+
+    async def run():
+        # Past the refresh-ahead point the cached body is served while a refresh runs; a failed refresh keeps it
+        cache = main.ProxyCache({"fundingInfo": 0.2})
+        calls.clear()
+        first = await cache.get("fundingInfo", "https://fapi.binance.com/fapi/v1/fundingInfo")
+        await asyncio.sleep(0.17)
+        assert await cache.get("fundingInfo", "https://fapi.binance.com/fapi/v1/fundingInfo") is first
+        await asyncio.sleep(0.05)
+        assert len(calls) == 2 and not cache.refreshing
+        assert await cache.get("fundingInfo", "https://fapi.binance.com/fapi/v1/fundingInfo") is first # Expired + Binance down
+
+        # Bodies are serialized and gzipped off the loop; concurrent premiumIndex requests share one build
+        import threading
+        builders = []
+        class RecordingBody(main.ProxyBody):
+            def __init__(self, payload, fetched_at=None):
+                builders.append(threading.get_ident())
+                super().__init__(payload, fetched_at)
+        monkeypatch.setattr(main, "ProxyBody", RecordingBody)
+        bn._handle_message(BINANCE_FRAME)
+        a, b = await asyncio.gather(cache.live_premium_index(bn.book), cache.live_premium_index(bn.book))
+        assert a is b and len(builders) == 1
+        await cache.get("premiumIndex", "https://fapi.binance.com/fapi/v1/premiumIndex")
+        assert len(builders) == 2 and threading.get_ident() not in builders
+
+    asyncio.run(run())
+
+def test_instrument_registry_bulk_loads_pages_and_warm_starts(tmp_path, monkeypatch):
+    def exchange(request):
+        path, params = request.url.path, request.url.params
+        if path == "/fapi/v1/exchangeInfo":
+            return main.httpx.Response(200, json={"symbols": [
+                {"symbol": "BTCUSDT", "status": "TRADING", "quantityPrecision": 3, "filters": [
+                    {"filterType": "PRICE_FILTER", "tickSize": "0.10"},
+                    {"filterType": "LOT_SIZE", "stepSize": "0.001", "minQty": "0.001", "maxQty": "1000"}]},
+                {"symbol": "BTCUSDC", "status": "TRADING", "filters": []}]})
+        if path == "/fapi/v1/fundingInfo":
+            return main.httpx.Response(200, json=[{"symbol": "BTCUSDT", "fundingIntervalHours": 4}])
+        # Bybit: two pages
+        page = {"symbol": "ETHUSDT", "status": "Trading", "fundingInterval": 240, "lotSizeFilter": {"qtyStep": "0.01", "minOrderQty": "0.01", "maxOrderQty": "500"},
+                "priceFilter": {"tickSize": "0.01"}, "leverageFilter": {"maxLeverage": "100.00"}}
+        if params.get("cursor") == "next":
+            return main.httpx.Response(200, json={"retCode": 0, "result": {"list": [{**page, "symbol": "SOLUSDT", "fundingInterval": 480}], "nextPageCursor": ""}})
+        return main.httpx.Response(200, json={"retCode": 0, "result": {"list": [page], "nextPageCursor": "next"}})
+    real_client = main.httpx.AsyncClient
+    monkeypatch.setattr(main.httpx, "AsyncClient", lambda **kw: real_client(transport=main.httpx.MockTransport(exchange), **kw))
+    monkeypatch.setattr(main, "public_api", main.SingleFlight(main.HTTPPool(), {}))
+    path = str(tmp_path / "data" / "instruments.json")
+
+    async def run():
+        registry = main.InstrumentRegistry(path)
+        intervals = registry.intervals["bybit"] # Decoders hold this reference
+        await registry.refresh()
+        btc = registry.get("binance", "BTC")
+        assert btc["stepSize"] == 0.001 and btc["tickSize"] == 0.1 and btc["fundingIntervalHours"] == 4 and btc["status"] == "TRADING"
+        assert registry.get("binance", "BTCUSDC") is None
+        assert set(registry.venues["bybit"]) == {"ETH", "SOL"}
+        eth = registry.get("bybit", "ETH")
+        assert eth["maxLeverage"] == 100.0 and eth["quantityPrecision"] == 2 and intervals == {"ETH": 4, "SOL": 8}
+
+        monkeypatch.setattr(main, "instruments", registry)
+        assert await main.get_bybit_max_leverage("ETHUSDT") == 100.0
+        assert main.instruments.get("bybit", "DOGE") is None
+        assert (await main.get_bybit_instrument("DOGE"))["stepSize"] == 0.01 # New listing fetched once and added
+        assert "DOGE" in registry.venues["bybit"]
+        assert (await main.get_metadata())["BTC"] == {"binance": 4}
+
+    asyncio.run(run())
+
+    # Warm restart: the saved registry is usable before any fetch
+    warm = main.InstrumentRegistry(path)
+    assert warm.load() and warm.get("bybit", "ETH")["minQty"] == 0.01 and warm.intervals["binance"] == {"BTC": 4}
+
+def test_follower_skips_idle_heartbeats_and_refuses_auto_trade(monkeypatch):
+    hub, bn, bb = make_hub()
+    share = main.MarketDataShare(hub, "unused.sock", "unused.lock")
+    row = ["BTC", 0.0001, 50000.0, 1700000000000, 8, time.time()]
+    share.apply({"active": ["binance_live"], "books": {"binance_live": {"reset": False, "rows": [row], "stale": []}}})
+    version = hub.version
+    share.apply({"active": ["binance_live"], "books": {"binance_live": {"reset": False, "rows": [], "stale": []}}})
+    assert hub.version == version # Nothing new: broadcasters stay asleep
+    share.apply({"active": ["binance_live"], "books": {"binance_live": {"reset": False, "rows": [], "stale": ["BTC"]}}})
+    assert hub.version == version + 1
+
+    # Sessions only run in the owner: a follower refuses auto-trade requests and the session channel
+    monkeypatch.setattr(main, "market_share", share)
+    with pytest.raises(main.HTTPException) as err:
+        main.require_trading_worker()
+    assert err.value.status_code == 503
+
+    async def run():
+        cm = main.ConnectionManager()
+        channels = main.SessionChannels(cm, None)
+        client = await cm.connect(FakeClientSocket())
+        client.session_id = "u1"
+        assert channels.subscribe(client, "session") == "session runs in another worker"
+        assert channels.subscribe(client, "positions", "BTC") is None # Exchange-backed: fine on any worker
+        for task in channels.pollers.values():
+            task.cancel()
+
+    asyncio.run(run())
+    share.owner = True
+    main.require_trading_worker()
@@ -73,6 +73,30 @@ const fetchRatesWithFailover = async (isLive) => {
 };
 
 const BINANCE_API = "/api/binance/fapi/v1/premiumIndex";
+// Shared decoder for binary WS frames
+const textDecoder = new TextDecoder();
+
+// protocol "compact": rows are [symbolId, rate, markPrice, nextFundingTime, fundingIntervalHours], null = unchanged.
+// Expands a compact snapshot/delta into the delta protocol's { name -> { symbol -> fields } } shape.
+const COMPACT_FIELDS = ["rate", "markPrice", "nextFundingTime", "fundingIntervalHours"];
+const expandCompact = (payload, symbols) => {
+  const books = {};
+  Object.entries(payload.books).forEach(([name, rows]) => {
+    const book = books[name] = {};
+    rows.forEach(([id, ...values]) => {
+      const fields = {};
+      values.forEach((value, i) => {
+        if (value !== null) fields[COMPACT_FIELDS[i]] = value;
+      });
+      book[symbols[id]] = fields;
+    });
+  });
+  const removed = {};
+  Object.entries(payload.removed || {}).forEach(([name, ids]) => {
+    removed[name] = ids.map(id => symbols[id]);
+  });
+  return { ...payload, books, removed };
+};
 // Using the all-pairs ticker endpoint for comprehensive data, targeting coinswitch.co directly
 const COINSWITCH_API_URL = "https://coinswitch.co/trade/api/v2/24hr/all-pairs/ticker?exchange=coinswitchx";
 
@@ -280,6 +304,7 @@ function App() {
 
       // Step 1: Fetch current to ensure we don't overwrite
       const statusRes = await fetch(`${primary}/api/auto-trade/status`);
+      if (!statusRes.ok) throw new Error(`Status request failed (${statusRes.status})`);
       const statusData = await statusRes.json();
       const currentConfig = statusData.config;
 
@@ -311,11 +336,15 @@ function App() {
       if (cKey) headers["X-User-Bybit-Key"] = cKey;
       if (cSecret) headers["X-User-Bybit-Secret"] = cSecret;
 
-      await fetch(`${primary}/api/auto-trade/config`, {
+      const res = await fetch(`${primary}/api/auto-trade/config`, {
         method: "POST",
         headers: headers,
         body: JSON.stringify(updatedConfig)
       });
+      if (!res.ok) {
+        const data = await res.json().catch(() => ({}));
+        throw new Error(data.detail || `Config request failed (${res.status})`);
+      }
 
       toast.toast({
         title: newState ? "Auto-Bet STARTED 🚀" : "Auto-Bet STOPPED 🛑",
@@ -326,7 +355,7 @@ function App() {
     } catch (e) {
       console.error("Toggle Failed", e);
       setGlobalAutoTrade(!globalAutoTrade); // Revert
-      toast.toast({ title: "Error", description: "Failed to toggle Auto-Bet", variant: "destructive" });
+      toast.toast({ title: "Error", description: `Failed to toggle Auto-Bet: ${e.message}`, variant: "destructive" });
     }
   };
 
@@ -679,6 +708,9 @@ function App() {
   const [usingFallback, setUsingFallback] = useState(true); // Default to True until WS connects
   const wsRef = useRef(null);
   const isLiveRef = useRef(isLive); // Track current mode for WS handler
+  const booksRef = useRef(null); // Delta protocol: { binance_live, binance_testnet, bybit } as of seqRef
+  const seqRef = useRef(0);
+  const symbolsRef = useRef([]); // Compact protocol: symbol id -> symbol
 
   // Keep isLiveRef in sync
   useEffect(() => {
@@ -714,6 +746,7 @@ function App() {
       }
 
       const ws = new WebSocket(wsUrl);
+      ws.binaryType = 'arraybuffer'; // encoding "binary": rate frames arrive as UTF-8 JSON bytes
       wsRef.current = ws;
 
       ws.onopen = () => {
@@ -721,7 +754,9 @@ function App() {
         setUsingFallback(false);
 
         // 1. Send INIT message to identify mode (Resubscribe equivalent)
-        ws.send(JSON.stringify({ op: "init", is_live: isLive }));
+        // protocol "compact": one full snapshot, then only changed symbols/fields, as positional rows
+        booksRef.current = null;
+        ws.send(JSON.stringify({ op: "init", is_live: isLive, protocol: "compact", encoding: "binary" }));
 
         // 2. Start Heartbeat (Every 5s)
         if (pingInterval) clearInterval(pingInterval);
@@ -738,16 +773,67 @@ function App() {
           // (Not strictly needed with Dual Stream but keeps UI cleaner during reset)
           // if (modeSwitchingRef.current) return;
 
-          const payload = JSON.parse(event.data);
+          const text = typeof event.data === 'string' ? event.data : textDecoder.decode(event.data);
+          const payload = JSON.parse(text);
 
           // Handle PONG
           if (payload.op === 'pong') {
             return;
           }
+          // Server heartbeat: answer or the backend reaps this socket as dead
+          if (payload.op === 'ping') {
+            ws.send(JSON.stringify({ op: "pong" }));
+            return;
+          }
+
+          const currentIsLive = isLiveRef.current;
+
+          // DELTA / COMPACT PROTOCOL: keep our own copy of the books and patch it
+          if (payload.op === 'snapshot' || payload.op === 'delta') {
+            if (payload.op === 'snapshot') {
+              if (Array.isArray(payload.symbols)) symbolsRef.current = payload.symbols;
+              const message = Array.isArray(payload.symbols) ? expandCompact(payload, symbolsRef.current) : payload;
+              booksRef.current = message.books;
+              seqRef.current = payload.seq;
+            } else {
+              if (!booksRef.current) return; // Waiting for the resync snapshot
+              if (payload.seq !== seqRef.current + 1) {
+                // Missed a delta: drop our copy and ask for a fresh snapshot
+                console.log(`WS seq gap (${seqRef.current} -> ${payload.seq}), resyncing`);
+                booksRef.current = null;
+                ws.send(JSON.stringify({ op: "resync" }));
+                return;
+              }
+              let message = payload;
+              if (Array.isArray(payload.symbols)) {
+                // Entries from symbols_from on; a table already longer (joined on a later snapshot) gets the same values
+                payload.symbols.forEach((sym, i) => { symbolsRef.current[payload.symbols_from + i] = sym; });
+                message = expandCompact(payload, symbolsRef.current);
+              }
+              Object.entries(message.books).forEach(([name, changes]) => {
+                const book = booksRef.current[name] || (booksRef.current[name] = {});
+                Object.entries(changes).forEach(([sym, fields]) => {
+                  book[sym] = { ...book[sym], ...fields };
+                });
+              });
+              // Symbols that left a top-N / watchlist view
+              Object.entries(message.removed || {}).forEach(([name, syms]) => {
+                const book = booksRef.current[name];
+                if (book) syms.forEach(sym => { delete book[sym]; });
+              });
+              seqRef.current = payload.seq;
+            }
+
+            const books = booksRef.current;
+            const binanceBook = currentIsLive ? books.binance_live : books.binance_testnet;
+            if (binanceBook && books.bybit) {
+              processRatesData(binanceBook, books.bybit);
+            }
+            return;
+          }
 
           // DUAL STREAM: Payload contains both live and testnet
           // We simply pick the one matching our local state
-          const currentIsLive = isLiveRef.current;
 
           let targetData = null;
           if (currentIsLive) {
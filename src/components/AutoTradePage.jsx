@@ -7,6 +7,7 @@ import { Switch } from "@/components/ui/switch";
 import { Badge } from "@/components/ui/badge";
 import { ScrollArea } from "@/components/ui/scroll-area";
 import { useToast } from "@/components/ui/toast";
+import { subscribeChannel, isChannelOpen } from "@/lib/sessionSocket";
 import { Play, Square, Activity, Settings, TrendingUp, Save, Zap, Clock, Terminal, Trash2, RefreshCcw, AlertTriangle } from "lucide-react";
 
 // Compact Input Helper - Moved OUTSIDE to prevent re-creation on render
@@ -113,6 +114,9 @@ export function AutoTradePage({ topOpportunities = [], allMarketData = [], isLiv
                     logs: data.logs.reverse(),
                     pending_opportunities: data.pending_opportunities || []
                 });
+            } else if (res.status === 503 && shouldUpdateConfig) {
+                // Auto-trade worker briefly unavailable (another worker taking over): retry so the config still loads
+                setTimeout(() => fetchStatus(true), 1000);
             }
         } catch (e) {
             console.error("Status fetch failed", e);
@@ -121,8 +125,28 @@ export function AutoTradePage({ topOpportunities = [], allMarketData = [], isLiv
 
     useEffect(() => {
         fetchStatus(true);
-        const interval = setInterval(() => fetchStatus(false), 2000);
-        return () => clearInterval(interval);
+        // Status and new log entries are pushed on the "session" channel as they happen
+        const unsubscribe = subscribeChannel(getBackendUrl(), "session", (msg) => {
+            if (msg.op === "session") {
+                setStatus(prev => ({
+                    ...prev,
+                    active_trades: msg.status.active_trades,
+                    active_positions: msg.status.active_positions || [],
+                    pending_opportunities: msg.status.pending_opportunities || []
+                }));
+            } else if (msg.op === "session_logs") {
+                const entries = [...msg.logs].reverse();
+                setStatus(prev => ({ ...prev, logs: msg.reset ? entries : [...entries, ...prev.logs].slice(0, 50) }));
+            }
+        });
+        // REST polling only while the channel is unavailable
+        const interval = setInterval(() => {
+            if (!isChannelOpen(getBackendUrl(), "session")) fetchStatus(false);
+        }, 2000);
+        return () => {
+            unsubscribe();
+            clearInterval(interval);
+        };
     }, []);
 
     // Sync isLive prop with config state when it changes (from header toggle)
@@ -159,10 +183,15 @@ export function AutoTradePage({ topOpportunities = [], allMarketData = [], isLiv
                 if (localStorage.getItem("user_bybit_demo_secret")) headers["X-User-Bybit-Secret"] = localStorage.getItem("user_bybit_demo_secret");
             }
 
-            await fetch(`${getBackendUrl()}/api/auto-trade/trade/${symbol}?close_on_exchange=true`, {
+            const res = await fetch(`${getBackendUrl()}/api/auto-trade/trade/${symbol}?close_on_exchange=true`, {
                 method: 'DELETE',
                 headers: headers
             });
+            if (!res.ok) {
+                const data = await res.json().catch(() => ({}));
+                toast.error(`Remove failed: ${data.detail || res.status}`);
+                return;
+            }
 
             // Optimistic update
             setStatus(prev => ({
@@ -206,7 +235,7 @@ export function AutoTradePage({ topOpportunities = [], allMarketData = [], isLiv
             if (res.ok) {
                 toast.success(`Exit simulated for ${symbol}`);
             } else {
-                const data = await res.json();
+                const data = await res.json().catch(() => ({}));
                 toast.error(`Simulation failed: ${data.detail || "Unknown error"}`);
             }
         } catch (e) {
@@ -288,7 +317,9 @@ export function AutoTradePage({ topOpportunities = [], allMarketData = [], isLiv
                 setConfig(data.config);
                 if (!isAutoSave) toast.success("Settings Saved");
             } else {
-                if (!isAutoSave) toast.error("Save Failed");
+                const data = await res.json().catch(() => ({}));
+                // Auto-saves fail silently otherwise, so an unsaved change is always reported
+                toast.error(`Save Failed: ${data.detail || res.status}`);
             }
         } catch (e) {
             if (!isAutoSave) toast.error(e.message);
@@ -5,6 +5,7 @@ import { Card, CardHeader, CardTitle, CardContent } from "@/components/ui/card";
 import { X, Play, RefreshCw, AlertTriangle, TrendingUp, TrendingDown, Clock, Timer, CheckCircle2 } from "lucide-react";
 import { Badge } from "@/components/ui/badge";
 import { Switch } from "@/components/ui/switch";
+import { subscribeChannel, isChannelOpen } from "@/lib/sessionSocket";
 
 export function DemoTradingModal({ isOpen, onClose, data }) {
     const [platform, setPlatform] = useState("BYBIT"); // BYBIT | BINANCE | ARBITRAGE
@@ -64,30 +65,40 @@ export function DemoTradingModal({ isOpen, onClose, data }) {
     const [backendTasks, setBackendTasks] = useState({});
 
     useEffect(() => {
+        const applyTasks = (data) => {
+            setBackendTasks(data.tasks);
+
+            // Sync UI Status
+            const tasks = Object.values(data.tasks);
+            if (tasks.length > 0) {
+                const latest = tasks.sort((a, b) => b.created_at - a.created_at)[0];
+                if (latest.status.includes("WAITING")) setSchedulerStatus("WAITING");
+                else if (latest.status.includes("EXECUTING")) setSchedulerStatus("EXECUTING");
+                else if (latest.status === "COMPLETED") setSchedulerStatus("COMPLETED");
+                else if (latest.status.startsWith("FAILED")) setSchedulerStatus("FAILED");
+            }
+        };
         const pollTasks = async () => {
             try {
                 const { primary } = getBackendUrl();
                 const res = await fetch(`${primary}/api/scheduled-tasks`);
                 if (res.ok) {
-                    const data = await res.json();
-                    setBackendTasks(data.tasks);
-
-                    // Sync UI Status
-                    const tasks = Object.values(data.tasks);
-                    if (tasks.length > 0) {
-                        const latest = tasks.sort((a, b) => b.created_at - a.created_at)[0];
-                        if (latest.status.includes("WAITING")) setSchedulerStatus("WAITING");
-                        else if (latest.status.includes("EXECUTING")) setSchedulerStatus("EXECUTING");
-                        else if (latest.status === "COMPLETED") setSchedulerStatus("COMPLETED");
-                        else if (latest.status.startsWith("FAILED")) setSchedulerStatus("FAILED");
-                    }
+                    applyTasks(await res.json());
                 }
             } catch (e) {
                 // Silent fail on poll
             }
         };
-        const interval = setInterval(pollTasks, 2000); // 2s polling
-        return () => clearInterval(interval);
+        // Task transitions are pushed on the "scheduler" channel; poll only while its socket is down
+        const { primary } = getBackendUrl();
+        const unsubscribe = subscribeChannel(primary, "scheduler", applyTasks);
+        const interval = setInterval(() => {
+            if (!isChannelOpen(primary)) pollTasks();
+        }, 2000);
+        return () => {
+            unsubscribe();
+            clearInterval(interval);
+        };
     }, []);
 
 
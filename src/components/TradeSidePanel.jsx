@@ -3,6 +3,7 @@ import { X, Settings, Wallet, CheckCircle2, Calculator, TrendingUp, TrendingDown
 import { Button } from "@/components/ui/button";
 import { useToast } from "@/components/ui/toast";
 import { cn } from "@/lib/utils";
+import { subscribeChannel, isChannelOpen } from "@/lib/sessionSocket";
 import {
     Dialog,
     DialogContent,
@@ -308,10 +309,20 @@ export function TradeSidePanel({ isOpen, onClose, data, onExecute }) {
     };
 
     useEffect(() => {
-        if (isOpen) {
+        if (isOpen && symbol) {
             fetchPositions();
-            const interval = setInterval(fetchPositions, 5000); // Poll positions
-            return () => clearInterval(interval);
+            // Positions are pushed on the "positions" channel (one backend poller per session and symbol)
+            const backendUrl = getBackendUrl();
+            const unsubscribe = subscribeChannel(backendUrl, "positions", (msg) => {
+                if (msg.symbol === symbol.toUpperCase().replace("USDT", "")) setPositions(msg.positions);
+            }, { symbol });
+            const interval = setInterval(() => {
+                if (!isChannelOpen(backendUrl)) fetchPositions();
+            }, 5000);
+            return () => {
+                unsubscribe();
+                clearInterval(interval);
+            };
         }
     }, [isOpen, symbol]);
 
@@ -0,0 +1,97 @@
+// Shared /ws/clients connection for the per-session channels ("session", "scheduler", "positions").
+// Components subscribe with a handler instead of polling the REST endpoints; while the socket is down
+// they fall back to REST (see isChannelOpen).
+
+// Server ops delivered to each channel's handlers
+const CHANNEL_OPS = {
+    session: ["session", "session_logs"],
+    scheduler: ["scheduler"],
+    positions: ["positions"],
+};
+
+const sockets = {}; // backend URL -> { ws, open, retry, subscribers, rejected }
+
+// Same keys the REST calls send as X-User-* headers
+const authMessage = () => ({
+    op: "auth",
+    bybit_key: localStorage.getItem("user_bybit_key") || null,
+    bybit_secret: localStorage.getItem("user_bybit_secret") || null,
+    binance_key: localStorage.getItem("user_binance_key") || null,
+    binance_secret: localStorage.getItem("user_binance_secret") || null,
+});
+
+const connect = (baseUrl) => {
+    const entry = sockets[baseUrl];
+    // protocol "none": this socket only carries channel events, never rate broadcasts
+    const ws = new WebSocket(baseUrl.replace(/\/$/, "").replace(/^http/, "ws") + "/ws/clients?protocol=none");
+    entry.ws = ws;
+
+    ws.onopen = () => {
+        entry.open = true;
+        entry.rejected = new Set();
+        ws.send(JSON.stringify(authMessage()));
+        entry.subscribers.forEach(sub => ws.send(JSON.stringify(sub.request)));
+    };
+
+    ws.onmessage = (event) => {
+        if (typeof event.data !== "string") return;
+        let msg;
+        try {
+            msg = JSON.parse(event.data);
+        } catch {
+            return;
+        }
+        // Server heartbeat: answer or the backend reaps this socket as dead
+        if (msg.op === "ping") {
+            ws.send(JSON.stringify({ op: "pong" }));
+            return;
+        }
+        // The server refused a channel (e.g. "session" on a worker that doesn't trade): callers poll REST instead
+        if (msg.op === "channel" && msg.status === "error") {
+            entry.rejected.add(msg.channel);
+            return;
+        }
+        entry.subscribers.forEach(sub => {
+            if (CHANNEL_OPS[sub.request.channel].includes(msg.op)) sub.onEvent(msg);
+        });
+    };
+
+    ws.onclose = () => {
+        entry.open = false;
+        if (sockets[baseUrl] === entry && entry.subscribers.size) {
+            entry.retry = setTimeout(() => connect(baseUrl), 3000);
+        }
+    };
+};
+
+// Subscribes `onEvent` to a channel; returns the unsubscribe function.
+export const subscribeChannel = (baseUrl, channel, onEvent, params = {}) => {
+    if (!sockets[baseUrl]) {
+        sockets[baseUrl] = { ws: null, open: false, retry: null, subscribers: new Set(), rejected: new Set() };
+        connect(baseUrl);
+    }
+    const entry = sockets[baseUrl];
+    const sub = { request: { op: "channel", channel, ...params }, onEvent };
+    entry.subscribers.add(sub);
+    if (entry.open) entry.ws.send(JSON.stringify(sub.request));
+
+    return () => {
+        entry.subscribers.delete(sub);
+        if (!entry.subscribers.size) {
+            clearTimeout(entry.retry);
+            delete sockets[baseUrl];
+            entry.ws.close();
+            return;
+        }
+        const stillWanted = [...entry.subscribers].some(s => s.request.channel === channel);
+        if (entry.open && !stillWanted) {
+            entry.ws.send(JSON.stringify({ op: "channel", channel, on: false }));
+        }
+    };
+};
+
+// False while the socket is down, or if the server refused `channel` on it
+export const isChannelOpen = (baseUrl, channel) => {
+    const entry = sockets[baseUrl];
+    return Boolean(entry && entry.open && !(channel && entry.rejected.has(channel)));
+};